@@ -48,6 +48,7 @@ def run_benchmark(df, model):
             row["feed"], model, file_mapping[row["feed"]]["distance_unit"], allow_viz
         )
         agent.reset()  # Ensure chat history is cleared
+        agent.profile_code = st.session_state.profile_code
         result = agent.run_workflow(
             row["question"], allow_retry, summarize=False, task=row["task"]
         )
@@ -84,6 +85,7 @@ def run_benchmark(df, model):
                 "llm_response": str(result["main_response"]),
                 "execution_time": result["execution_time"],
                 "token_usage": result["token_usage"],
+                "profile": result["profile"],
             }
         )
         # time.sleep(5)
@@ -188,6 +190,7 @@ def main():
     with st.sidebar.expander("Benchmark Settings"):
         st.sidebar.checkbox("Allow Visualization", value=False, key="allow_viz")
         st.sidebar.checkbox("Allow Retry", value=False, key="allow_retry")
+        st.sidebar.checkbox("Profile Code", value=False, key="profile_code")
     if st.sidebar.button("Run Benchmark"):
         # Clear the main screen
         with st.spinner(f"Running benchmark for {model}..."):
@@ -1,22 +1,47 @@
+import os
 import sys
+import ctypes
 import traceback
 import re
 import _pickle as cPickle
 import gzip
 import threading
-import copy
+import queue
 import warnings
-from typing import Dict, Any
+import multiprocessing
+from typing import Dict, Any, Optional
+import math
+import signal
+import time
 import psutil
 import gc
 import streamlit as st
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 ## For Evals
-from evaluator.eval_imports import import_namespace
+from evaluator.eval_imports import BASE_NAMESPACE, eval_namespace, load_namespace
 
 # Custom Imports
-from utils.constants import TIMEOUT_SECONDS
+from utils.constants import (
+    TIMEOUT_SECONDS,
+    EVAL_BUDGET_FULL_ROWS,
+    EVAL_BUDGET_MIN_SECONDS,
+    EVAL_WORKERS,
+    EVAL_WORKER_WAIT_SECONDS,
+    EVAL_CPU_MARGIN_SECONDS,
+    EVAL_MEMORY_MB,
+    REWRITE_GENERATED_CODE,
+)
 from prompts.generate_prompt import generate_system_prompt
+from gtfs_agent.feed_store import load_feed_artifact, feed_memory_report
+from gtfs_agent.gtfs_loader import feed_view, stop_time_rows
+from evaluator.result_cache import EvalResultCache, code_key, feed_version
+from evaluator.line_profile import LineProfiler
+from evaluator.rewrite_code import rewrite_code
 
 warnings.filterwarnings("ignore")
 
@@ -26,25 +51,376 @@ def load_zipped_pickle(filename: str) -> Any:
         return cPickle.load(f)
 
 
+@st.cache_resource(ttl=3600, show_spinner="Loading GTFS feed...")
+def load_artifact(directory: str) -> Any:
+    return load_feed_artifact(directory)
+
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def load_eval_pool(location: str) -> Optional["EvalWorkerPool"]:
+    """One worker pool per feed, shared by every session evaluating against it"""
+    if EVAL_WORKERS < 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    loader = load_artifact(location) if os.path.isdir(location) else load_zipped_pickle(location)
+    return EvalWorkerPool(loader.feed, EVAL_WORKERS)
+
+
+@st.cache_resource(show_spinner=False)
+def load_result_cache() -> EvalResultCache:
+    """One result cache per app, so sessions asking the same question share it"""
+    return EvalResultCache()
+
+
+class CodeExecutionError(Exception):
+    """An error raised by generated code in a worker process, already formatted"""
+
+
+class ExecutionBudgetExceeded(BaseException):
+    """
+    Raised inside generated code running in a thread, or being profiled in
+    a worker, once its execution budget is spent. Not an Exception, so the
+    `except Exception` blocks generated code is full of do not swallow it.
+    """
+
+
+class CPUBudgetExceeded(ExecutionBudgetExceeded):
+    """Raised inside generated code running in a worker once it used its CPU seconds"""
+
+
+def _raise_budget_exceeded(signum, frame):
+    raise ExecutionBudgetExceeded()
+
+
+def _raise_cpu_budget_exceeded(signum, frame):
+    raise CPUBudgetExceeded()
+
+
+def _cpu_limit_error(cpu_seconds: Optional[float]) -> CodeExecutionError:
+    """The error of code stopped at its CPU time limit"""
+    return CodeExecutionError(
+        f"Error Type: CPUTimeLimitExceeded\nError Message: Code execution used more than {cpu_seconds} CPU seconds\n"
+    )
+
+
+def execution_budget(feed, timeout_seconds: int = TIMEOUT_SECONDS) -> int:
+    """
+    Seconds generated code may run against feed: timeout_seconds for feeds
+    of EVAL_BUDGET_FULL_ROWS stop_times rows or more, proportionally less for
+    smaller ones, but at least EVAL_BUDGET_MIN_SECONDS.
+    """
+    share = stop_time_rows(feed) / EVAL_BUDGET_FULL_ROWS
+    return math.ceil(min(timeout_seconds, max(EVAL_BUDGET_MIN_SECONDS, timeout_seconds * share)))
+
+
+def detailed_error_info(error: Exception, code: str) -> str:
+    """
+    Get detailed error information including the full traceback and relevant code snippet.
+    Must be called while handling `error`.
+    """
+    exc_type, exc_value, exc_traceback = sys.exc_info()
+    tb = traceback.extract_tb(exc_traceback)
+
+    # Find the last frame that refers to our code
+    relevant_frame = next(
+        (frame for frame in reversed(tb) if frame.filename == "<string>"), None
+    )
+
+    if relevant_frame:
+        line_no = relevant_frame.lineno
+        code_lines = code.split("\n")
+        start_line = max(0, line_no - 3)
+        end_line = min(len(code_lines), line_no + 2)
+        relevant_code = "\n".join(
+            f"{i+1}: {line}"
+            for i, line in enumerate(code_lines[start_line:end_line])
+        )
+    else:
+        relevant_code = "Unable to locate relevant code snippet"
+
+    error_info = [
+        f"Error Type: {exc_type.__name__}",
+        f"Error Message: {str(error)}",
+        "Relevant Code:",
+        relevant_code + "\n",
+    ]
+
+    return "\n".join(error_info)
+
+
+def _limit_worker(cpu_seconds: Optional[float], memory_mb: Optional[float]):
+    """Apply an evaluation's CPU time and memory limits to this worker process"""
+    if resource is None:
+        return
+    if cpu_seconds:
+        # SIGXCPU stops the code once it has used cpu_seconds, so the worker
+        # can still send its usage and profile; the hard limit a second later
+        # kills it if the code is stuck in a long C call
+        signal.signal(signal.SIGXCPU, _raise_cpu_budget_exceeded)
+        limit = max(1, math.ceil(cpu_seconds))
+        resource.setrlimit(resource.RLIMIT_CPU, (limit, limit + 1))
+    if memory_mb:
+        # On top of the address space inherited from the app process, so
+        # allocations beyond it raise MemoryError in the generated code
+        limit = psutil.Process().memory_info().vms + int(memory_mb * 2**20)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_usage(cpu_start: float = 0.0) -> Dict[str, float]:
+    """CPU seconds used since cpu_start and peak RSS in MiB of this process"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    peak = usage.ru_maxrss / 2**20 if sys.platform == "darwin" else usage.ru_maxrss / 2**10
+    return {"cpu_seconds": usage.ru_utime + usage.ru_stime - cpu_start, "peak_rss_mb": peak}
+
+
+def _eval_worker(conn, feed):
+    """
+    Body of a pool worker: run one piece of code against the feed inherited
+    from the parent within the given limits, and send back ("result", value,
+    usage, profile) or ("error", message, usage, profile). When profiling,
+    the code is stopped at its timeout by SIGALRM and ("timeout", None, usage,
+    profile) sent back, so the profile is not lost with the killed worker.
+    Code over its CPU time limit is stopped by SIGXCPU the same way and
+    ("cpu_limit", None, usage, profile) sent back.
+    Errors and profiles show the lines of source, the code as generated.
+    """
+    try:
+        code, source, cpu_seconds, memory_mb, profile_seconds = conn.recv()
+    except EOFError:
+        # The pool was dropped before using this worker
+        return
+    _limit_worker(cpu_seconds, memory_mb)
+    cpu_start = _worker_usage()["cpu_seconds"]
+    nm = eval_namespace(feed)
+    profiler = LineProfiler(source) if profile_seconds else None
+    try:
+        if profiler is None:
+            exec(code, nm)
+        else:
+            signal.signal(signal.SIGALRM, _raise_budget_exceeded)
+            signal.setitimer(signal.ITIMER_REAL, profile_seconds)
+            with profiler:
+                exec(code, nm)
+        reply = ("result", nm.get("result"))
+    except CPUBudgetExceeded:
+        reply = ("cpu_limit", None)
+    except ExecutionBudgetExceeded:
+        reply = ("timeout", None)
+    except BaseException as e:
+        reply = ("error", detailed_error_info(e, source))
+    finally:
+        if profiler is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    usage = _worker_usage(cpu_start)
+    profile = profiler.results() if profiler is not None else None
+    try:
+        conn.send((*reply, usage, profile))
+    except Exception as e:
+        conn.send(("error", f"Error Type: {type(e).__name__}\nError Message: The result could not be returned from the worker: {e}\n", usage, profile))
+    conn.close()
+
+
+def _killed_worker_usage(worker) -> Dict[str, Optional[float]]:
+    """Usage of a worker that did not reply, read before it is reaped"""
+    usage = {"cpu_seconds": None, "peak_rss_mb": None}
+    try:
+        process = psutil.Process(worker.pid)
+        times = process.cpu_times()
+        usage["cpu_seconds"] = times.user + times.system
+        # A worker that already exited reports no memory
+        usage["peak_rss_mb"] = process.memory_info().rss / 2**20 or None
+        # Linux also reports the high-water mark
+        with open(f"/proc/{worker.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    usage["peak_rss_mb"] = int(line.split()[1]) / 2**10
+    except (psutil.Error, OSError, ValueError):
+        pass
+    return usage
+
+
+class EvalWorkerPool:
+    """
+    Pre-forked worker processes that run generated code against one feed.
+
+    Workers are forked from the process holding the fully loaded feed, so each one
+    sees the feed through fork copy-on-write instead of a deep copy, and the
+    parent's feed is never touched by generated code. A worker runs a single
+    evaluation and exits, so changes it makes to the feed never reach the next
+    one; a replacement is forked while it runs. A worker that times out is
+    killed, so runaway code stops using CPU.
+
+    The pool keeps `size` workers forked: workers found dead are dropped, and
+    workers that could not be forked, e.g. for lack of memory, are forked
+    again on the next run.
+    """
+
+    def __init__(self, feed, size: int = EVAL_WORKERS):
+        self.feed = feed
+        self.size = size
+        self.context = multiprocessing.get_context("fork")
+        self.idle = queue.Queue()
+        # Workers forked and not yet taken by a run
+        self.forked = 0
+        self.lock = threading.Lock()
+        # Import the evaluation libraries and read every table of a lazy feed
+        # (see LazyFeed) once here rather than in every worker, which would
+        # each decode the tables it touches again and throw them away
+        load_namespace(BASE_NAMESPACE)
+        if hasattr(feed, "load_all"):
+            feed.load_all()
+        self._refill()
+
+    def _fork_worker(self):
+        parent_conn, child_conn = self.context.Pipe()
+        try:
+            worker = self.context.Process(target=_eval_worker, args=(child_conn, self.feed), daemon=True)
+            worker.start()
+        except BaseException:
+            parent_conn.close()
+            raise
+        finally:
+            child_conn.close()
+        self.idle.put((worker, parent_conn))
+
+    def _refill(self):
+        """Fork workers until `size` are forked, as far as the system allows"""
+        while True:
+            with self.lock:
+                if self.forked >= self.size:
+                    return
+                self.forked += 1
+            try:
+                self._fork_worker()
+            except OSError as e:
+                with self.lock:
+                    self.forked -= 1
+                print(f"Could not fork a code execution worker: {e}")
+                return
+
+    def _take_worker(self, wait_seconds: float):
+        """
+        An idle live worker and its connection, waiting up to wait_seconds.
+
+        Raises:
+            CodeExecutionError: If no worker became idle in time
+        """
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            self._refill()
+            try:
+                worker, conn = self.idle.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise CodeExecutionError(
+                    f"Error Type: WorkerUnavailable\nError Message: No code execution worker became available within {wait_seconds} seconds\n"
+                )
+            with self.lock:
+                self.forked -= 1
+            if worker.is_alive():
+                return worker, conn
+            # Died while idle, e.g. killed by the system; the next pass replaces it
+            conn.close()
+            worker.join()
+
+    def run(
+        self,
+        code: str,
+        timeout_seconds: int = TIMEOUT_SECONDS,
+        cpu_seconds: Optional[float] = None,
+        memory_mb: Optional[float] = EVAL_MEMORY_MB,
+        usage: Optional[Dict[str, Any]] = None,
+        profile: Optional[list] = None,
+        source: Optional[str] = None,
+    ) -> Any:
+        """
+        Run code in an idle worker and return its `result` variable.
+
+        Args:
+            code (str): The code to run
+            timeout_seconds (int): Wall clock limit, the worker is killed after it
+            cpu_seconds (float, optional): CPU time limit of the worker, by
+                default timeout_seconds plus EVAL_CPU_MARGIN_SECONDS
+            memory_mb (float, optional): Memory the code may allocate
+            usage (dict, optional): Filled with the `cpu_seconds` and `peak_rss_mb`
+                the worker used
+            profile (list, optional): When given, the code is profiled line by
+                line and the list filled with its profile, see LineProfiler
+            source (str, optional): The code as generated, shown in errors and
+                profiles when code is a rewrite of it with the same lines
+
+        Raises:
+            TimeoutError: If the code did not finish within timeout_seconds
+            CodeExecutionError: If the code raised, with the formatted error, or
+                no worker became idle within EVAL_WORKER_WAIT_SECONDS
+        """
+        usage = {} if usage is None else usage
+        if cpu_seconds is None:
+            # Single-threaded code reaches the wall clock limit first
+            cpu_seconds = timeout_seconds + EVAL_CPU_MARGIN_SECONDS
+        worker, conn = self._take_worker(EVAL_WORKER_WAIT_SECONDS)
+        try:
+            profile_seconds = timeout_seconds if profile is not None else None
+            try:
+                conn.send((code, source or code, cpu_seconds, memory_mb, profile_seconds))
+            except OSError as e:
+                raise CodeExecutionError(
+                    f"Error Type: WorkerExit\nError Message: The code could not be sent to the code execution process: {e}\n"
+                )
+            finally:
+                # Replace the worker while it runs, off the critical path
+                self._refill()
+            # A profiled worker stops the code itself, give it time to send the profile
+            grace_seconds = 5 if profile is not None else 0
+            if not conn.poll(timeout_seconds + grace_seconds):
+                usage.update(_killed_worker_usage(worker))
+                raise TimeoutError(f"Code execution timed out after {timeout_seconds} seconds")
+            try:
+                status, value, worker_usage, worker_profile = conn.recv()
+                usage.update(worker_usage)
+                if worker_profile is not None:
+                    profile.extend(worker_profile)
+            except EOFError:
+                usage.update(_killed_worker_usage(worker))
+                worker.join()
+                # Killed at the hard CPU limit while stuck in a C call
+                cpu_used = usage.get("cpu_seconds")
+                if worker.exitcode == -signal.SIGXCPU or (
+                    worker.exitcode == -signal.SIGKILL and cpu_seconds and cpu_used is not None and cpu_used >= cpu_seconds
+                ):
+                    raise _cpu_limit_error(cpu_seconds)
+                raise CodeExecutionError(
+                    f"Error Type: WorkerExit\nError Message: The code execution process exited with code {worker.exitcode}\n"
+                )
+        finally:
+            # A worker that replied has nothing left to do, one that timed out is stopped
+            conn.close()
+            worker.kill()
+            worker.join()
+        if status == "timeout":
+            raise TimeoutError(f"Code execution timed out after {timeout_seconds} seconds")
+        if status == "cpu_limit":
+            raise _cpu_limit_error(cpu_seconds)
+        if status == "error":
+            raise CodeExecutionError(value)
+        return value
+
+    def close(self):
+        """Stop the idle workers"""
+        while not self.idle.empty():
+            worker, conn = self.idle.get_nowait()
+            conn.close()
+            worker.kill()
+            worker.join()
+
+
 class PropagatingThread(threading.Thread):
     def run(self):
         self.exc = None
         self.ret = None
         try:
-            # Set CPU affinity to use only 80% of available cores
-            process = psutil.Process()
-            num_cores = psutil.cpu_count()
-            cores_to_use = max(1, int(num_cores * 0.8))  # Use 80% of cores, minimum 1
-            # On Windows/Linux, use the first N cores
-            available_cores = list(range(cores_to_use))
-            process.cpu_affinity(available_cores)
-            
             self.ret = self._target(*self._args, **self._kwargs)
         except BaseException as e:
             self.exc = e
-        finally:
-            # Reset CPU affinity to use all cores
-            process.cpu_affinity(list(range(psutil.cpu_count())))
 
     def join(self, timeout=None):
         super().join(timeout)
@@ -52,6 +428,21 @@ class PropagatingThread(threading.Thread):
             raise self.exc
         return self.ret
 
+    def interrupt(self, grace_seconds: float = 1.0) -> bool:
+        """
+        Raise ExecutionBudgetExceeded in the thread, and again until it ends or
+        grace_seconds pass, in case the code catches it. Python code stops at
+        its next bytecode; a long call into C (e.g. a pandas kernel) only once
+        it returns. Returns whether the thread ended.
+        """
+        deadline = time.monotonic() + grace_seconds
+        while self.is_alive() and time.monotonic() < deadline:
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                ctypes.c_ulong(self.ident), ctypes.py_object(ExecutionBudgetExceeded)
+            )
+            super().join(0.05)
+        return not self.is_alive()
+
 
 class GTFS_Eval:
     def __init__(self, file_mapping: Dict[str, Dict[str, str]]):
@@ -61,8 +452,20 @@ class GTFS_Eval:
         self.system_prompt = None
         self.distance_unit = None
         self.allow_viz = None
-        # Initialize loader dictionary with lowercase keys and pickle file locations
-        self.loaders = {key.lower(): value["pickle_loc"] for key, value in self.file_mapping.items()}
+        self.pool = None
+        self.feed_version = None
+        self.budget_seconds = None
+        self.result_cache = load_result_cache()
+        # Initialize loader dictionary with lowercase keys and feed locations,
+        # preferring the columnar artifact over the pickled loader when built
+        self.loaders = {
+            key.lower(): (
+                value["artifact_loc"]
+                if os.path.isdir(value.get("artifact_loc") or "")
+                else value.get("pickle_loc")
+            )
+            for key, value in self.file_mapping.items()
+        }
 
 
     def __getstate__(self):
@@ -80,8 +483,16 @@ class GTFS_Eval:
             # Force garbage collection before loading new feed
             gc.collect()
             self.gtfs = GTFS
+        if os.path.isdir(current_loader):
+            return load_artifact(current_loader)
         return load_zipped_pickle(current_loader)
 
+    def feed_memory_report(self):
+        """Mapped memory of the memory-mapped feeds, see feed_store.mapped_memory"""
+        return feed_memory_report(
+            {name: loc for name, loc in self.loaders.items() if os.path.isdir(loc or "")}
+        )
+
     def get_system_prompt(self, GTFS, distance_unit, allow_viz):
         if (
             self.system_prompt is None
@@ -90,18 +501,53 @@ class GTFS_Eval:
             or self.allow_viz != allow_viz
         ):
             self.current_loader = self.load_current_feed(GTFS)
+            self.pool = load_eval_pool(self.loaders.get(GTFS.lower()))
+            self.feed_version = feed_version(self.loaders.get(GTFS.lower()))
+            self.budget_seconds = execution_budget(self.current_loader.feed)
             self.distance_unit = distance_unit
             self.allow_viz = allow_viz
             # Generate the system prompt
             self.system_prompt = generate_system_prompt(self.current_loader, allow_viz)
         return self.system_prompt
 
-    def evaluate(self, code: str, timeout_seconds: int = TIMEOUT_SECONDS) -> Dict[str, Any]:
+    def evaluate(
+        self,
+        code: str,
+        timeout_seconds: Optional[int] = None,
+        cpu_seconds: Optional[float] = None,
+        memory_mb: Optional[float] = EVAL_MEMORY_MB,
+        use_cache: bool = True,
+        profile: bool = False,
+        rewrite: bool = REWRITE_GENERATED_CODE,
+    ) -> Dict[str, Any]:
         """
         Evaluates the given code and returns the result.
+
+        Each evaluation is limited to timeout_seconds of wall clock time, by
+        default the feed's execution budget (see execution_budget), and in a
+        worker process also to cpu_seconds of CPU time, by default the budget
+        plus EVAL_CPU_MARGIN_SECONDS, and memory_mb of memory. Code over its budget is stopped: a worker is killed, and code
+        in a thread is interrupted (see PropagatingThread.interrupt). The CPU seconds and peak RSS (MiB, including the feed pages the
+        worker shares with the app) it used are returned next to `eval_success`;
+        the thread path reports only CPU seconds, as its memory is the app's.
+
+        Successful results are cached by code and feed version, see
+        result_cache.code_key. A cached result is returned without running the
+        code, with `cache_hit` set and no usage or rewrites; use_cache=False
+        always runs it.
+
+        With profile=True the code always runs, traced line by line, and its
+        per-line wall time, hits and allocations are returned as `profile`,
+        slowest line first, also when it times out (see LineProfiler).
+
+        With rewrite=True slow pandas patterns in the code are rewritten into
+        equivalent faster calls before it runs, and the others warned about,
+        as `rewrites` and `performance_warnings` (see rewrite_code). Errors and
+        profiles still refer to the lines of the code as generated.
         """
         # Extract executable code from the input
         executable_code = re.findall(r"```python\n(.*?)```", code, re.DOTALL)
+        usage = {"cpu_seconds": None, "peak_rss_mb": None}
 
         # For text only responses
         if not executable_code:
@@ -110,41 +556,59 @@ class GTFS_Eval:
                 "eval_success": False,
                 "error_message": None,
                 "only_text": True,
+                "cache_hit": False,
+                "profile": None,
+                "rewrites": [],
+                "performance_warnings": [],
+                **usage,
             }
 
         code = executable_code[0]
-        nm = {
-            **globals(),
-            **import_namespace,
-            "feed": copy.deepcopy(self.current_loader.feed),
-        }  # Deep copy of feed
+        timeout_seconds = timeout_seconds or self.budget_seconds or TIMEOUT_SECONDS
+        line_profile = [] if profile else None
+        key = code_key(code, self.feed_version) if use_cache and not profile and self.feed_version else None
+        cached_result = self.result_cache.get(key)
+        if cached_result is not None:
+            return {
+                "code_output": cached_result,
+                "eval_success": True,
+                "error_message": None,
+                "only_text": False,
+                "cache_hit": True,
+                "profile": None,
+                "rewrites": [],
+                "performance_warnings": [],
+                **usage,
+            }
 
-        try:
+        # Only code that runs is rewritten
+        rewritten_code, rewrites, performance_warnings = rewrite_code(code) if rewrite else (code, [], [])
 
-            def execute_code():
-                global execution_result
-                exec(code, nm)
-                execution_result = nm.get("result")
-                # Force garbage collection after execution
-                gc.collect()
-
-            thread = PropagatingThread(target=execute_code)
-            thread.daemon = True
-            thread.start()
-            thread.join(timeout=timeout_seconds)
-            # Keep gc.collect() here to ensure cleanup even if execute_code() times out
-            gc.collect()
-            if thread.is_alive():
-                raise TimeoutError(f"Code execution timed out after {timeout_seconds} seconds")
+        try:
+            if self.pool is not None:
+                # A pre-forked worker sees the feed copy-on-write
+                execution_result = self.pool.run(
+                    rewritten_code, timeout_seconds, cpu_seconds, memory_mb, usage, line_profile, source=code
+                )
+            else:
+                execution_result = self._evaluate_in_thread(
+                    rewritten_code, timeout_seconds, usage, line_profile, source=code
+                )
             if execution_result is None:
                 raise Exception(
                     "Code execution did not return a result. Please ensure the `result` variable is assigned"
                 )
+            self.result_cache.put(key, execution_result)
             return {
                 "code_output": execution_result,
                 "eval_success": True,
                 "error_message": None,
                 "only_text": False,
+                "cache_hit": False,
+                "profile": line_profile,
+                "rewrites": rewrites,
+                "performance_warnings": performance_warnings,
+                **usage,
             }
 
         except TimeoutError as te:
@@ -154,6 +618,24 @@ class GTFS_Eval:
                 "eval_success": False,
                 "error_message": f"TimeoutError: {str(te)}",
                 "only_text": False,
+                "cache_hit": False,
+                "profile": line_profile,
+                "rewrites": rewrites,
+                "performance_warnings": performance_warnings,
+                **usage,
+            }
+
+        except CodeExecutionError as e:
+            return {
+                "code_output": None,
+                "eval_success": False,
+                "error_message": str(e),
+                "only_text": False,
+                "cache_hit": False,
+                "profile": line_profile,
+                "rewrites": rewrites,
+                "performance_warnings": performance_warnings,
+                **usage,
             }
 
         except Exception as e:
@@ -163,40 +645,68 @@ class GTFS_Eval:
                 "eval_success": False,
                 "error_message": error_message,
                 "only_text": False,
+                "cache_hit": False,
+                "profile": line_profile,
+                "rewrites": rewrites,
+                "performance_warnings": performance_warnings,
+                **usage,
             }
 
-    def _get_detailed_error_info(self, error: Exception, code: str) -> str:
+    def _evaluate_in_thread(
+        self,
+        code: str,
+        timeout_seconds: int,
+        usage: Dict[str, Any],
+        profile: Optional[list] = None,
+        source: Optional[str] = None,
+    ) -> Any:
         """
-        Get detailed error information including the full traceback and relevant code snippet.
+        Run code in a thread of this process against a view of the feed,
+        for platforms without fork or when EVAL_WORKERS is 0. Only the wall
+        clock limit applies, CPU and memory limits need a worker process.
+        A profile shows the lines of source, see EvalWorkerPool.run.
         """
-        exc_type, exc_value, exc_traceback = sys.exc_info()
-        tb = traceback.extract_tb(exc_traceback)
+        # Tables are copied on first access, see feed_view
+        nm = eval_namespace(feed_view(self.current_loader.feed))
 
-        # Find the last frame that refers to our code
-        relevant_frame = next(
-            (frame for frame in reversed(tb) if frame.filename == "<string>"), None
-        )
+        profiler = LineProfiler(source or code) if profile is not None else None
 
-        if relevant_frame:
-            line_no = relevant_frame.lineno
-            code_lines = code.split("\n")
-            start_line = max(0, line_no - 3)
-            end_line = min(len(code_lines), line_no + 2)
-            relevant_code = "\n".join(
-                f"{i+1}: {line}"
-                for i, line in enumerate(code_lines[start_line:end_line])
-            )
-        else:
-            relevant_code = "Unable to locate relevant code snippet"
+        def execute_code():
+            cpu_start = time.thread_time()
+            try:
+                if profiler is None:
+                    exec(code, nm)
+                else:
+                    with profiler:
+                        exec(code, nm)
+            finally:
+                usage["cpu_seconds"] = time.thread_time() - cpu_start
+                if profiler is not None:
+                    profile.extend(profiler.results())
+            # Force garbage collection after execution
+            gc.collect()
+            return nm.get("result")
 
-        error_info = [
-            f"Error Type: {exc_type.__name__}",
-            f"Error Message: {str(error)}",
-            "Relevant Code:",
-            relevant_code + "\n",
-        ]
+        # The result comes back on this call's thread, never through shared state
+        thread = PropagatingThread(target=execute_code)
+        thread.daemon = True
+        thread.start()
+        execution_result = thread.join(timeout=timeout_seconds)
+        if thread.is_alive():
+            # Stop the code rather than let it run on in the background,
+            # holding its copies of the feed's tables
+            if not thread.interrupt():
+                print("Timed out code is still running in a library call, it stops once that returns")
+            # Keep gc.collect() here to free what the interrupted code held
+            gc.collect()
+            raise TimeoutError(f"Code execution timed out after {timeout_seconds} seconds")
+        return execution_result
 
-        return "\n".join(error_info)
+    def _get_detailed_error_info(self, error: Exception, code: str) -> str:
+        """
+        Get detailed error information including the full traceback and relevant code snippet.
+        """
+        return detailed_error_info(error, code)
 
     def reset(self):
         """
@@ -206,6 +716,8 @@ class GTFS_Eval:
         self.gtfs = None
         self.system_prompt = None
         self.distance_unit = None
+        self.feed_version = None
+        self.budget_seconds = None
         # Force garbage collection after reset
         gc.collect()
         print("GTFS_Eval instance has been reset.")
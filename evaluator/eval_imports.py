@@ -1,61 +1,144 @@
 # Imports for Evals
+import builtins
 import datetime
+import importlib
 import time
+import types
 import pytz
-import geopy
-import folium
 import geopandas as gpd
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import plotly
-import plotly.express as px
 import shapely
 import streamlit as st
 from shapely.geometry import LineString, Point, Polygon
-from thefuzz import process, fuzz
-from tqdm import tqdm
-from stqdm import stqdm
-from utils.find_stops import (
-    get_geo_location,
-    find_stops_by_full_name,
-    find_stops_by_street,
-    find_stops_by_intersection,
-    find_nearby_stops,
-    find_stops_by_address,
-    find_route,
-)
+from gtfs_agent.gtfs_loader import active_service_ids, active_trips
+from evaluator import rewrite_code
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is imported on first attribute access, so
+    libraries only generated code uses do not slow down every process that
+    imports the evaluator. It is not registered in sys.modules.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_module"] = None
+
+    def _load(self) -> types.ModuleType:
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+class LazyAttribute:
+    """Stand-in for a function or class of a module, imported on first use"""
+
+    def __init__(self, module: str, name: str):
+        self.__dict__.update(_module=module, _name=name, _target=None)
+
+    def _load(self):
+        if self._target is None:
+            self.__dict__["_target"] = getattr(importlib.import_module(self._module), self._name)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
 
-# Create a dictionary for namespace with imported modules
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy {self._module}.{self._name}>"
+
+
+def resolve(value):
+    """The module, function or class behind a lazy stand-in, or value itself"""
+    return value._load() if isinstance(value, (LazyModule, LazyAttribute)) else value
+
+
+def load_namespace(namespace: dict):
+    """
+    Import everything the lazy stand-ins in namespace refer to, e.g. before
+    forking workers that would otherwise each import them again.
+    """
+    for value in namespace.values():
+        resolve(value)
+
+
+FIND_STOPS_FUNCTIONS = [
+    "get_geo_location",
+    "find_stops_by_full_name",
+    "find_stops_by_street",
+    "find_stops_by_intersection",
+    "find_nearby_stops",
+    "find_departures",
+    "next_departures",
+    "trip_stop_times",
+    "find_stops_by_address",
+    "find_route",
+]
+
+# Create a dictionary for namespace with imported modules. Libraries the app
+# already imports are used directly, the rest are imported on first use
 import_namespace = {
     "datetime": datetime,
     "time": time,
     "pytz": pytz,
-    "geopy": geopy,
-    "folium": folium,
+    "geopy": LazyModule("geopy"),
+    "folium": LazyModule("folium"),
     "gpd": gpd,
-    "matplotlib": matplotlib,
-    "plt": plt,
+    "matplotlib": LazyModule("matplotlib"),
+    "plt": LazyModule("matplotlib.pyplot"),
     "np": np,
     "pd": pd,
     "plotly": plotly,
-    "px": px,
+    "px": LazyModule("plotly.express"),
     "shapely": shapely,
     "LineString": LineString,
     "Point": Point,
     "Polygon": Polygon,
-    "process": process,
-    "fuzz": fuzz,
-    "tqdm": tqdm,
-    "stqdm": stqdm,
-    "get_geo_location": get_geo_location,
-    "find_stops_by_full_name": find_stops_by_full_name,
-    "find_stops_by_street": find_stops_by_street,
-    "find_stops_by_intersection": find_stops_by_intersection,
-    "find_nearby_stops": find_nearby_stops,
-    "find_stops_by_address": find_stops_by_address,
-    "find_route": find_route,
+    "process": LazyModule("thefuzz.process"),
+    "fuzz": LazyModule("thefuzz.fuzz"),
+    "tqdm": LazyAttribute("tqdm", "tqdm"),
+    "stqdm": LazyAttribute("stqdm", "stqdm"),
+    **{name: LazyAttribute("utils.find_stops", name) for name in FIND_STOPS_FUNCTIONS},
+    "active_service_ids": active_service_ids,
+    "active_trips": active_trips,
     "st": st,
     "result": None,
 }
+
+# The namespace every evaluation starts from, built once per process and
+# read-only. Code rewritten by rewrite_code.rewrite_code reaches its helpers
+# by RUNTIME_NAME
+BASE_NAMESPACE = types.MappingProxyType(
+    {"__builtins__": dict(vars(builtins)), **import_namespace, rewrite_code.RUNTIME_NAME: rewrite_code}
+)
+
+
+def eval_namespace(feed) -> dict:
+    """
+    Globals for one evaluation: a shallow copy of BASE_NAMESPACE holding
+    `feed`. Names the code binds, `result` and builtins included, stay in
+    this copy.
+
+    A plain dict rather than a chained mapping, so global lookups in the
+    generated code keep Python's fast path for dict globals.
+    """
+    namespace = BASE_NAMESPACE.copy()
+    namespace["__builtins__"] = namespace["__builtins__"].copy()
+    namespace["feed"] = feed
+    return namespace
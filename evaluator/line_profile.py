@@ -0,0 +1,125 @@
+import sys
+import time
+import threading
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from utils.constants import PROFILE_TOP_LINES
+
+# Profiles tracing memory, so tracemalloc started for them is stopped with the last
+_memory_lock = threading.Lock()
+_memory_profiles = 0
+_started_tracemalloc = False
+
+
+class LineProfiler:
+    """
+    Per-line wall time, hits and allocations of generated code run with
+    `with LineProfiler(code):` in the current thread.
+
+    Only lines of the code itself (compiled as `filename`) are timed; time
+    spent in library calls counts towards the line making them. Allocations
+    are the bytes traced by tracemalloc that a line added, which is started
+    if it is not tracing already and stopped when the last profile started
+    meanwhile ends. tracemalloc traces the whole process, so while profiles
+    run in several threads at once, as in the thread path of GTFS_Eval,
+    their allocation figures include those of the other threads.
+
+    Tracing makes Python-heavy code, such as loops over rows, two to three
+    times slower, so it is only used when a profile is asked for.
+    """
+
+    def __init__(self, code: str, filename: str = "<string>", trace_memory: bool = True):
+        self.code_lines = code.split("\n")
+        self.filename = filename
+        self.trace_memory = trace_memory
+        self.seconds = defaultdict(float)
+        self.hits = defaultdict(int)
+        self.allocated = defaultdict(int)
+        self.line = None
+        self.line_start = 0.0
+        self.line_memory = 0
+
+    def __enter__(self) -> "LineProfiler":
+        global _memory_profiles, _started_tracemalloc
+        if self.trace_memory:
+            with _memory_lock:
+                if _memory_profiles == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _started_tracemalloc = True
+                _memory_profiles += 1
+        self.line_start = time.perf_counter()
+        sys.settrace(self._trace)
+        return self
+
+    def __exit__(self, *exc_info):
+        global _memory_profiles, _started_tracemalloc
+        sys.settrace(None)
+        self._tick(None)
+        if self.trace_memory:
+            with _memory_lock:
+                _memory_profiles -= 1
+                if _memory_profiles == 0 and _started_tracemalloc:
+                    tracemalloc.stop()
+                    _started_tracemalloc = False
+        return False
+
+    def _memory(self) -> int:
+        return tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+
+    def _tick(self, line, hit: bool = True):
+        """Charge the time and memory since the last tick to the current line, then move to line"""
+        now, memory = time.perf_counter(), self._memory()
+        if self.line is not None:
+            self.seconds[self.line] += now - self.line_start
+            self.allocated[self.line] += max(0, memory - self.line_memory)
+        if line is not None and hit:
+            self.hits[line] += 1
+        self.line, self.line_start, self.line_memory = line, now, memory
+
+    def _trace(self, frame, event, arg):
+        # Library frames are not traced line by line
+        if frame.f_code.co_filename != self.filename:
+            return None
+        return self._trace_lines
+
+    def _trace_lines(self, frame, event, arg):
+        if event == "line":
+            self._tick(frame.f_lineno)
+        elif event == "return" and frame.f_back is not None:
+            caller = frame.f_back
+            if caller.f_code.co_filename == self.filename:
+                # Back in the line that called this function
+                self._tick(caller.f_lineno, hit=False)
+        return self._trace_lines
+
+    def results(self) -> List[Dict[str, Any]]:
+        """
+        The profile, slowest line first.
+
+        Returns:
+            list: One dict per line with `line`, `code`, `hits`, `seconds`
+                and `allocated_mb`
+        """
+        rows = [
+            {
+                "line": line,
+                "code": self.code_lines[line - 1].strip() if 0 < line <= len(self.code_lines) else "",
+                "hits": self.hits[line],
+                "seconds": self.seconds[line],
+                "allocated_mb": self.allocated[line] / 2**20,
+            }
+            for line in self.seconds
+        ]
+        return sorted(rows, key=lambda row: row["seconds"], reverse=True)
+
+
+def format_hot_lines(profile: List[Dict[str, Any]], top: int = PROFILE_TOP_LINES) -> str:
+    """The top lines of a LineProfiler profile as text, for the retry prompt and logs"""
+    total = sum(row["seconds"] for row in profile) or 1.0
+    return "\n".join(
+        f"Line {row['line']}: {row['seconds']:.2f} s ({row['seconds'] / total:.0%}), "
+        f"{row['hits']} hits, {row['allocated_mb']:.1f} MiB allocated: {row['code']}"
+        for row in profile[:top]
+    )
@@ -0,0 +1,133 @@
+import os
+import ast
+import time
+import hashlib
+import threading
+import _pickle as cPickle
+from collections import OrderedDict
+from typing import Any, Optional
+
+from utils.constants import EVAL_CACHE_TTL_SECONDS, EVAL_CACHE_MAX_MB
+
+# Calls whose value changes between runs of the same code, such as
+# `datetime.now()` or `np.random.choice(...)`; code making them is never cached
+NONDETERMINISTIC_CALLS = {
+    "now",
+    "today",
+    "utcnow",
+    "time",
+    "time_ns",
+    "perf_counter",
+    "random",
+    "rand",
+    "randn",
+    "randint",
+    "choice",
+    "shuffle",
+    "sample",
+    "uuid4",
+}
+
+
+def feed_version(location: str) -> str:
+    """
+    Version of the feed stored at location, a pickled loader or an artifact
+    directory. Built from the path, size and modification time of its files,
+    so it changes whenever the feed is rebuilt without reading the feed itself.
+    """
+    if os.path.isdir(location):
+        paths = sorted(os.path.join(location, name) for name in os.listdir(location))
+    else:
+        paths = [location]
+    digest = hashlib.sha256(os.path.abspath(location).encode())
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def code_key(code: str, version: str) -> Optional[str]:
+    """
+    Cache key of code run against the feed at version, or None if the code
+    cannot be cached. The code is keyed on its AST, so comments and formatting
+    do not matter.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            func = node.func
+            name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+            if name in NONDETERMINISTIC_CALLS:
+                return None
+    return hashlib.sha256(f"{version}\n{ast.dump(tree)}".encode()).hexdigest()
+
+
+class EvalResultCache:
+    """
+    Results of generated code, keyed by `code_key` and evicted after
+    ttl_seconds or, least recently used first, once they take more than max_mb.
+
+    Results are stored pickled, which holds DataFrames, Plotly figures and
+    folium maps alike, and every hit unpickles a fresh copy, so a caller
+    changing its result never changes the cached one.
+    """
+
+    def __init__(self, ttl_seconds: float = EVAL_CACHE_TTL_SECONDS, max_mb: float = EVAL_CACHE_MAX_MB):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = int(max_mb * 2**20)
+        self.entries = OrderedDict()  # key -> (expiry time, pickled result)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Optional[str]) -> Any:
+        """The cached result for key, or None if there is none"""
+        if key is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, payload = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+        return cPickle.loads(payload)
+
+    def put(self, key: Optional[str], result: Any) -> bool:
+        """Cache result under key, returns False if it cannot be cached"""
+        if key is None or self.max_bytes <= 0:
+            return False
+        try:
+            payload = cPickle.dumps(result, protocol=-1)
+        except Exception:
+            # Results holding open files, generators and the like
+            return False
+        if len(payload) > self.max_bytes:
+            return False
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, payload)
+            self.size += len(payload)
+            self._evict()
+        return True
+
+    def _remove(self, key: str):
+        _, payload = self.entries.pop(key)
+        self.size -= len(payload)
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [key for key, (expires, _) in self.entries.items() if expires < now]:
+            self._remove(key)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
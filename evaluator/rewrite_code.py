@@ -0,0 +1,583 @@
+import ast
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Name rewritten code reaches this module by, see eval_imports.BASE_NAMESPACE
+RUNTIME_NAME = "__rewrite__"
+
+# Units of a geopy Distance, see geodesic_rows
+GEOPY_UNITS = {"kilometers", "km", "meters", "m", "miles", "mi", "feet", "ft", "nautical", "nm"}
+
+# DataFrame methods that change the frame in place without `inplace=True`
+MUTATING_METHODS = {"insert", "pop", "update", "__setitem__", "__delitem__"}
+
+LOOPS = (ast.For, ast.AsyncFor, ast.While, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+
+def _root_name(node: ast.AST) -> Optional[str]:
+    """The name an attribute or subscript chain starts from, e.g. `feed` for `feed.stops['a']`"""
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Starred)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _is_frame(node: ast.AST) -> bool:
+    """Whether node is a name or attributes of a name, e.g. `feed.stop_times`"""
+    while isinstance(node, ast.Attribute):
+        node = node.value
+    return isinstance(node, ast.Name)
+
+
+def _same(a: ast.AST, b: ast.AST) -> bool:
+    return ast.dump(a) == ast.dump(b)
+
+
+def _column(node: ast.AST, frame: ast.AST, attribute_of=pd.DataFrame) -> Optional[Tuple[str, bool]]:
+    """The column `frame['col']` or `frame.col` selects, and whether as an attribute"""
+    if (
+        isinstance(node, ast.Subscript)
+        and _same(node.value, frame)
+        and isinstance(node.slice, ast.Constant)
+        and isinstance(node.slice.value, str)
+    ):
+        return node.slice.value, False
+    if isinstance(node, ast.Attribute) and _same(node.value, frame) and not hasattr(attribute_of, node.attr):
+        return node.attr, True
+    return None
+
+
+def _targets(node: ast.AST) -> List[ast.AST]:
+    """Assignment targets with tuples unpacked"""
+    if isinstance(node, (ast.Tuple, ast.List)):
+        return [target for elt in node.elts for target in _targets(elt)]
+    return [node]
+
+
+def _mutated_names(tree: ast.AST) -> set:
+    """
+    Names whose objects the code may change in place: roots of subscript and
+    attribute assignments, of in-place operators and methods, arguments of
+    functions changing their parameters, and every name aliasing one of them.
+    """
+    mutated, aliases, mutating_functions = set(), [], set()
+    for node in ast.walk(tree):
+        targets = []
+        if isinstance(node, ast.Assign):
+            targets = [t for target in node.targets for t in _targets(target) if not isinstance(t, ast.Name)]
+            if _is_frame(node.value):
+                aliases += [(t.id, _root_name(node.value)) for t in node.targets if isinstance(t, ast.Name)]
+        elif isinstance(node, ast.AugAssign):
+            # `df += 1` changes a DataFrame in place
+            targets = [node.target]
+        elif isinstance(node, ast.AnnAssign):
+            targets = [node.target] if not isinstance(node.target, ast.Name) else []
+        elif isinstance(node, ast.Delete):
+            targets = [t for target in node.targets for t in _targets(target) if not isinstance(t, ast.Name)]
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            inplace = any(
+                keyword.arg == "inplace" and not (isinstance(keyword.value, ast.Constant) and not keyword.value.value)
+                for keyword in node.keywords
+            )
+            if inplace or node.func.attr in MUTATING_METHODS:
+                targets = [node.func.value]
+        mutated.update(_root_name(target) for target in targets)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            params = {arg.arg for arg in node.args.posonlyargs + node.args.args + node.args.kwonlyargs}
+            if params & _mutated_names(ast.Module(body=node.body, type_ignores=[])):
+                mutating_functions.add(node.name)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in mutating_functions:
+            mutated.update(_root_name(arg) for arg in node.args + [keyword.value for keyword in node.keywords])
+    # Aliases share their object both ways
+    changed = True
+    while changed:
+        changed = False
+        for alias, name in aliases:
+            if (alias in mutated) != (name in mutated):
+                mutated.update((alias, name))
+                changed = True
+    mutated.discard(None)
+    return mutated
+
+
+def _stored_names(node: ast.AST) -> set:
+    """Names bound anywhere within node"""
+    names = {n.id for n in ast.walk(node) if isinstance(n, ast.Name) and isinstance(n.ctx, (ast.Store, ast.Del))}
+    names |= {n.name for n in ast.walk(node) if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))}
+    return names
+
+
+class _Rewriter(ast.NodeVisitor):
+    """Finds the rewrites and warnings of rewrite_code in one pass over the tree"""
+
+    def __init__(self, code: str, tree: ast.AST):
+        self.code = code
+        self.mutated = _mutated_names(tree)
+        self.geodesic_names, self.distance_modules, self.geopy_modules = self._geodesic_imports(tree)
+        # Innermost loop or function last, with the names bound in it
+        self.contexts: List[Tuple[ast.AST, set]] = []
+        self.replacements: List[Tuple[ast.AST, str]] = []
+        self.rewrites: List[str] = []
+        self.warnings: List[str] = []
+
+    @staticmethod
+    def _geodesic_imports(tree: ast.AST) -> Tuple[set, set, set]:
+        """
+        Names the code binds to `geopy.distance.geodesic`, to `geopy.distance`
+        and to `geopy` by importing them and nothing else.
+        """
+        geodesic, distance, geopy, other = set(), set(), {"geopy"}, set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom):
+                for alias in node.names:
+                    name = alias.asname or alias.name
+                    if node.module == "geopy.distance" and alias.name == "geodesic":
+                        geodesic.add(name)
+                    elif node.module == "geopy" and alias.name == "distance":
+                        distance.add(name)
+                    else:
+                        other.add(name)
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.name == "geopy.distance" and alias.asname:
+                        distance.add(alias.asname)
+                    elif alias.name in ("geopy", "geopy.distance") and not alias.asname:
+                        # `geopy` is also in the evaluation namespace
+                        continue
+                    else:
+                        other.add(alias.asname or alias.name.split(".")[0])
+        # A name bound any other way may not be geopy's
+        rebound = _stored_names(tree) | other | {node.arg for node in ast.walk(tree) if isinstance(node, ast.arg)}
+        return geodesic - rebound, distance - rebound, geopy - rebound
+
+    def _is_geodesic(self, func: ast.AST) -> bool:
+        if isinstance(func, ast.Name):
+            return func.id in self.geodesic_names
+        if not (isinstance(func, ast.Attribute) and func.attr == "geodesic"):
+            return False
+        module = func.value
+        if isinstance(module, ast.Name):
+            return module.id in self.distance_modules
+        return (
+            isinstance(module, ast.Attribute)
+            and module.attr == "distance"
+            and isinstance(module.value, ast.Name)
+            and module.value.id in self.geopy_modules
+        )
+
+    def _source(self, node: ast.AST) -> str:
+        return ast.get_source_segment(self.code, node)
+
+    def _rewrite(self, node: ast.AST, text: str, message: str):
+        self.replacements.append((node, text))
+        self.rewrites.append(f"Line {node.lineno}: {message}")
+
+    def _warn(self, node: ast.AST, message: str):
+        warning = f"Line {node.lineno}: {message}"
+        if warning not in self.warnings:
+            self.warnings.append(warning)
+
+    def _in_loop(self) -> bool:
+        """Whether the innermost loop or function is a loop"""
+        return bool(self.contexts) and isinstance(self.contexts[-1][0], LOOPS)
+
+    def _visit_context(self, node: ast.AST, *fields):
+        self.contexts.append((node, _stored_names(node)))
+        for field in fields:
+            value = getattr(node, field)
+            for child in value if isinstance(value, list) else [value]:
+                self.visit(child)
+        self.contexts.pop()
+
+    def visit_For(self, node: ast.For):
+        # The iterable and the else clause run once
+        self.visit(node.iter)
+        self._visit_context(node, "target", "body")
+        for child in node.orelse:
+            self.visit(child)
+
+    visit_AsyncFor = visit_For
+
+    def visit_While(self, node: ast.While):
+        self._visit_context(node, "test", "body")
+        for child in node.orelse:
+            self.visit(child)
+
+    def _visit_comprehension(self, node: ast.AST):
+        self.contexts.append((node, _stored_names(node)))
+        self.generic_visit(node)
+        self.contexts.pop()
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _visit_comprehension
+
+    def visit_FunctionDef(self, node: ast.FunctionDef):
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        self._visit_context(node, "body")
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node: ast.Lambda):
+        self._visit_context(node, "body")
+
+    def visit_Subscript(self, node: ast.Subscript):
+        if isinstance(node.ctx, ast.Load) and self.contexts:
+            self._equality_filter(node)
+        self.generic_visit(node)
+
+    def _equality_filter(self, node: ast.Subscript):
+        """`frame[frame['col'] == value]` or `frame.loc[...]` run repeatedly"""
+        frame, mask = node.value, node.slice
+        if isinstance(frame, ast.Attribute) and frame.attr == "loc":
+            frame = frame.value
+        if not (
+            _is_frame(frame)
+            and isinstance(mask, ast.Compare)
+            and len(mask.ops) == 1
+            and isinstance(mask.ops[0], ast.Eq)
+        ):
+            return
+        column, value = _column(mask.left, frame), mask.comparators[0]
+        if column is None:
+            column, value = _column(mask.comparators[0], frame), mask.left
+        if column is None or _column(value, frame) is not None:
+            # Not a column compared with a value
+            return
+        name, attribute = column
+        root = _root_name(frame)
+        context, stored = self.contexts[-1]
+        if root in self.mutated or root in stored:
+            # Changed in place, or a different frame on every run
+            if self._in_loop():
+                self._warn(
+                    node,
+                    f"`{self._source(node)}` scans the whole table on every iteration; "
+                    "filter once with `isin` or `groupby` outside the loop",
+                )
+            return
+        text = f"{RUNTIME_NAME}.rows_equal({self._source(frame)}, {name!r}, {self._source(value)}"
+        text += ", attribute=True)" if attribute else ")"
+        self._rewrite(node, text, f"rows of `{self._source(frame)}` by `{name}` looked up instead of scanned")
+
+    def visit_Call(self, node: ast.Call):
+        func = node.func
+        if isinstance(func, ast.Attribute) and func.attr in ("iterrows", "itertuples"):
+            self._warn(
+                node,
+                f"`{func.attr}` loops over rows in Python; column operations, `merge` or `groupby` are usually much faster",
+            )
+        elif isinstance(func, ast.Attribute) and func.attr == "apply" and self._axis_is_rows(node):
+            if not self._geodesic_apply(node):
+                self._warn(node, "row-wise `apply(..., axis=1)` calls Python for every row; use column operations where possible")
+        elif self._is_geodesic(func) and self._in_loop():
+            self._warn(node, "`geodesic` is called once per iteration; compute the distances of all pairs at once")
+        self.generic_visit(node)
+
+    @staticmethod
+    def _axis_is_rows(node: ast.Call) -> bool:
+        axis = [keyword.value for keyword in node.keywords if keyword.arg == "axis"] or node.args[1:2]
+        return bool(axis) and isinstance(axis[0], ast.Constant) and axis[0].value in (1, "columns")
+
+    def _geodesic_apply(self, node: ast.Call) -> bool:
+        """Rewrite `frame.apply(lambda row: geodesic(a, b).unit, axis=1)`, return whether it was"""
+        frame = node.func.value
+        if not (_is_frame(frame) and len(node.args) == 1 and isinstance(node.args[0], ast.Lambda)):
+            return False
+        if [keyword.arg for keyword in node.keywords] != ["axis"]:
+            return False
+        function = node.args[0]
+        params = function.args
+        if len(params.args) != 1 or params.posonlyargs or params.kwonlyargs or params.vararg or params.kwarg:
+            return False
+        row = params.args[0].arg
+        body = function.body
+        if not (isinstance(body, ast.Attribute) and body.attr in GEOPY_UNITS and isinstance(body.value, ast.Call)):
+            return False
+        call = body.value
+        if not self._is_geodesic(call.func) or len(call.args) != 2 or call.keywords:
+            return False
+        points = [self._point(arg, row) for arg in call.args]
+        if None in points or not any(RUNTIME_NAME in point for point in points):
+            return False
+        axis = self._source(node.keywords[0].value)
+        text = (
+            f"{RUNTIME_NAME}.geodesic_rows({self._source(frame)}, {self._source(function)}, "
+            f"{points[0]}, {points[1]}, {body.attr!r}, axis={axis})"
+        )
+        self._rewrite(node, text, "row-wise `geodesic` distances computed for all rows at once")
+        return True
+
+    def _point(self, node: ast.AST, row: str) -> Optional[str]:
+        """
+        Source of a point for geodesic_rows: a (latitude, longitude) tuple of
+        Columns of the row and values, or a value. Values must not depend on
+        the row, since they are evaluated once rather than for every row.
+        """
+        if isinstance(node, ast.Tuple) and len(node.elts) == 2:
+            parts = []
+            for elt in node.elts:
+                column = _column(elt, ast.Name(id=row, ctx=ast.Load()), attribute_of=pd.Series)
+                if column is not None:
+                    parts.append(f"{RUNTIME_NAME}.Column({column[0]!r})")
+                elif self._is_value(elt, row):
+                    parts.append(self._source(elt))
+                else:
+                    return None
+            return f"({parts[0]}, {parts[1]})"
+        return self._source(node) if self._is_value(node, row) else None
+
+    @staticmethod
+    def _is_value(node: ast.AST, row: str) -> bool:
+        """Constants, names and their attributes or constant subscripts, other than the row"""
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            node = node.operand
+        if isinstance(node, ast.Constant):
+            return True
+        if isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Constant):
+            node = node.value
+        return _is_frame(node) and _root_name(node) != row
+
+    def visit_Assign(self, node: ast.Assign):
+        call = node.value
+        if (
+            self._in_loop()
+            and isinstance(call, ast.Call)
+            and isinstance(call.func, ast.Attribute)
+            and call.func.attr == "concat"
+            and _root_name(call.func.value) == "pd"
+        ):
+            grown = {target.id for target in node.targets if isinstance(target, ast.Name)}
+            used = {n.id for n in ast.walk(call) if isinstance(n, ast.Name)}
+            for name in sorted(grown & used):
+                self._warn(
+                    node,
+                    f"`pd.concat` grows `{name}` inside a loop, copying it every time; "
+                    "collect the parts in a list and concatenate once",
+                )
+        self.generic_visit(node)
+
+
+def _replace(code: str, replacements: List[Tuple[ast.AST, str]]) -> str:
+    """
+    Replace the source of each node with its text, outermost first. Texts
+    get the line breaks of the source they replace, inside their closing
+    parenthesis, so every line keeps its number.
+    """
+    data = code.encode()
+    line_starts = [0]
+    for line in data.splitlines(keepends=True):
+        line_starts.append(line_starts[-1] + len(line))
+
+    def offset(line: int, col: int) -> int:
+        # AST columns are UTF-8 byte offsets
+        return line_starts[line - 1] + col
+
+    spans = sorted(
+        (
+            (offset(node.lineno, node.col_offset), offset(node.end_lineno, node.end_col_offset), text)
+            for node, text in replacements
+        ),
+        key=lambda span: (span[0], -span[1]),
+    )
+    parts, position = [], 0
+    for start, end, text in spans:
+        if start < position:
+            # Within a node already replaced
+            continue
+        missing_breaks = data[start:end].count(b"\n") - text.count("\n")
+        if missing_breaks > 0:
+            text = text[:-1] + "\n" * missing_breaks + text[-1]
+        parts += [data[position:start], text.encode()]
+        position = end
+    parts.append(data[position:])
+    return b"".join(parts).decode()
+
+
+def rewrite_code(code: str) -> Tuple[str, List[str], List[str]]:
+    """
+    Rewrite slow pandas patterns in generated code into calls of the
+    equivalent, faster helpers of this module, and warn about the slow
+    patterns that are left.
+
+    Rewritten are equality filters such as
+    `feed.stop_times[feed.stop_times['trip_id'] == trip_id]` run in a loop or
+    function, on a frame the code never changes in place (see rows_equal),
+    and row-wise geodesic distances such as
+    `df.apply(lambda row: geodesic(point, (row['stop_lat'], row['stop_lon'])).meters, axis=1)`
+    (see geodesic_rows). Rewritten code keeps its line numbers, so errors
+    and profiles still point at the lines of the original.
+
+    Args:
+        code (str): The generated code
+
+    Returns:
+        tuple: The code to run, the rewrites made and the performance
+            warnings, the last two as "Line N: ..." messages
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code, [], []
+    rewriter = _Rewriter(code, tree)
+    rewriter.visit(tree)
+    if not rewriter.replacements:
+        return code, [], rewriter.warnings
+    rewritten = _replace(code, rewriter.replacements)
+    try:
+        ast.parse(rewritten)
+    except SyntaxError:
+        return code, [], rewriter.warnings
+    return rewritten, rewriter.rewrites, rewriter.warnings
+
+
+# Runtime helpers of rewritten code
+
+# Row positions of each value of a column, by id of the frame
+_row_positions: Dict[int, Tuple[weakref.ref, int, Dict[str, Optional[dict]]]] = {}
+# Marks a column filtered once, which is not grouped yet
+_FILTERED_ONCE = {}
+
+
+def _forget_frame(key: int, ref: weakref.ref):
+    if _row_positions.get(key, (None,))[0] is ref:
+        del _row_positions[key]
+
+
+def _positions(frame: pd.DataFrame, column: str) -> Optional[dict]:
+    """
+    Positions of the rows of each value of column, grouped once per frame
+    the second time it is filtered on column, so frames filtered only once
+    are not grouped for nothing. None while it should be filtered.
+    """
+    key = id(frame)
+    entry = _row_positions.get(key)
+    if entry is None or entry[0]() is not frame or entry[1] != len(frame):
+        ref = weakref.ref(frame, lambda ref, key=key: _forget_frame(key, ref))
+        entry = _row_positions[key] = (ref, len(frame), {})
+    columns = entry[2]
+    if column not in columns:
+        columns[column] = _FILTERED_ONCE
+        return None
+    if columns[column] is _FILTERED_ONCE:
+        try:
+            columns[column] = frame.groupby(column, sort=False, observed=True).indices
+        except (TypeError, ValueError, KeyError):
+            columns[column] = None
+    return columns[column]
+
+
+def _groupable(frame, column: str, value) -> bool:
+    """Whether looking value up in the grouped column matches `==` exactly"""
+    if not isinstance(frame, pd.DataFrame) or column not in frame.columns or not frame.columns.is_unique:
+        return False
+    dtype = frame.dtypes[column]
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if isinstance(value, str):
+        return dtype == object or isinstance(dtype, pd.StringDtype)
+    if isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_)):
+        return dtype == object or (isinstance(dtype, np.dtype) and dtype.kind in "iu")
+    return False
+
+
+def rows_equal(frame, column: str, value, attribute: bool = False):
+    """
+    `frame[frame[column] == value]`, or `frame[frame.column == value]` when
+    attribute is set, for code filtering the same frame many times.
+
+    From the second time the frame is filtered on column, rows are taken
+    from positions grouped by column once, rather than by comparing the
+    whole column again, and come out in the same order with the same index. Values that `==` could
+    match differently than a lookup, such as floats or dates, are compared.
+    """
+    if not _groupable(frame, column, value) or (attribute and hasattr(type(frame), column)):
+        series = getattr(frame, column) if attribute else frame[column]
+        return frame[series == value]
+    positions = _positions(frame, column)
+    if positions is None:
+        return frame[frame[column] == value]
+    return frame.iloc[positions.get(value, [])]
+
+
+class Column:
+    """A column of the rows in a point passed to geodesic_rows"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"Column({self.name!r})"
+
+
+_wgs84 = None
+
+
+def _coordinates(frame: pd.DataFrame, point) -> Tuple[np.ndarray, np.ndarray]:
+    """Latitudes and longitudes of point for every row, as geopy reads them"""
+    if isinstance(point, tuple) and any(isinstance(part, Column) for part in point):
+        coordinates = []
+        for part in point:
+            if isinstance(part, Column):
+                if frame.dtypes[part.name].kind not in "iuf":
+                    raise ValueError(f"Column {part.name} is not numeric")
+                coordinates.append(frame[part.name].to_numpy(dtype=float))
+            else:
+                coordinates.append(np.full(len(frame), float(part)))
+        return tuple(coordinates)
+    from geopy import Point
+
+    point = Point(point)
+    if point.altitude:
+        raise ValueError("Points with an altitude are measured by geopy")
+    return np.full(len(frame), point.latitude), np.full(len(frame), point.longitude)
+
+
+def _geopy_unit(kilometers: np.ndarray, unit: str) -> np.ndarray:
+    """Distances in unit, converted as a geopy Distance converts them"""
+    if unit in ("kilometers", "km"):
+        return kilometers
+    if unit in ("meters", "m"):
+        return kilometers * 1000.0
+    if unit in ("miles", "mi"):
+        return kilometers / 1.609344
+    if unit in ("feet", "ft"):
+        return kilometers / 1.609344 * 5280
+    return kilometers / 1.852
+
+
+def geodesic_rows(frame, function, point1, point2, unit: str, axis=1):
+    """
+    `frame.apply(function, axis=axis)` where function returns
+    `geodesic(point1, point2).<unit>` of each row, computed for all rows in
+    one call of pyproj. Both use Karney's algorithm on the WGS-84 ellipsoid,
+    so the distances agree with geopy's to about 1e-12.
+
+    Points are (latitude, longitude) tuples of Columns and values, or values
+    such as a tuple or a geopy Point. Rows geopy would reject or wrap, with
+    coordinates that are missing or out of range, are left to the apply.
+    """
+    global _wgs84
+    if isinstance(frame, pd.DataFrame) and len(frame):
+        try:
+            (lat1, lon1), (lat2, lon2) = (_coordinates(frame, point) for point in (point1, point2))
+        except (TypeError, ValueError, KeyError):
+            lat1 = None
+        if lat1 is not None:
+            latitudes, longitudes = np.concatenate([lat1, lat2]), np.concatenate([lon1, lon2])
+            if (
+                np.isfinite(latitudes).all()
+                and np.isfinite(longitudes).all()
+                and (np.abs(latitudes) <= 90).all()
+                and (np.abs(longitudes) < 180).all()
+            ):
+                if _wgs84 is None:
+                    from pyproj import Geod
+
+                    _wgs84 = Geod(ellps="WGS84")
+                _, _, meters = _wgs84.inv(lon1, lat1, lon2, lat2)
+                return pd.Series(_geopy_unit(np.asarray(meters) / 1000.0, unit), index=frame.index)
+    return frame.apply(function, axis=axis)
@@ -4,6 +4,7 @@ from prompts.all_prompts import (
     SUMMARY_LLM_SYSTEM_PROMPT,
     SUMMARY_LLM_USER_PROMPT,
     RETRY_PROMPT,
+    HOT_LINES_PROMPT,
     MAIN_LLM_USER_PROMPT,
     MODERATION_LLM_SYSTEM_PROMPT,
     MODERATION_LLM_BLOCK_RESPONSE,
@@ -18,12 +19,14 @@ from utils.constants import (
     MODERATION_LLM,
     MODERATION_LLM_TEMPERATURE,
     MODERATION_LLM_MAX_TOKENS,
+    PROFILE_GENERATED_CODE,
 )
 from typing import List, Dict, Any, Tuple
 from utils.helper import summarize_large_output, combine_token_usage
 from gtfs_agent.llm_client import OpenAIClient, GroqClient, AnthropicClient, GeminiClient, OpenRouterClient
 from utils.data_models import ChatInteraction
 from evaluator.eval_code import GTFS_Eval
+from evaluator.line_profile import format_hot_lines
 from streamlit_folium import folium_static
 from traceloop.sdk import Traceloop
 from traceloop.sdk.decorators import workflow, task
@@ -39,6 +42,7 @@ class LLMAgent:
         max_retry=3,
         max_chars=2000,
         max_rows=20,
+        profile_code: bool = PROFILE_GENERATED_CODE,
     ):
         self.evaluator = GTFS_Eval(file_mapping)
         self.model = model
@@ -51,6 +55,8 @@ class LLMAgent:
         self.max_retry = max_retry
         self.max_chars = max_chars
         self.max_rows = max_rows
+        # Profile generated code, so retries after a timeout see its slowest lines
+        self.profile_code = profile_code
 
         ## Initialize the logger and clients
         self.logger = setup_logger(LOG_FILE)
@@ -67,6 +73,7 @@ class LLMAgent:
 
         self.result = None
         self.last_response = None
+        self.last_profile = None
         self.chat_history = []
         self.allow_viz = allow_viz
         self.load_system_prompt(self.GTFS, self.distance_unit, self.allow_viz)
@@ -185,7 +192,20 @@ class LLMAgent:
     @task(name="Execute Code")
     def execute(self, user_input: str, llm_response: str):
         self.logger.info("Evaluating code from LLM response")
-        output = self.evaluator.evaluate(llm_response)
+        output = self.evaluator.evaluate(llm_response, profile=self.profile_code)
+        self.last_profile = output["profile"]
+        if self.last_profile:
+            self.logger.info(f"Slowest lines:\n{format_hot_lines(self.last_profile)}")
+        for rewrite in output["rewrites"]:
+            self.logger.info(f"Rewrote generated code: {rewrite}")
+        for warning in output["performance_warnings"]:
+            self.logger.warning(f"Slow pattern in generated code: {warning}")
+        if output["cache_hit"]:
+            self.logger.info("Evaluation result reused from the cache")
+        else:
+            self.logger.info(
+                f"Evaluation used {output['cpu_seconds']} CPU seconds, peak RSS {output['peak_rss_mb']} MiB"
+            )
         result = output["code_output"]
         success = output["eval_success"]
         error = output["error_message"]
@@ -210,7 +230,8 @@ class LLMAgent:
             if isinstance(result, dict) and "map" in result:
                 success, error = self._check_map_renderability(result["map"])
 
-            if success or only_text or "TimeoutError" in error:
+            # Without a profile to show the LLM, a timeout is not retried
+            if success or only_text or ("TimeoutError" in error and not self.last_profile):
                 error_message = "\n".join(errors) if len(errors) > 0 else error
                 self.update_chat_history(
                     user_input,
@@ -238,6 +259,7 @@ class LLMAgent:
                     llm_response,
                     error,
                     temperature=MAIN_LLM_RETRY_TEMPERATURE,
+                    hot_lines=self._hot_lines(error),
                 )
                 # Add usage from retry attempt
                 for key in total_usage:
@@ -261,6 +283,13 @@ class LLMAgent:
         except Exception as e:
             return False, f"Error rendering Folium map: {str(e)}"
 
+    def _hot_lines(self, error: str) -> str:
+        """HOT_LINES_PROMPT for the last evaluation if it was profiled and too slow, else empty"""
+        too_slow = "TimeoutError" in error or "CPUTimeLimitExceeded" in error
+        if not self.last_profile or not too_slow:
+            return ""
+        return HOT_LINES_PROMPT.format(hot_lines=format_hot_lines(self.last_profile))
+
     def _log_retry_attempt(self, attempt, error):
         st.write(f"Something wasn't right, retrying: attempt {attempt}")
         self.logger.info(
@@ -274,7 +303,7 @@ class LLMAgent:
         )
 
     def get_retry_messages(
-        self, user_input: str, main_llm_response: str, error: str
+        self, user_input: str, main_llm_response: str, error: str, hot_lines: str = ""
     ) -> List[Dict[str, str]]:
         messages = []
         for interaction in self.chat_history:
@@ -287,7 +316,9 @@ class LLMAgent:
         # Add the user input and main LLM response
         messages.append({"role": "user", "content": user_input})
         messages.append({"role": "assistant", "content": main_llm_response})
-        messages.append({"role": "user", "content": RETRY_PROMPT.format(error=error)})
+        messages.append(
+            {"role": "user", "content": RETRY_PROMPT.format(error=error, hot_lines=hot_lines)}
+        )
         # # Add the error message as part of the last assistant's response
         # if messages and messages[-1]["role"] == "assistant":
         #     messages[-1]["content"] += f"\n\nError: {error}"
@@ -306,10 +337,11 @@ class LLMAgent:
         main_llm_response: str,
         error: str,
         temperature: float = MAIN_LLM_RETRY_TEMPERATURE,
+        hot_lines: str = "",
     ) -> str:
         model = self.model
         self.logger.info(f"Retrying LLM call with model: {model}")
-        messages = self.get_retry_messages(user_input, main_llm_response, error)
+        messages = self.get_retry_messages(user_input, main_llm_response, error, hot_lines)
         client = self.clients[self.get_client_key(model)]
         response, call_success, usage = client.call(
             model, messages, self.system_prompt, temperature, role="Main LLM Retry"
@@ -361,6 +393,7 @@ class LLMAgent:
 
     def reset(self):
         self.last_response = None
+        self.last_profile = None
         self.chat_history = []
         self.result = None
         self.status = None
@@ -416,6 +449,7 @@ class LLMAgent:
                         "summary_response": None,
                         "token_usage": moderation_usage,
                         "execution_time": 0,
+                        "profile": None,
                     }
             else:
                 moderation_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
@@ -439,6 +473,7 @@ class LLMAgent:
                     "summary_response": None,
                     "token_usage": main_llm_usage,
                     "execution_time": execution_time,
+                    "profile": None,
                 }
 
             # Evaluate the code with retry
@@ -477,6 +512,7 @@ class LLMAgent:
             "token_usage": total_usage,
             # "validation_response": validation_response,
             "execution_time": execution_time,
+            "profile": self.last_profile,
         }
 
     @task(name="Validate Evaluation")
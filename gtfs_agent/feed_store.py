@@ -0,0 +1,541 @@
+import os
+import mmap
+import json
+import time
+import tempfile
+from functools import partial
+from typing import Dict, Optional
+
+import gtfs_kit as gk
+import numpy as np
+import pandas as pd
+import psutil
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from shapely.geometry.base import BaseGeometry
+
+from gtfs_agent.gtfs_loader import (
+    STOP_TIMES_CHUNK_ROWS,
+    GTFSLoader,
+    LazyFeed,
+    derived_tables,
+)
+
+ARTIFACT_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+# Table file extension for each artifact format
+ARTIFACT_FORMATS = {"parquet": ".parquet", "ipc": ".arrow"}
+# Feed tables stored behind a property that also maintains a derived index
+INDEXED_TABLES = ["trips", "calendar", "calendar_dates"]
+
+
+def feed_tables(feed: gk.Feed) -> Dict[str, pd.DataFrame]:
+    """
+    Return every table of a feed by its public name, without derived indexes
+    or the tables rebuilt from others (see gtfs_loader.derived_tables).
+    """
+    derived = derived_tables(feed)
+    if isinstance(feed, LazyFeed):
+        feed.load_all(derived)
+    tables = {}
+    for attr, value in vars(feed).items():
+        if not isinstance(value, pd.DataFrame):
+            continue
+        name = attr.lstrip("_")
+        if (attr.startswith("_") and name not in INDEXED_TABLES) or name in derived:
+            continue
+        tables[name] = value
+    return tables
+
+
+def _first_valid(series: pd.Series):
+    valid = series.dropna()
+    return valid.iloc[0] if len(valid) else None
+
+
+def _to_arrow(
+    df: pd.DataFrame,
+    meta: dict,
+    nan_as_null: bool = True,
+    prune: bool = True,
+    preserve_index: Optional[bool] = None,
+) -> pa.Table:
+    """
+    Convert a table to Arrow, pruning all-null columns and encoding values
+    Arrow cannot infer: shapely geometries are stored as WKB and columns of
+    mixed Python types as strings. What was done is recorded in `meta`.
+    """
+    meta["columns"] = list(df.columns)
+    meta["pruned_columns"] = {}
+    if len(df) and prune:
+        meta["pruned_columns"] = {
+            c: str(df[c].dtype) for c in df.columns if df[c].isna().all()
+        }
+        df = df.drop(columns=list(meta["pruned_columns"]))
+    meta["geometry_columns"] = [
+        c
+        for c in df.columns
+        if df[c].dtype == object and isinstance(_first_valid(df[c]), BaseGeometry)
+    ]
+    if meta["geometry_columns"]:
+        df = df.copy()
+        for column in meta["geometry_columns"]:
+            df[column] = shapely.to_wkb(df[column].to_numpy())
+
+    meta["stringified_columns"] = []
+    while True:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=preserve_index)
+            break
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            column = next(
+                (
+                    c
+                    for c in df.columns
+                    if df[c].dtype == object
+                    and c not in meta["stringified_columns"]
+                    and f"'{c}'" in str(e)
+                ),
+                None,
+            )
+            if column is None:
+                raise
+            df = df.copy()
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+            meta["stringified_columns"].append(column)
+
+    if not nan_as_null:
+        for column in df.columns:
+            if df[column].dtype.kind == "f":
+                index = table.schema.get_field_index(column)
+                values = pa.array(df[column].to_numpy())
+                table = table.set_column(index, table.field(index), values)
+    return table
+
+
+def _write_json_atomic(path: str, data: dict):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class TableChunkWriter:
+    """
+    Append DataFrame chunks of one table to an artifact file, so a table is
+    written without ever being held whole in memory.
+
+    The first chunk fixes the schema and later ones are cast to it, so
+    chunks must come with the same column types (see
+    gtfs_loader.stream_dtypes). Categorical columns are stored as strings
+    and nullable integer columns as Arrow integers with nulls; both dtypes
+    are recorded in the table's manifest entry and restored by `read_table`.
+    Columns are not pruned and the IPC file holds one record batch per
+    chunk, so its columns are copied rather than memory-mapped on load.
+    """
+
+    def __init__(self, directory: str, name: str, file_format: str = "parquet"):
+        if file_format not in ARTIFACT_FORMATS:
+            raise ValueError(f"Unknown artifact format {file_format!r}")
+        os.makedirs(directory, exist_ok=True)
+        self.file_format = file_format
+        self.meta = {"file": f"{name}{ARTIFACT_FORMATS[file_format]}", "rows": 0}
+        self.path = os.path.join(directory, self.meta["file"])
+        self.schema = None
+        self._sink = None
+        self._writer = None
+
+    def write(self, df: pd.DataFrame):
+        """Append one chunk to the file."""
+        # Columns are replaced below, never changed in place
+        df = df.copy(deep=False)
+        categorical = [
+            c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)
+        ]
+        for column in categorical:
+            df[column] = df[column].astype(object)
+        nullable = {
+            c: str(df[c].dtype)
+            for c in df.columns
+            if pd.api.types.is_extension_array_dtype(df[c].dtype)
+            and pd.api.types.is_integer_dtype(df[c].dtype)
+        }
+        meta = {}
+        table = _to_arrow(
+            df,
+            meta,
+            nan_as_null=self.file_format == "parquet",
+            prune=False,
+            preserve_index=False,
+        )
+        if self.schema is None:
+            # A column that is all null in the first chunk may hold strings later
+            self.schema = pa.schema(
+                [
+                    (
+                        field.with_type(pa.string())
+                        if pa.types.is_null(field.type)
+                        else field
+                    )
+                    for field in table.schema
+                ],
+                metadata=table.schema.metadata,
+            )
+            self.meta.update(meta)
+            self.meta["categorical_columns"] = categorical
+            self.meta["nullable_columns"] = nullable
+            self._open()
+        table = table.select(self.schema.names).cast(self.schema)
+        self._writer.write_table(table)
+        self.meta["rows"] += table.num_rows
+
+    def _open(self):
+        if self.file_format == "ipc":
+            self._sink = pa.OSFile(self.path, "wb")
+            self._writer = pa.ipc.new_file(self._sink, self.schema)
+        else:
+            string_columns = [
+                field.name
+                for field in self.schema
+                if pa.types.is_string(field.type)
+                or pa.types.is_large_string(field.type)
+            ]
+            self._writer = pq.ParquetWriter(
+                self.path,
+                self.schema,
+                use_dictionary=string_columns,
+                compression="zstd",
+            )
+
+    def close(self) -> dict:
+        """
+        Finish the file.
+
+        Returns:
+            dict: The table's manifest entry
+        """
+        if self._writer is not None:
+            self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+        return self.meta
+
+
+def save_feed_artifact(
+    loader: GTFSLoader,
+    directory: str,
+    file_format: str = "parquet",
+    written_tables: Optional[Dict[str, dict]] = None,
+) -> dict:
+    """
+    Write a loaded feed as one file per table plus a JSON manifest.
+
+    "parquet" writes compressed Parquet files with dictionary-encoded string
+    columns, the smallest on disk. "ipc" writes uncompressed Arrow IPC files
+    that `load_feed_artifact` memory-maps, so processes serving the same feed
+    share the pages of its numeric columns.
+    All-null columns are pruned from the files (they are restored empty on
+    load). The manifest, which also holds the loader's settings, is written
+    last, so a directory without one is an incomplete artifact.
+
+    Args:
+        loader (GTFSLoader): Loader whose feed has been loaded
+        directory (str): Output directory for this feed
+        file_format (str): "parquet" or "ipc"
+        written_tables (Optional[Dict[str, dict]]): Manifest entries of tables
+            already written to `directory` by a TableChunkWriter
+
+    Returns:
+        dict: The manifest
+    """
+    if file_format not in ARTIFACT_FORMATS:
+        raise ValueError(f"Unknown artifact format {file_format!r}")
+    os.makedirs(directory, exist_ok=True)
+    tables = dict(written_tables or {})
+    for name, df in feed_tables(loader.feed).items():
+        meta = {"file": f"{name}{ARTIFACT_FORMATS[file_format]}"}
+        path = os.path.join(directory, meta["file"])
+        if file_format == "ipc":
+            # Keep NaN as a value so float columns stay null-free and mappable
+            table = _to_arrow(df, meta, nan_as_null=False).combine_chunks()
+            with pa.OSFile(path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            table = _to_arrow(df, meta)
+            string_columns = [
+                field.name
+                for field in table.schema
+                if pa.types.is_string(field.type)
+                or pa.types.is_large_string(field.type)
+            ]
+            pq.write_table(
+                table, path, use_dictionary=string_columns, compression="zstd"
+            )
+        meta["rows"] = table.num_rows
+        tables[name] = meta
+
+    loader_state = {
+        key: value
+        for key, value in vars(loader).items()
+        if key not in ("feed", "zipfile")
+        and isinstance(value, (str, int, float, bool, list, type(None)))
+    }
+    manifest = {
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "created": time.time(),
+        "dist_units": loader.feed.dist_units,
+        "loader": loader_state,
+        "tables": tables,
+    }
+    _write_json_atomic(os.path.join(directory, MANIFEST_FILE), manifest)
+    return manifest
+
+
+def stream_feed_artifact(
+    loader: GTFSLoader,
+    directory: str,
+    file_format: str = "parquet",
+    chunk_rows: int = STOP_TIMES_CHUNK_ROWS,
+) -> Optional[dict]:
+    """
+    Build a feed and write it as an artifact, streaming stop_times.txt from
+    the zip to the artifact in chunks of `chunk_rows` rows, so the build
+    never holds the whole stop_times table. The loader's feed is left
+    without stop_times; the other tables are saved as by `save_feed_artifact`.
+
+    Args:
+        loader (GTFSLoader): Loader whose feed has not been loaded yet
+        directory (str): Output directory for this feed
+        file_format (str): "parquet" or "ipc"
+        chunk_rows (int): Rows of stop_times.txt read at a time
+
+    Returns:
+        Optional[dict]: The manifest, or None if the feed failed to load
+    """
+    writer = TableChunkWriter(directory, "stop_times", file_format)
+    try:
+        loaded = loader.load_feed(stop_times_sink=writer.write, chunk_rows=chunk_rows)
+    finally:
+        meta = writer.close()
+    if not loaded:
+        return None
+    loader.load_all_tables()
+    return save_feed_artifact(
+        loader, directory, file_format, written_tables={"stop_times": meta}
+    )
+
+
+def read_manifest(directory: str) -> dict:
+    with open(os.path.join(directory, MANIFEST_FILE), "r") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != ARTIFACT_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported feed artifact version {manifest.get('format_version')} in {directory}"
+        )
+    return manifest
+
+
+def _mapped_columns(table: pa.Table, raw: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Numeric columns without nulls as writable NumPy views into the mapped
+    file, so they share its pages instead of being copied into the process.
+    """
+    metadata = table.schema.pandas_metadata or {}
+    # A RangeIndex is stored as a dict description rather than a column
+    index_columns = {c for c in metadata.get("index_columns", []) if isinstance(c, str)}
+    base_address = raw.ctypes.data
+    columns = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if (
+            name in index_columns
+            or column.num_chunks != 1
+            or column.null_count
+            or not (
+                pa.types.is_integer(column.type) or pa.types.is_floating(column.type)
+            )
+        ):
+            continue
+        chunk = column.chunks[0]
+        data = chunk.buffers()[1]
+        start = data.address - base_address
+        values = raw[start : start + data.size].view(column.type.to_pandas_dtype())
+        columns[name] = values[chunk.offset : chunk.offset + len(chunk)]
+    return columns
+
+
+def _to_pandas(table: pa.Table, meta: dict, mapped=None) -> pd.DataFrame:
+    """
+    Build the DataFrame the loader had from a stored table, undoing the
+    encodings recorded in `meta`. Columns in `mapped` are used as they are.
+    """
+    mapped = mapped or {}
+    null_strings = {
+        field.name
+        for field in table.schema
+        if pa.types.is_string(field.type) and table.column(field.name).null_count
+    }
+    # Free Arrow buffers while converting so the table is never held twice
+    frame = table.drop_columns(list(mapped)).to_pandas(
+        split_blocks=True, self_destruct=True
+    )
+    columns = {}
+    for name in meta["columns"]:
+        if name in mapped:
+            columns[name] = mapped[name]
+            continue
+        if name in meta["pruned_columns"]:
+            # All-null columns are not stored, but code may still reference them
+            values = pd.Series(np.nan, index=frame.index).astype(
+                meta["pruned_columns"][name]
+            )
+        elif name in meta["geometry_columns"]:
+            values = pd.Series(shapely.from_wkb(frame[name].to_numpy()))
+        elif name in null_strings:
+            # pd.read_csv leaves missing strings as NaN, Arrow gives None
+            values = frame[name].where(frame[name].notna(), np.nan)
+        else:
+            values = frame[name]
+        if name in meta.get("categorical_columns", []):
+            values = values.astype("category")
+        elif name in meta.get("nullable_columns", {}):
+            # Like pd.read_csv, integers without missing values get a NumPy
+            # dtype and ones with missing values are floats, unless compacted
+            dtype = meta["nullable_columns"][name]
+            if not values.isna().any():
+                dtype = dtype.lower()
+            elif dtype == "Int64":
+                dtype = "float64"
+            values = values.astype(dtype)
+        if (
+            isinstance(values.dtype, pd.CategoricalDtype)
+            and not values.cat.categories.is_monotonic_increasing
+        ):
+            # Parquet dictionaries keep first-seen order, astype sorts them
+            values = values.cat.reorder_categories(values.cat.categories.sort_values())
+        columns[name] = values.array
+    # copy=False keeps every column in its own block, mapped ones included
+    return pd.DataFrame(columns, index=frame.index, copy=False)
+
+
+def read_table(directory: str, meta: dict, nrows: Optional[int] = None) -> pd.DataFrame:
+    """
+    Read one table of an artifact back into the DataFrame the loader built.
+
+    Args:
+        directory (str): Artifact directory of one feed
+        meta (dict): The table's entry in the manifest
+        nrows (Optional[int]): Read only the first this many rows
+
+    Returns:
+        pd.DataFrame: The table
+    """
+    path = os.path.join(directory, meta["file"])
+    if not path.endswith(ARTIFACT_FORMATS["ipc"]):
+        if nrows is None:
+            return _to_pandas(pq.read_table(path), meta)
+        parquet_file = pq.ParquetFile(path)
+        batch = next(parquet_file.iter_batches(batch_size=nrows), None)
+        if batch is None:
+            return _to_pandas(parquet_file.schema_arrow.empty_table(), meta)
+        return _to_pandas(pa.Table.from_batches([batch]), meta)
+
+    # A private mapping: every process shares the file's pages through the
+    # page cache, and a write copies only the touched page into the writer
+    with open(path, "rb") as f:
+        mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    raw = np.frombuffer(mapped_file, dtype=np.uint8)
+    table = pa.ipc.open_file(pa.BufferReader(pa.py_buffer(mapped_file))).read_all()
+    if nrows is not None:
+        # A small sample is copied rather than mapped
+        return _to_pandas(table.slice(0, nrows), meta)
+    return _to_pandas(table, meta, _mapped_columns(table, raw))
+
+
+def load_feed_artifact(directory: str, lazy: bool = True) -> GTFSLoader:
+    """
+    Rebuild a GTFSLoader and its feed from an artifact written by
+    `save_feed_artifact`, without the source gtfs.zip.
+
+    Args:
+        directory (str): Artifact directory of one feed
+        lazy (bool): Read each table on first access (see LazyFeed) instead
+            of all of them up front
+
+    Returns:
+        GTFSLoader: The loader, with `feed` set
+    """
+    manifest = read_manifest(directory)
+    feed = LazyFeed(dist_units=manifest["dist_units"])
+    for name, meta in manifest["tables"].items():
+        if lazy:
+            feed.add_lazy_table(name, partial(read_table, directory, meta))
+        else:
+            setattr(feed, name, read_table(directory, meta))
+
+    # Tables the saved feed did not have were deleted from it by GTFSLoader
+    for attr in dir(feed):
+        if (
+            not attr.startswith("_")
+            and attr not in manifest["tables"]
+            and getattr(feed, attr) is None
+        ):
+            try:
+                delattr(feed, attr)
+            except AttributeError:
+                pass
+
+    loader = GTFSLoader.__new__(GTFSLoader)
+    loader.__setstate__({**manifest["loader"], "feed": feed})
+    return loader
+
+
+def mapped_memory(directory: str) -> Dict[str, float]:
+    """
+    Resident memory of this process's mappings of an artifact's IPC files.
+
+    `rss_mb` counts every resident mapped page, `pss_mb` splits shared pages
+    evenly between the processes mapping them, and `copied_mb` is pages this
+    process copied by writing to a table. Linux reports all three; other
+    platforms report what psutil exposes and 0 for the rest.
+
+    Args:
+        directory (str): Artifact directory of one feed
+
+    Returns:
+        Dict[str, float]: Memory in MiB
+    """
+    directory = os.path.realpath(directory)
+    totals = {"rss_mb": 0.0, "pss_mb": 0.0, "copied_mb": 0.0}
+    for region in psutil.Process().memory_maps(grouped=True):
+        if os.path.dirname(os.path.realpath(region.path)) != directory:
+            continue
+        totals["rss_mb"] += region.rss / 2**20
+        totals["pss_mb"] += getattr(region, "pss", 0) / 2**20
+        # Copy-on-write turns a page of a private file mapping anonymous
+        totals["copied_mb"] += getattr(region, "anonymous", 0) / 2**20
+    return totals
+
+
+def feed_memory_report(artifacts: Dict[str, str]) -> pd.DataFrame:
+    """
+    Mapped memory of every loaded feed in this process.
+
+    Args:
+        artifacts (Dict[str, str]): Feed name to artifact directory
+
+    Returns:
+        pd.DataFrame: One row per feed with the `mapped_memory` columns
+    """
+    return pd.DataFrame(
+        [
+            {"feed": name, **mapped_memory(directory)}
+            for name, directory in artifacts.items()
+        ]
+    )
@@ -1,24 +1,739 @@
+import os
+import copy
+import json
+import time
+import glob
+import threading
+import _pickle as cPickle
 import gtfs_kit as gk
 import pandas as pd
 import numpy as np
 import zipfile
 import datetime
+import tempfile
 import traceback
-from typing import Optional, Any
-from functools import lru_cache
+import hashlib
+from collections import OrderedDict, defaultdict
+from typing import Optional, Any, Callable, Dict, Iterable
+from functools import lru_cache, partial
 from utils.helper import list_files_in_zip
-from geopy.distance import geodesic
-from shapely.geometry import Point
+from prompts.gtfs_file_field_type import GTFS_FILE_FIELD_TYPE_MAPPING
 from scipy.spatial import cKDTree
 
 DATE_FORMAT = "%Y%m%d"
 DATE_FORMAT_ALT = "%Y-%m-%d"
 
+# WGS84 ellipsoid and mean earth radius, in meters
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+EARTH_RADIUS = 6371008.8
 
-@lru_cache(maxsize=None)
-def process_stop_sequence(stops, shape_coords, k_neighbors=3):
+# Multiply a distance in meters by these to get the feed's distance unit
+DISTANCE_UNIT_FACTORS = {
+    "m": 1.0,
+    "km": 1e-3,
+    "ft": 3.28084,
+    "mi": 0.000621371,
+    "miles": 0.000621371,
+}
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between arrays of points."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def ellipsoid_distance(lat1, lon1, lat2, lon2, max_iter=100, tol=1e-12):
+    """
+    Distance in meters on the WGS84 ellipsoid between arrays of points, using
+    Vincenty's inverse formula iterated on all pairs at once. Agrees with
+    `geopy.distance.geodesic` to well under a millimeter for shape segments.
+    """
+    a, f = WGS84_A, WGS84_F
+    b = (1 - f) * a
+    L = np.radians(np.asarray(lon2, dtype=float) - np.asarray(lon1, dtype=float))
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt(
+                (cos_u2 * sin_lam) ** 2
+                + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2
+            )
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(
+                sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma
+            )
+            cos2_alpha = 1 - sin_alpha**2
+            cos_2sm = np.where(
+                cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha
+            )
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma
+                + C * sin_sigma * (cos_2sm + C * cos_sigma * (-1 + 2 * cos_2sm**2))
+            )
+            # NaN coordinates never converge, so only wait on finite pairs
+            if not np.any(np.abs(lam - lam_prev) > tol):
+                break
+
+    u2 = cos2_alpha * (a**2 - b**2) / b**2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = (
+        B
+        * sin_sigma
+        * (
+            cos_2sm
+            + B
+            / 4
+            * (
+                cos_sigma * (-1 + 2 * cos_2sm**2)
+                - B / 6 * cos_2sm * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sm**2)
+            )
+        )
+    )
+    return b * A * (sigma - delta_sigma)
+
+
+DISTANCE_METHODS = {
+    "ellipsoid": ellipsoid_distance,
+    "haversine": haversine_distance,
+}
+
+
+def compute_shape_distances(
+    shapes: pd.DataFrame, distance_unit: str = "km", method: str = "ellipsoid"
+) -> pd.DataFrame:
+    """
+    Compute `shape_dist_traveled` for every shape in one pass.
+
+    Points are ordered by (shape_id, shape_pt_sequence), the distance between
+    each point and the previous one is computed for the whole table at once,
+    the first point of each shape is reset to zero and the segments are summed
+    per shape.
+
+    Args:
+        shapes (pd.DataFrame): The feed's shapes table
+        distance_unit (str): One of DISTANCE_UNIT_FACTORS, meters if unknown
+        method (str): "ellipsoid" (WGS84, matches geopy) or "haversine" (faster)
+
+    Returns:
+        pd.DataFrame: Sorted copy of `shapes` with `shape_dist_traveled` filled in
+    """
+    if method not in DISTANCE_METHODS:
+        raise ValueError(
+            f"Unknown distance method: {method}. Use one of {list(DISTANCE_METHODS)}"
+        )
+    shapes = shapes.sort_values(["shape_id", "shape_pt_sequence"], kind="stable")
+    lat = shapes["shape_pt_lat"].to_numpy(dtype=float)
+    lon = shapes["shape_pt_lon"].to_numpy(dtype=float)
+    shape_ids = shapes["shape_id"].to_numpy()
+
+    segments = np.zeros(len(shapes))
+    if len(shapes) > 1:
+        segments[1:] = DISTANCE_METHODS[method](lat[:-1], lon[:-1], lat[1:], lon[1:])
+        segments[1:][shape_ids[1:] != shape_ids[:-1]] = 0.0
+    segments *= DISTANCE_UNIT_FACTORS.get(distance_unit, 1.0)
+
+    shapes["shape_dist_traveled"] = (
+        pd.Series(segments, index=shapes.index).groupby(shape_ids, sort=False).cumsum()
+    )
+    return shapes
+
+
+def parse_gtfs_times(values) -> np.ndarray:
+    """
+    Parse a column of GTFS times to float32 seconds since midnight.
+
+    "H:MM:SS" and "HH:MM:SS" strings, including times past 24:00:00, are
+    parsed by a NumPy kernel over the fixed-width character codes: seconds
+    and minutes sit at fixed offsets from the end of each string and the
+    hours are whatever precedes them. Each distinct value is parsed once.
+    Blank values become NaN, plain numbers are taken as seconds and the few
+    values that fit neither (stray whitespace) fall back to the scalar parser.
+
+    Args:
+        values: Series or array of GTFS time strings or seconds
+
+    Returns:
+        np.ndarray: float32 seconds since midnight
+    """
+    series = pd.Series(values, copy=False)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=np.float32)
+
+    # Feeds repeat the same few thousand times, so parse each distinct one once
+    value_codes, uniques = pd.factorize(series)
+    times = _parse_time_strings(np.asarray(uniques, dtype=object))
+    # Missing values have code -1 and pick up the trailing NaN
+    return np.append(times, np.float32(np.nan))[value_codes]
+
+
+def _parse_time_strings(values: np.ndarray) -> np.ndarray:
+    strings = pd.Series(values, dtype=object).fillna("").to_numpy(dtype=str)
+    n = len(strings)
+    width = strings.dtype.itemsize // 4
+    codes = strings.view(np.uint32).reshape(n, width).astype(np.int64) - ord("0")
+    lengths = np.count_nonzero(codes != -ord("0"), axis=1)
+    rows = np.arange(n)
+
+    def from_end(offset):
+        return codes[rows, np.clip(lengths - offset, 0, width - 1)]
+
+    colon = ord(":") - ord("0")
+    digits = [from_end(offset) for offset in (1, 2, 4, 5)]
+    parsed = (lengths >= 7) & (from_end(3) == colon) & (from_end(6) == colon)
+    for digit in digits:
+        parsed &= (digit >= 0) & (digit <= 9)
+    seconds = digits[1] * 10 + digits[0]
+    minutes = digits[3] * 10 + digits[2]
+
+    hours = np.zeros(n, dtype=np.int64)
+    for position in range(width - 6):
+        in_hours = position < lengths - 6
+        digit = codes[:, position]
+        parsed &= ~in_hours | ((digit >= 0) & (digit <= 9))
+        hours = np.where(in_hours, hours * 10 + digit, hours)
+
+    times = (hours * 3600 + minutes * 60 + seconds).astype(np.float32)
+    times[~parsed] = np.nan
+    # Times already stored as seconds, e.g. "45296" or "45296.0"
+    pending = np.flatnonzero(~parsed & (lengths > 0))
+    times[pending] = pd.to_numeric(strings[pending], errors="coerce")
+    for i in pending[np.isnan(times[pending])]:
+        times[i] = _parse_time_value(values[i])
+    return times
+
+
+def parse_gtfs_dates(values) -> np.ndarray:
+    """
+    Parse a column of GTFS dates ("YYYYMMDD" or "YYYY-MM-DD") to datetime64[D].
+
+    Blank values become NaT and anything else that is not a date raises.
+    """
+    series = pd.Series(values, copy=False)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.to_numpy(dtype="datetime64[D]")
+
+    parsed = pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]")
+    pending = series.notna() & (series.astype(str).str.strip() != "")
+    for date_format in [DATE_FORMAT, DATE_FORMAT_ALT]:
+        if not pending.any():
+            break
+        parsed[pending] = pd.to_datetime(
+            series[pending].astype(str).str.strip(), format=date_format, errors="coerce"
+        )
+        pending &= parsed.isna()
+    if pending.any():
+        # datetime.date values pass through, anything else is malformed
+        for i in np.flatnonzero(pending):
+            parsed.iat[i] = pd.Timestamp(_parse_date_value(series.iat[i]))
+    return parsed.to_numpy(dtype="datetime64[D]")
+
+
+def _parse_time_value(val: Any) -> np.float32:
+    if isinstance(val, (float, np.float32)) or pd.isna(val):
+        return val
+    if not str(val).strip():
+        return np.nan
+    try:
+        return np.float32(val)
+    except ValueError:
+        h, m, s = map(float, str(val).strip().split(":"))
+        return np.float32(h * 3600 + m * 60 + s)
+
+
+def _parse_date_value(val: str) -> datetime.date:
+    if isinstance(val, datetime.date):
+        return val
+    for date_format in [DATE_FORMAT, DATE_FORMAT_ALT]:
+        try:
+            return datetime.datetime.strptime(val, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Unable to parse date: {val}")
+
+
+# Integer fields holding counts, orders or durations rather than small enums
+WIDE_INTEGER_FIELDS = {
+    "stop_sequence",
+    "shape_pt_sequence",
+    "route_sort_order",
+    "headway_secs",
+    "min_transfer_time",
+    "transfer_duration",
+    "duration_limit",
+    "transfer_count",
+    "rule_priority",
+    "traversal_time",
+    "stair_count",
+    "prior_notice_duration_min",
+    "prior_notice_duration_max",
+}
+
+
+def compact_dtype(file_name: str, field: str) -> Optional[str]:
+    """
+    Compact dtype for a GTFS field, from its type in
+    GTFS_FILE_FIELD_TYPE_MAPPING: "category" for IDs, "int8" for enums and
+    "int32" for other integers and for times in seconds. None keeps the
+    field as it is.
+    """
+    field_type = GTFS_FILE_FIELD_TYPE_MAPPING.get(file_name, {}).get(field)
+    if field_type is None:
+        return None
+    if field_type == "string" and field.endswith("_id"):
+        return "category"
+    if field_type == "integer":
+        return "int32" if field in WIDE_INTEGER_FIELDS else "int8"
+    if field_type.startswith("time"):
+        return "int32"
+    return None
+
+
+def apply_compact_dtypes(df: pd.DataFrame, file_name: str) -> pd.DataFrame:
+    """
+    Convert the columns of a GTFS table to their `compact_dtype`, in place.
+
+    Integer columns with missing values use the nullable "Int8"/"Int32"
+    dtypes. A column that does not fit its compact dtype (non-numeric or
+    fractional values, or out of range) is left unchanged.
+
+    Args:
+        df (pd.DataFrame): Table read from `file_name`
+        file_name (str): GTFS file name, e.g. "stop_times.txt"
+
+    Returns:
+        pd.DataFrame: The same DataFrame
+    """
+    for column in df.columns:
+        dtype = compact_dtype(file_name, column)
+        if dtype is None:
+            continue
+        values = df[column]
+        if dtype == "category":
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                df[column] = values.astype("category")
+            continue
+        numeric = pd.to_numeric(values, errors="coerce")
+        valid = numeric.dropna()
+        info = np.iinfo(dtype)
+        if (
+            numeric.isna().sum() != values.isna().sum()
+            or (valid % 1 != 0).any()
+            or (len(valid) and (valid.min() < info.min or valid.max() > info.max))
+        ):
+            continue
+        if len(valid) < len(numeric):
+            dtype = dtype.capitalize()
+        df[column] = numeric.astype(dtype)
+    return df
+
+
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+
+def build_service_calendar(
+    calendar: Optional[pd.DataFrame], calendar_dates: Optional[pd.DataFrame]
+) -> pd.DataFrame:
+    """
+    Which services run on each date of the feed's validity window.
+
+    The weekly patterns of calendar.txt are expanded over each service's
+    start and end dates, then the calendar_dates.txt exceptions are applied
+    (1 adds the service on that date, 2 removes it).
+
+    Args:
+        calendar (Optional[pd.DataFrame]): feed.calendar, or None
+        calendar_dates (Optional[pd.DataFrame]): feed.calendar_dates, or None
+
+    Returns:
+        pd.DataFrame: Boolean bitmap with a DatetimeIndex named "date"
+            covering every day from the first to the last service date and
+            one column per service_id
+    """
+    tables = [t for t in (calendar, calendar_dates) if t is not None and len(t)]
+    service_ids = sorted(
+        set().union(*(t.service_id.astype(str).unique() for t in tables))
+    )
+    if calendar is not None and len(calendar):
+        starts = pd.to_datetime(calendar.start_date).to_numpy("datetime64[D]")
+        ends = pd.to_datetime(calendar.end_date).to_numpy("datetime64[D]")
+    else:
+        starts = ends = np.array([], dtype="datetime64[D]")
+    if calendar_dates is not None and len(calendar_dates):
+        exceptions = calendar_dates.assign(
+            date=pd.to_datetime(calendar_dates.date).to_numpy("datetime64[D]")
+        ).dropna(subset=["date"])
+    else:
+        exceptions = pd.DataFrame(columns=["service_id", "date", "exception_type"])
+    bounds = np.concatenate([starts, ends, exceptions.date.to_numpy("datetime64[D]")])
+    bounds = bounds[~np.isnat(bounds)]
+    if not len(bounds):
+        return pd.DataFrame(
+            columns=service_ids,
+            index=pd.DatetimeIndex([], dtype="datetime64[ns]", name="date"),
+            dtype=bool,
+        )
+
+    dates = np.arange(bounds.min(), bounds.max() + 1)
+    columns = {service_id: i for i, service_id in enumerate(service_ids)}
+    bitmap = np.zeros((len(dates), len(service_ids)), dtype=bool)
+    if len(starts):
+        # weekday() of 1970-01-01 is 3 (Thursday)
+        weekdays = (dates.astype(np.int64) + 3) % 7
+        runs_on = calendar[WEEKDAYS].to_numpy(dtype=bool)[:, weekdays]
+        in_range = (dates >= starts[:, None]) & (dates <= ends[:, None])
+        rows = calendar.service_id.astype(str).map(columns).to_numpy()
+        # A service_id listed twice runs on the union of its patterns
+        np.logical_or.at(bitmap.T, rows, runs_on & in_range)
+    for exception_type, runs in [(1, True), (2, False)]:
+        added = exceptions[exceptions.exception_type == exception_type]
+        day = (added.date.to_numpy("datetime64[D]") - dates[0]).astype(np.int64)
+        bitmap[day, added.service_id.astype(str).map(columns).to_numpy()] = runs
+
+    return pd.DataFrame(
+        bitmap,
+        index=pd.DatetimeIndex(dates.astype("datetime64[ns]"), name="date"),
+        columns=service_ids,
+    )
+
+
+def _service_calendar(feed) -> pd.DataFrame:
+    """feed.service_calendar, built on the fly for feeds loaded without one."""
+    service_calendar = getattr(feed, "service_calendar", None)
+    if service_calendar is None:
+        service_calendar = build_service_calendar(
+            getattr(feed, "calendar", None), getattr(feed, "calendar_dates", None)
+        )
+    return service_calendar
+
+
+def active_service_ids(feed, date) -> list:
+    """
+    Service IDs running on a date, with calendar_dates exceptions applied.
+
+    Args:
+        feed: GTFS feed
+        date: A datetime.date, datetime, pd.Timestamp or "YYYYMMDD" /
+            "YYYY-MM-DD" string
+
+    Returns:
+        list: The service_ids active on that date, empty outside the feed's
+            validity window
+    """
+    service_calendar = _service_calendar(feed)
+    day = pd.Timestamp(date).normalize()
+    if day not in service_calendar.index:
+        return []
+    row = service_calendar.loc[day]
+    return row.index[row.to_numpy(dtype=bool)].tolist()
+
+
+def active_trips(feed, date) -> pd.DataFrame:
+    """
+    Trips running on a date, with calendar_dates exceptions applied.
+
+    Args:
+        feed: GTFS feed
+        date: A datetime.date, datetime, pd.Timestamp or "YYYYMMDD" /
+            "YYYY-MM-DD" string
+
+    Returns:
+        pd.DataFrame: The rows of feed.trips whose service runs on that date
+    """
+    service_ids = active_service_ids(feed, date)
+    return feed.trips[feed.trips.service_id.astype(str).isin(service_ids)]
+
+
+def build_departure_index(stop_times: pd.DataFrame) -> tuple:
+    """
+    Index stop_times by stop and departure time for binary-search lookups.
+
+    Stop times without a departure time are left out.
+
+    Args:
+        stop_times (pd.DataFrame): feed.stop_times with departure_time in seconds
+
+    Returns:
+        tuple: (stop_departures, stop_departure_offsets)
+            - stop_departures: `departure_time` and the positional `row` of
+              each stop time in stop_times, sorted by (stop_id, departure_time)
+            - stop_departure_offsets: indexed by stop_id, the `start` and
+              `end` positions of that stop's departures in stop_departures
+    """
+    departures = stop_times.departure_time.to_numpy(dtype=np.float64, na_value=np.nan)
+    rows = np.flatnonzero(~np.isnan(departures))
+    stop_codes, stop_ids = pd.factorize(
+        stop_times.stop_id.astype(str).to_numpy()[rows], sort=True
+    )
+    order = np.lexsort((departures[rows], stop_codes))
+    stop_codes = stop_codes[order]
+    rows = rows[order]
+    codes = np.arange(len(stop_ids))
+    stop_departures = pd.DataFrame(
+        {"departure_time": departures[rows], "row": rows.astype(np.int64)}
+    )
+    stop_departure_offsets = pd.DataFrame(
+        {
+            "start": np.searchsorted(stop_codes, codes, side="left"),
+            "end": np.searchsorted(stop_codes, codes, side="right"),
+        },
+        index=pd.Index(stop_ids, name="stop_id"),
+    )
+    return stop_departures, stop_departure_offsets
+
+
+# Memory budget of the shared snap cache, in bytes
+SNAP_CACHE_MAX_BYTES = 128 * 2**20
+
+
+class SnapCache:
+    """
+    Bounded LRU cache of per-shape cKDTrees and stop pattern snaps.
+
+    Trees are keyed on (shape_id, shape hash) and snaps on (shape_id, pattern
+    hash), where the pattern hash covers the shape geometry, the stop
+    coordinates and k_neighbors. A shape_id reused by another feed with a
+    different geometry therefore misses instead of returning stale snaps.
+    Least recently used entries are evicted once `max_bytes` is exceeded, so
+    memory stays flat however many feeds are built in one process.
+    """
+
+    def __init__(self, max_bytes: int = SNAP_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def _put(self, key, value, nbytes: int):
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self.nbytes -= evicted_bytes
+
+    def tree(
+        self, shape_id, shape_coords: np.ndarray, shape_digest: Optional[bytes] = None
+    ) -> cKDTree:
+        """
+        Return the cKDTree of a shape, building it on a miss. `shape_digest`
+        is the shape's _array_digest if the caller already has it.
+        """
+        shape_digest = shape_digest or _array_digest(shape_coords)
+        key = ("tree", shape_id, shape_digest)
+        tree = self._get(key)
+        if tree is None:
+            tree = cKDTree(data=shape_coords)
+            # Points and index are copied into the tree, nodes cost about as much
+            self._put(key, tree, 2 * (tree.data.nbytes + tree.indices.nbytes))
+        return tree
+
+    def snap(
+        self,
+        shape_id,
+        shape_coords: np.ndarray,
+        stops: np.ndarray,
+        k_neighbors=3,
+        shape_digest: Optional[bytes] = None,
+    ) -> Optional[np.ndarray]:
+        """
+        Return the snap indices of one stop pattern, solving it on a miss.
+        Pass the shape's `shape_digest` when snapping several patterns of one
+        shape, so its points are hashed once rather than per pattern.
+        """
+        shape_digest = shape_digest or _array_digest(shape_coords)
+        pattern_hash = _array_digest(stops, shape_digest, str(k_neighbors).encode())
+        key = ("snap", shape_id, pattern_hash)
+        if key in self._entries:
+            return self._get(key)
+        self.misses += 1
+        points = process_stop_sequence(
+            stops, self.tree(shape_id, shape_coords, shape_digest), k_neighbors
+        )
+        if points is not None:
+            points = np.asarray(points, dtype=np.int64)
+        self._put(key, points, 64 + (points.nbytes if points is not None else 0))
+        return points
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+        }
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+def _array_digest(array: np.ndarray, *extra: bytes) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    for part in extra:
+        digest.update(part)
+    return digest.digest()
+
+
+snap_cache = SnapCache()
+
+
+# Zip members each cached build stage reads, directly or through feed.clean()
+# (which drops services and stops that no trip uses)
+BUILD_STAGE_INPUTS = {
+    "shape_distances": ["shapes.txt"],
+    "stop_distances": ["stop_times.txt", "trips.txt", "stops.txt", "shapes.txt"],
+    "parse_times": [
+        "stop_times.txt",
+        "trips.txt",
+        "stops.txt",
+        "shapes.txt",
+        "timeframes.txt",
+    ],
+    "parse_dates": [
+        "calendar.txt",
+        "calendar_dates.txt",
+        "feed_info.txt",
+        "trips.txt",
+        "stop_times.txt",
+    ],
+}
+# Feed tables each cached build stage produces
+BUILD_STAGE_OUTPUTS = {
+    "shape_distances": ["shapes"],
+    "stop_distances": ["stop_times"],
+    "parse_times": ["stop_times", "timeframes"],
+    "parse_dates": ["calendar", "calendar_dates", "feed_info"],
+}
+# Bump when a stage's computation changes so older cached results are unused
+BUILD_STAGE_VERSION = 1
+
+
+def hash_zip_members(gtfs_path: str) -> Dict[str, str]:
+    """
+    Content hash of every GTFS file in a zip, keyed by file name.
+
+    Files in a subfolder are keyed by their base name, and macOS resource
+    forks are skipped, so the keys match the table files gtfs_kit reads.
+
+    Args:
+        gtfs_path (str): Path to the gtfs.zip
+
+    Returns:
+        Dict[str, str]: blake2b hex digest per file name
+    """
+    hashes = {}
+    with zipfile.ZipFile(gtfs_path) as zf:
+        for info in zf.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or "__MACOSX" in info.filename or name.startswith("._"):
+                continue
+            digest = hashlib.blake2b(digest_size=16)
+            with zf.open(info) as f:
+                for block in iter(lambda: f.read(2**20), b""):
+                    digest.update(block)
+            hashes[name] = digest.hexdigest()
+    return hashes
+
+
+# Rows of stop_times.txt read at a time when streaming a build
+STOP_TIMES_CHUNK_ROWS = 100_000
+
+
+def stream_dtypes(file_name: str) -> defaultdict:
+    """
+    Fixed read dtypes for streaming a GTFS file in chunks, from the field
+    types in GTFS_FILE_FIELD_TYPE_MAPPING. Every chunk must come out with the
+    same column types, so nothing is inferred: integers are nullable "Int64",
+    floats are "float64" and everything else, unknown fields included, is
+    read as strings.
+
+    Args:
+        file_name (str): GTFS file name, e.g. "stop_times.txt"
+
+    Returns:
+        defaultdict: dtype per column, for pd.read_csv
+    """
+    dtypes = defaultdict(lambda: str)
+    for field, field_type in GTFS_FILE_FIELD_TYPE_MAPPING.get(file_name, {}).items():
+        if field_type == "integer":
+            dtypes[field] = "Int64"
+        elif field_type.startswith("float"):
+            dtypes[field] = "float64"
+    return dtypes
+
+
+def iter_trip_chunks(chunks):
+    """
+    Re-cut a stream of stop_times chunks so that rows of the same trip that
+    are contiguous in the file land in the same chunk. The trailing run of a
+    chunk's last trip is carried over to the next chunk.
+
+    Args:
+        chunks: Iterable of stop_times DataFrames, e.g. from
+            pd.read_csv(..., chunksize=n)
+
+    Yields:
+        pd.DataFrame: Chunks with a fresh RangeIndex
+    """
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        trip_ids = chunk["trip_id"].to_numpy()
+        others = trip_ids[::-1] != trip_ids[-1]
+        if not others.any():
+            # The whole chunk is a single trip so far
+            carry = chunk
+            continue
+        split = len(trip_ids) - int(np.argmax(others))
+        carry = chunk.iloc[split:]
+        yield chunk.iloc[:split].reset_index(drop=True)
+    if carry is not None and len(carry):
+        yield carry.reset_index(drop=True)
+
+
+def process_stop_sequence(stops, tree: cKDTree, k_neighbors=3):
     geo_const = 6371000 * np.pi / 180
-    tree = cKDTree(data=shape_coords)
 
     if len(stops) <= 1:
         return None
@@ -50,33 +765,324 @@ def process_stop_sequence(stops, shape_coords, k_neighbors=3):
             return points
 
 
+def sort_stop_times(stop_times: pd.DataFrame) -> pd.DataFrame:
+    """stop_times sorted by (trip_id, stop_sequence), with a fresh RangeIndex."""
+    return stop_times.sort_values(
+        ["trip_id", "stop_sequence"], kind="stable"
+    ).reset_index(drop=True)
+
+
+def trip_offsets(trip_ids: np.ndarray) -> tuple:
+    """
+    Start and end positions of each run of equal trip IDs.
+
+    Args:
+        trip_ids (np.ndarray): trip_id of each row, grouped by trip
+
+    Returns:
+        tuple: (starts, ends) arrays, one entry per run
+    """
+    if not len(trip_ids):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, trip_ids[1:] != trip_ids[:-1]])
+    ends = np.r_[starts[1:], len(trip_ids)]
+    return starts, ends
+
+
+def build_trip_index(stop_times: pd.DataFrame, first_row: int = 0) -> pd.DataFrame:
+    """
+    Offsets of each trip's rows in a stop_times table grouped by trip, as
+    sort_stop_times leaves it, so a trip's stop times are the slice
+    `stop_times.iloc[start:end]`.
+
+    Args:
+        stop_times (pd.DataFrame): Stop times grouped by trip_id
+        first_row (int): Position of the table's first row, for a chunk of
+            a larger table
+
+    Returns:
+        pd.DataFrame: `start` and `end` positions indexed by trip_id
+
+    Raises:
+        ValueError: If the rows of a trip are not contiguous
+    """
+    trip_ids = stop_times.trip_id.astype(str).to_numpy()
+    starts, ends = trip_offsets(trip_ids)
+    index = pd.Index(trip_ids[starts], name="trip_id")
+    if not index.is_unique:
+        raise ValueError("stop_times is not grouped by trip_id")
+    return pd.DataFrame(
+        {"start": starts + first_row, "end": ends + first_row}, index=index
+    )
+
+
+def slice_positions(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Row positions start, start + 1, ..., end - 1 of every slice, in one array."""
+    lengths = np.asarray(ends, dtype=np.int64) - np.asarray(starts, dtype=np.int64)
+    offsets = np.asarray(starts, dtype=np.int64) - np.cumsum(lengths) + lengths
+    return np.repeat(offsets, lengths) + np.arange(lengths.sum())
+
+
+# Time columns of stop_times and their name in stop_patterns, relative to the trip start
+PATTERN_TIME_COLUMNS = {
+    "arrival_time": "arrival_offset",
+    "departure_time": "departure_offset",
+}
+
+
+def _shift_times(times: pd.Series, seconds: np.ndarray) -> pd.Series:
+    """Add seconds to a time column, keeping its dtype."""
+    shifted = times.to_numpy(dtype=np.float64, na_value=np.nan) + seconds
+    return pd.Series(shifted, index=times.index).astype(times.dtype)
+
+
+def build_stop_patterns(stop_times: pd.DataFrame) -> tuple:
+    """
+    Compress stop_times into the unique timed stop patterns of its trips.
+
+    Trips that visit the same stops with the same running times (and the
+    same values in every other column) share one pattern and differ only in
+    their start time. materialize_stop_times rebuilds the flat table exactly.
+
+    Args:
+        stop_times (pd.DataFrame): Stop times sorted by (trip_id, stop_sequence)
+
+    Returns:
+        tuple: A tuple containing:
+            - pd.DataFrame: stop_patterns, the rows of every pattern with
+              `pattern_id` in place of trip_id and `arrival_offset`/
+              `departure_offset` seconds since the trip start in place of
+              the times, sorted by pattern_id
+            - pd.DataFrame: trip_patterns, the `trip_id`, `pattern_id` and
+              `start_time` of every trip in stop_times order
+    """
+    starts, ends = trip_offsets(stop_times.trip_id.astype(str).to_numpy())
+    lengths = ends - starts
+    time_columns = [column for column in PATTERN_TIME_COLUMNS if column in stop_times]
+    # A trip starts at its earliest time, trips without times at 0
+    start_time = np.full(len(starts), np.nan)
+    for column in time_columns:
+        values = stop_times[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        if len(starts):
+            start_time = np.fmin(start_time, np.fmin.reduceat(values, starts))
+    start_time = np.nan_to_num(start_time)
+
+    patterns = stop_times.drop(columns="trip_id").rename(columns=PATTERN_TIME_COLUMNS)
+    shift = np.repeat(-start_time, lengths)
+    for column in time_columns:
+        offset = PATTERN_TIME_COLUMNS[column]
+        patterns[offset] = _shift_times(patterns[offset], shift)
+
+    # Number each distinct row, a trip's pattern is then its sequence of rows
+    row_codes = (
+        patterns.groupby(
+            list(patterns.columns), dropna=False, sort=False, observed=True
+        )
+        .ngroup()
+        .to_numpy()
+    )
+    pattern_of_key, first_trips = {}, []
+    pattern_ids = np.empty(len(starts), dtype=np.int64)
+    for trip, (start, end) in enumerate(zip(starts, ends)):
+        key = row_codes[start:end].tobytes()
+        if key not in pattern_of_key:
+            pattern_of_key[key] = len(first_trips)
+            first_trips.append(trip)
+        pattern_ids[trip] = pattern_of_key[key]
+
+    first_trips = np.array(first_trips, dtype=np.int64)
+    rows = slice_positions(starts[first_trips], ends[first_trips])
+    stop_patterns = patterns.iloc[rows].reset_index(drop=True)
+    stop_patterns.insert(
+        int(stop_times.columns.get_loc("trip_id")),
+        "pattern_id",
+        np.repeat(np.arange(len(first_trips)), lengths[first_trips]),
+    )
+    trip_patterns = pd.DataFrame(
+        {
+            "trip_id": stop_times.trip_id.iloc[starts].reset_index(drop=True),
+            "pattern_id": pattern_ids,
+            "start_time": start_time,
+        }
+    )
+    return stop_patterns, trip_patterns
+
+
+def materialize_stop_times(
+    stop_patterns: pd.DataFrame,
+    trip_patterns: pd.DataFrame,
+    nrows: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Rebuild the flat stop_times table from build_stop_patterns' output.
+
+    Args:
+        stop_patterns (pd.DataFrame): Rows of every pattern, by pattern_id
+        trip_patterns (pd.DataFrame): Pattern and start time of every trip
+        nrows (Optional[int]): Rebuild only the first nrows rows
+
+    Returns:
+        pd.DataFrame: stop_times sorted by (trip_id, stop_sequence)
+    """
+    pattern_starts, pattern_ends = trip_offsets(stop_patterns.pattern_id.to_numpy())
+    pattern_ids = trip_patterns.pattern_id.to_numpy()
+    starts, ends = pattern_starts[pattern_ids], pattern_ends[pattern_ids]
+    if nrows is not None:
+        trips = np.searchsorted(np.cumsum(ends - starts), nrows) + 1
+        trip_patterns = trip_patterns.iloc[:trips]
+        starts, ends = starts[:trips], ends[:trips]
+
+    stop_times = stop_patterns.iloc[slice_positions(starts, ends)].reset_index(
+        drop=True
+    )
+    trips = np.repeat(np.arange(len(trip_patterns)), ends - starts)
+    stop_times["pattern_id"] = trip_patterns.trip_id.iloc[trips].reset_index(drop=True)
+    shift = trip_patterns.start_time.to_numpy(dtype=np.float64)[trips]
+    for offset in PATTERN_TIME_COLUMNS.values():
+        if offset in stop_times:
+            stop_times[offset] = _shift_times(stop_times[offset], shift)
+    stop_times = stop_times.rename(
+        columns={
+            "pattern_id": "trip_id",
+            **{offset: column for column, offset in PATTERN_TIME_COLUMNS.items()},
+        }
+    )
+    return stop_times if nrows is None else stop_times.head(nrows)
+
+
+def derived_tables(feed) -> list:
+    """
+    Tables of a feed that are rebuilt from others on first access, and left
+    out of pickles and artifacts: stop_times of a feed holding trip patterns.
+    """
+    return ["stop_times"] if hasattr(feed, "trip_patterns") else []
+
+
+def _materialize_feed_stop_times(feed, nrows: Optional[int] = None) -> pd.DataFrame:
+    return materialize_stop_times(feed.stop_patterns, feed.trip_patterns, nrows)
+
+
+def with_lazy_stop_times(feed: gk.Feed) -> gk.Feed:
+    """
+    Make `feed.stop_times` of a feed holding trip patterns (see
+    build_stop_patterns) available, rebuilt the first time it is accessed.
+
+    Args:
+        feed (gk.Feed): A feed with `stop_patterns` and `trip_patterns`
+
+    Returns:
+        gk.Feed: The feed as a LazyFeed, or unchanged if it has no trip
+            patterns or already has stop_times
+    """
+    if (
+        not derived_tables(feed)
+        or vars(feed).get("stop_times") is not None
+        or "stop_times" in getattr(feed, "pending_tables", [])
+    ):
+        return feed
+    if not isinstance(feed, LazyFeed):
+        feed = LazyFeed.from_feed(feed)
+    feed.add_lazy_table("stop_times", partial(_materialize_feed_stop_times, feed))
+    return feed
+
+
+def stop_time_rows(feed) -> int:
+    """
+    Number of rows of `feed.stop_times`, without reading or rebuilding it
+    when it has not been yet.
+
+    Args:
+        feed (gk.Feed): A loaded feed
+
+    Returns:
+        int: Rows of stop_times, 0 if the feed has none
+    """
+    if "stop_times" not in getattr(feed, "pending_tables", []):
+        stop_times = getattr(feed, "stop_times", None)
+        return 0 if stop_times is None else len(stop_times)
+    trip_index = getattr(feed, "trip_stop_offsets", None)
+    if trip_index is not None and len(trip_index):
+        return int(trip_index.end.max())
+    if derived_tables(feed):
+        pattern_rows = feed.stop_patterns.pattern_id.value_counts()
+        return int(feed.trip_patterns.pattern_id.map(pattern_rows).sum())
+    return len(feed.stop_times)
+
+
 def nearest_points(
-    stop_df: pd.DataFrame, shape_points: pd.DataFrame, k_neighbors: int = 3
+    stop_df: pd.DataFrame,
+    shape_id: str,
+    shape_coords: np.ndarray,
+    k_neighbors: int = 3,
+    cache: Optional[SnapCache] = None,
 ) -> pd.DataFrame:
-    stop_df = stop_df.copy()
-    stop_df["snap_start_id"] = -1
+    """
+    Snap the stops of every trip on one shape to indices of `shape_coords`.
 
-    shape_coords = np.array([point.coords[0] for point in shape_points]).reshape(-1, 2)
+    Trips that visit the same stops in the same order share a stop pattern, so
+    each distinct pattern is solved once and its snap indices are broadcast to
+    all of its trips in a single assignment.
 
-    failed_trips = []
-    total_trips = 0
-    defective_trips = 0
+    Args:
+        stop_df (pd.DataFrame): Stop times of the shape's trips with `stop_lon`
+            and `stop_lat` columns
+        shape_id (str): The shape the trips run on
+        shape_coords (np.ndarray): (lon, lat) shape points in sequence order
+        k_neighbors (int): Initial number of candidate shape points per stop
+        cache (SnapCache): Cache of trees and snaps, the shared `snap_cache`
+            if None
 
-    for name, group in stop_df.groupby("trip_id"):
-        total_trips += 1
-        stops = tuple(x.coords[0] for x in group["geometry"])
+    Returns:
+        pd.DataFrame: `stop_df` ordered by trip and stop_sequence with a
+            `snap_start_id` column, without the trips that could not be snapped
+    """
+    stop_df = sort_stop_times(stop_df)
+    trip_ids = stop_df["trip_id"].to_numpy()
+    trip_starts, trip_ends = trip_offsets(trip_ids)
+    trip_lengths = trip_ends - trip_starts
 
-        points = process_stop_sequence(
-            stops, tuple(map(tuple, shape_coords)), k_neighbors
-        )
+    stop_ids = stop_df["stop_id"].to_numpy()
+    pattern_codes = {}
+    trip_patterns = np.array(
+        [
+            pattern_codes.setdefault(
+                tuple(stop_ids[start : start + length]), len(pattern_codes)
+            )
+            for start, length in zip(trip_starts, trip_lengths)
+        ],
+        dtype=np.int64,
+    )
+    # First trip of each pattern stands in for all of them
+    pattern_trips = np.unique(trip_patterns, return_index=True)[1]
 
+    cache = snap_cache if cache is None else cache
+    stop_coords = stop_df[["stop_lon", "stop_lat"]].to_numpy(dtype=float)
+    shape_digest = _array_digest(shape_coords)
+    pattern_snaps = []
+    failed_patterns = np.zeros(len(pattern_trips), dtype=bool)
+    for code, trip in enumerate(pattern_trips):
+        start, length = trip_starts[trip], trip_lengths[trip]
+        stops = stop_coords[start : start + length]
+        points = cache.snap(shape_id, shape_coords, stops, k_neighbors, shape_digest)
         if points is None:
-            failed_trips.append(name)
-            defective_trips += 1
-            print(f"Excluding Trip: {name} due to processing failure")
-        else:
-            stop_df.loc[stop_df.trip_id == name, "snap_start_id"] = points
+            failed_patterns[code] = True
+            points = np.full(length, -1, dtype=np.int64)
+        pattern_snaps.append(points)
+
+    # Row i of a trip takes element i of its pattern's snap indices
+    pattern_offsets = np.r_[0, np.cumsum(trip_lengths[pattern_trips])[:-1]]
+    row_patterns = np.repeat(trip_patterns, trip_lengths)
+    row_positions = np.arange(len(stop_df)) - np.repeat(trip_starts, trip_lengths)
+    stop_df["snap_start_id"] = np.concatenate(pattern_snaps)[
+        pattern_offsets[row_patterns] + row_positions
+    ]
 
+    total_trips = len(trip_starts)
+    failed_trips = trip_ids[trip_starts][failed_patterns[trip_patterns]]
+    for name in failed_trips:
+        print(f"Excluding Trip: {name} due to processing failure")
+
+    defective_trips = len(failed_trips)
     if defective_trips > 0:
         percent_defective = (defective_trips / total_trips) * 100
         print(f"Total defective trips: {defective_trips}")
@@ -86,147 +1092,685 @@ def nearest_points(
     return stop_df
 
 
+def _copy_lazy_table(feed: "LazyFeed", name: str, nrows: Optional[int] = None):
+    """Table loader of a copied LazyFeed, reading through the original feed."""
+    if nrows is not None:
+        return feed.peek(name, nrows)
+    return copy.deepcopy(getattr(feed, name))
+
+
+class LazyFeed(gk.Feed):
+    """
+    A gk.Feed whose tables are read the first time they are accessed and
+    then kept.
+
+    A table is registered with `add_lazy_table` as a function returning the
+    DataFrame, or only its first `nrows` rows when given. Until then the
+    table costs nothing, `hasattr(feed, name)` still reports it, and `peek`
+    returns its first rows for prompt generation without reading the rest.
+    """
+
+    def __init__(self, dist_units: str):
+        super().__init__(dist_units=dist_units)
+        self._lazy_tables = {}
+        self._lazy_lock = threading.RLock()
+
+    @classmethod
+    def from_feed(cls, feed: gk.Feed) -> "LazyFeed":
+        """Wrap the tables of an already loaded feed, without copying them."""
+        lazy = cls.__new__(cls)
+        lazy.__dict__.update(vars(feed))
+        lazy._lazy_tables = {}
+        lazy._lazy_lock = threading.RLock()
+        return lazy
+
+    def add_lazy_table(self, name: str, load: Callable[..., pd.DataFrame]):
+        """
+        Register a table to be read on first access.
+
+        Args:
+            name (str): Table name, e.g. "fare_rules" for `feed.fare_rules`
+            load (Callable): `load(nrows=None)` returning the table
+        """
+        with self._lazy_lock:
+            # Drop the None placeholder (and derived index) set by gk.Feed so
+            # that accessing the table falls through to __getattr__
+            for attr in [name, f"_{name}", f"_{name}_i"]:
+                self.__dict__.pop(attr, None)
+            self._lazy_tables[name] = load
+
+    def __getattr__(self, name: str):
+        # Only called when normal lookup fails, so loaded tables cost nothing
+        pending = self.__dict__.get("_lazy_tables")
+        table = name.lstrip("_")
+        if table.endswith("_i"):
+            table = table[:-2]
+        if pending and table in pending:
+            self._load_lazy_table(table)
+            return getattr(self, name)
+        raise AttributeError(
+            f"{type(self).__name__!r} object has no attribute {name!r}"
+        )
+
+    def __delattr__(self, name: str):
+        # Deleting a table that was never read only forgets how to read it
+        with self._lazy_lock:
+            if self._lazy_tables.pop(name, None) is not None:
+                return
+        super().__delattr__(name)
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(self._lazy_tables))
+
+    def _load_lazy_table(self, name: str):
+        with self._lazy_lock:
+            # Another thread may have loaded it while we waited
+            load = self._lazy_tables.get(name)
+            if load is None:
+                return
+            try:
+                setattr(self, name, load())
+            except Exception as e:
+                # Leave the table absent, as an eager load would have
+                print(f"Could not load {name} due to {e}")
+            del self._lazy_tables[name]
+
+    @property
+    def pending_tables(self) -> list:
+        """Names of the tables that have not been read yet."""
+        return list(self._lazy_tables)
+
+    def peek(self, name: str, nrows: int = 5) -> pd.DataFrame:
+        """First `nrows` rows of a table, reading only those if it is not loaded."""
+        load = self._lazy_tables.get(name)
+        if load is None:
+            return getattr(self, name).head(nrows)
+        return load(nrows=nrows)
+
+    def load_all(self, skip: Iterable[str] = ()) -> "LazyFeed":
+        """Read every pending table, except those in `skip`."""
+        for name in self.pending_tables:
+            if name not in skip:
+                getattr(self, name)
+        return self
+
+    def to_feed(self, skip: Iterable[str] = ()) -> gk.Feed:
+        """
+        A plain gk.Feed sharing this feed's tables, all of them loaded
+        except those in `skip`, which it leaves out.
+        """
+        self.load_all(skip)
+        left_out = {"_lazy_tables", "_lazy_lock"}
+        left_out.update(attr for name in skip for attr in [name, f"_{name}"])
+        feed = gk.Feed.__new__(gk.Feed)
+        feed.__dict__.update(
+            {key: value for key, value in vars(self).items() if key not in left_out}
+        )
+        return feed
+
+    def __deepcopy__(self, memo):
+        clone = self.__class__.__new__(self.__class__)
+        memo[id(self)] = clone
+        with self._lazy_lock:
+            pending = self.pending_tables
+            state = {
+                key: value
+                for key, value in vars(self).items()
+                if key not in ("_lazy_tables", "_lazy_lock")
+            }
+        clone.__dict__.update(copy.deepcopy(state, memo))
+        clone._lazy_lock = threading.RLock()
+        # The copy reads through this feed, which keeps the table for later copies
+        clone._lazy_tables = {
+            name: partial(_copy_lazy_table, self, name) for name in pending
+        }
+        return clone
+
+    def __getstate__(self):
+        self.load_all()
+        state = self.__dict__.copy()
+        del state["_lazy_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lazy_lock = threading.RLock()
+
+
+def _copy_on_write_enabled() -> bool:
+    """Whether pandas copy-on-write mode is on, as it always is from pandas 3."""
+    major = int(pd.__version__.split(".")[0])
+    return major >= 3 or pd.options.mode.copy_on_write is True
+
+
+def _view_table(feed: gk.Feed, name: str, nrows: Optional[int] = None):
+    """Table loader of a feed view, copying the table of the viewed feed."""
+    if nrows is not None:
+        if isinstance(feed, LazyFeed):
+            return feed.peek(name, nrows)
+        return getattr(feed, name).head(nrows).copy()
+    # Under copy-on-write a shallow copy shares the data until either side
+    # is written to, otherwise the table is copied outright
+    return getattr(feed, name).copy(deep=not _copy_on_write_enabled())
+
+
+# Attribute values a feed view shares with the feed rather than copying
+_IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None), tuple, frozenset)
+
+
+def feed_view(feed: gk.Feed) -> LazyFeed:
+    """
+    A copy of a feed for code that may modify it, such as generated code.
+
+    Each table is copied the first time it is accessed, so tables the code
+    never touches cost nothing. pandas cannot tell reads from in-place writes
+    without its process-wide copy-on-write mode, which this leaves alone, so
+    a table the code only reads is copied too: on CUMTD, reading stop_times
+    costs about 30 ms and 26 MiB. When copy-on-write mode is on anyway, as it
+    always is from pandas 3, a table is a shallow copy sharing its data with
+    the feed until either side writes to it. Immutable attributes are shared,
+    other attributes copied. Changes made through the view never reach the
+    feed.
+
+    Args:
+        feed (gk.Feed): The feed to view, left unchanged
+
+    Returns:
+        LazyFeed: The view
+    """
+    view = LazyFeed.__new__(LazyFeed)
+    view._lazy_tables = {}
+    view._lazy_lock = threading.RLock()
+    tables = list(getattr(feed, "pending_tables", []))
+    for attr, value in vars(feed).items():
+        if attr in ("_lazy_tables", "_lazy_lock"):
+            continue
+        if isinstance(value, pd.DataFrame):
+            # Indexes derived from property-backed tables are rebuilt with them
+            if not (attr.startswith("_") and attr.endswith("_i")):
+                tables.append(attr.lstrip("_"))
+        elif isinstance(value, _IMMUTABLE_TYPES):
+            view.__dict__[attr] = value
+        else:
+            view.__dict__[attr] = copy.deepcopy(value)
+    for name in tables:
+        view.add_lazy_table(name, partial(_view_table, feed, name))
+    return view
+
+
 class GTFSLoader:
-    def __init__(self, gtfs, gtfs_path: str, distance_unit: str = "km"):
+    def __init__(
+        self,
+        gtfs,
+        gtfs_path: str,
+        distance_unit: str = "km",
+        distance_method: str = "ellipsoid",
+        date_dtype: str = "date",
+        cache_dir: Optional[str] = None,
+        compact_dtypes: bool = False,
+        compress_stop_times: bool = False,
+    ):
         self.gtfs = gtfs
         self.gtfs_path = gtfs_path
         self.feed: Optional[gk.feed] = None
         self.file_list = list_files_in_zip(gtfs_path)
         self.zipfile = zipfile.ZipFile(gtfs_path)
         self.distance_unit = distance_unit
+        self.distance_method = distance_method
+        # "date" keeps datetime.date objects, "datetime64" stores datetime64 columns
+        self.date_dtype = date_dtype
+        # Build stage outputs are cached here, keyed on the zip members they read
+        self.cache_dir = cache_dir
+        self.member_hashes = {}
+        self.build_log = []
+        # Store IDs as categoricals and integers and times in small int dtypes
+        self.compact_dtypes = compact_dtypes
+        # Keep stop_times as timed trip patterns, rebuilt when first accessed
+        self.compress_stop_times = compress_stop_times
+        # Tables handed to a sink chunk by chunk instead of kept on the feed
+        self.streamed_tables = []
 
     def __getstate__(self):
         state = self.__dict__.copy()
         if "zipfile" in state:
             del state["zipfile"]
+        if isinstance(state.get("feed"), LazyFeed):
+            # Pickles hold every table in a plain gk.Feed, but not the ones
+            # rebuilt from others
+            state["feed"] = state["feed"].to_feed(derived_tables(state["feed"]))
         return state
 
     def __setstate__(self, state):
         self.__dict__.update(state)
+        if self.__dict__.get("feed") is not None:
+            self.feed = with_lazy_stop_times(self.feed)
+
+    def load_feed(
+        self,
+        stop_times_sink: Optional[Callable[[pd.DataFrame], None]] = None,
+        chunk_rows: int = STOP_TIMES_CHUNK_ROWS,
+    ):
+        """
+        Read and process the feed.
+
+        With `stop_times_sink`, stop_times.txt is streamed instead of read
+        whole: each chunk of about `chunk_rows` rows is processed like the
+        full table would be and handed to the sink, and the feed is left
+        without stop_times. Peak memory is then bounded by the chunk size
+        rather than by the size of the feed.
+
+        Args:
+            stop_times_sink (Optional[Callable]): Called with each processed
+                stop_times chunk, e.g. feed_store.TableChunkWriter.write
+            chunk_rows (int): Rows of stop_times.txt read at a time
 
-    def load_feed(self):
+        Returns:
+            bool: Whether the feed was loaded
+        """
         try:
-            feed = gk.read_feed(self.gtfs_path, dist_units=self.distance_unit)
-            feed = self._process_feed(feed)
+            self.build_log = []
+            if self.cache_dir:
+                start = time.perf_counter()
+                self.member_hashes = hash_zip_members(self.gtfs_path)
+                self._log_stage("hash_members", "ran", start)
+            start = time.perf_counter()
+            if stop_times_sink is None:
+                feed = gk.read_feed(self.gtfs_path, dist_units=self.distance_unit)
+                self._log_stage("read", "ran", start)
+                feed = self._process_feed(feed)
+            else:
+                feed = self._read_feed_without(["stop_times.txt"])
+                self._log_stage("read", "ran", start)
+                feed = self._process_streamed_feed(feed, stop_times_sink, chunk_rows)
             self.feed = feed
         except Exception as e:
             print(f"Error loading GTFS feed: {e}")
             print(traceback.format_exc())
             return False
+        self._report_build()
         return True
 
     def _process_feed(self, feed):
         feed = self._append_distances(feed)
+        start = time.perf_counter()
+        feed = feed.clean()
+        self._log_stage("clean", "ran", start)
+        feed = self._cached_stage(feed, "parse_times", self._parse_times)
+        feed = self._cached_stage(feed, "parse_dates", self._parse_dates)
+        feed = self._build_service_calendar(feed)
+        feed = self._build_trip_index(feed)
+        if not self.compress_stop_times:
+            # Its row per stop time would undo the compression, so compressed
+            # feeds build it on first use
+            feed = self._build_departure_index(feed)
+        if self.compact_dtypes:
+            start = time.perf_counter()
+            feed = self._compact_feed(feed)
+            self._log_stage("compact_dtypes", "ran", start)
+        feed = self._remove_empty_attributes(feed)
+        if self.compress_stop_times:
+            feed = self._compress_stop_times(feed)
+        return feed
+
+    def _compress_stop_times(self, feed):
+        """Replace stop_times with its trip patterns, see build_stop_patterns."""
+        start = time.perf_counter()
+        feed.stop_patterns, feed.trip_patterns = build_stop_patterns(feed.stop_times)
+        feed.stop_times = None
+        feed = with_lazy_stop_times(feed)
+        self._log_stage("compress_stop_times", "ran", start)
+        return feed
+
+    def _read_feed_without(self, file_names: list):
+        """Read the feed with gtfs_kit, skipping the given files of the zip."""
+        with tempfile.TemporaryDirectory() as directory:
+            with zipfile.ZipFile(self.gtfs_path) as zf:
+                for member in zf.namelist():
+                    if member not in file_names:
+                        zf.extract(member, directory)
+            return gk.read_feed(directory, dist_units=self.distance_unit)
+
+    def _process_streamed_feed(self, feed, stop_times_sink, chunk_rows: int):
+        """_process_feed for a feed whose stop_times are streamed to a sink."""
+        if feed.shapes is not None:
+            feed = self._append_shape_distances(feed)
+        start = time.perf_counter()
+        trip_ids, stop_ids, trip_index = self._stream_stop_times(
+            feed, stop_times_sink, chunk_rows
+        )
+        self.streamed_tables = ["stop_times"]
+        self._log_stage("stream_stop_times", "ran", start)
+
+        # clean() only needs to know which trips and stops have stop times
+        start = time.perf_counter()
+        feed.stop_times = pd.DataFrame(
+            {
+                "trip_id": pd.Series(sorted(trip_ids), dtype=object),
+                "stop_id": pd.Series(sorted(stop_ids), dtype=object),
+                "arrival_time": np.nan,
+                "departure_time": np.nan,
+            }
+        )
         feed = feed.clean()
-        feed = self._parse_times_and_dates(feed)
+        feed.stop_times = None
+        self._log_stage("clean", "ran", start)
+        feed = self._parse_times(feed)
+        feed = self._cached_stage(feed, "parse_dates", self._parse_dates)
+        feed = self._build_service_calendar(feed)
+        feed.trip_stop_offsets = trip_index
+        if self.compact_dtypes:
+            start = time.perf_counter()
+            feed = self._compact_feed(feed)
+            self._log_stage("compact_dtypes", "ran", start)
         feed = self._remove_empty_attributes(feed)
         return feed
 
+    def _stream_stop_times(self, feed, stop_times_sink, chunk_rows: int) -> tuple:
+        """
+        Read stop_times.txt in chunks and hand each one to `stop_times_sink`
+        processed as the full table would be: distances along the trip's
+        shape, cleaned IDs, times in seconds and, if enabled, compact dtypes.
+
+        Chunks are cut at trip boundaries (see iter_trip_chunks), so a trip
+        whose rows are contiguous in the file, as in nearly every feed, is
+        snapped to its shape in one piece.
+
+        Each chunk is written sorted by (trip_id, stop_sequence), and the
+        offsets of its trips are collected into a trip index like
+        build_trip_index's.
+
+        Returns:
+            tuple: Sets of the cleaned trip and stop IDs that have stop
+                times, and the trip index (None if a trip spans chunks)
+        """
+        shape_groups = None
+        if feed.shapes is not None:
+            shape_groups = feed.shapes.sort_values(
+                ["shape_id", "shape_pt_sequence"]
+            ).groupby("shape_id")
+        id_columns = [
+            column
+            for column in gk.constants.GTFS_REF.loc[
+                gk.constants.GTFS_REF["table"] == "stop_times", "column"
+            ]
+            if column.endswith("_id")
+        ]
+        trip_ids, stop_ids = set(), set()
+        trip_index, rows_written = [], 0
+        with zipfile.ZipFile(self.gtfs_path) as zf, zf.open("stop_times.txt") as f:
+            reader = pd.read_csv(
+                f,
+                dtype=stream_dtypes("stop_times.txt"),
+                encoding="utf-8-sig",
+                chunksize=chunk_rows,
+            )
+            for chunk in iter_trip_chunks(reader):
+                chunk.columns = chunk.columns.str.strip()
+                if shape_groups is not None and (
+                    "shape_dist_traveled" not in chunk.columns
+                    or chunk.shape_dist_traveled.isna().any()
+                ):
+                    chunk = self._stop_distances(
+                        chunk.drop(columns="shape_dist_traveled", errors="ignore"),
+                        feed.stops,
+                        feed.trips,
+                        shape_groups,
+                    )
+                    # Integer shape distances would give chunks differing dtypes
+                    chunk["shape_dist_traveled"] = chunk.shape_dist_traveled.astype(
+                        "float64"
+                    )
+                # Same as gk.clean_ids and clean_times followed by _parse_times
+                for column in id_columns:
+                    if column in chunk.columns:
+                        chunk[column] = (
+                            chunk[column]
+                            .str.strip()
+                            .str.replace(r"\s+", "_", regex=True)
+                        )
+                for column in ["departure_time", "arrival_time"]:
+                    chunk[column] = parse_gtfs_times(chunk[column])
+                trip_ids.update(chunk.trip_id.dropna().unique())
+                stop_ids.update(chunk.stop_id.dropna().unique())
+                if self.compact_dtypes:
+                    chunk = apply_compact_dtypes(chunk, "stop_times.txt")
+                chunk = sort_stop_times(chunk)
+                trip_index.append(build_trip_index(chunk, rows_written))
+                rows_written += len(chunk)
+                stop_times_sink(chunk)
+
+        stats = snap_cache.stats()
+        print(
+            f"Snap cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['entries']} entries, {stats['nbytes'] / 2**20:.1f} MiB"
+        )
+        trip_index = pd.concat(trip_index) if trip_index else None
+        if trip_index is not None and not trip_index.index.is_unique:
+            # A trip split across chunks has no single slice
+            print("stop_times.txt is not grouped by trip, skipping the trip index")
+            trip_index = None
+        return trip_ids, stop_ids, trip_index
+
+    def _compact_feed(self, feed):
+        for attr, value in list(vars(feed).items()):
+            if isinstance(value, pd.DataFrame) and not attr.endswith("_i"):
+                # Property-backed tables are set again to rebuild their indexes
+                name = attr.lstrip("_")
+                setattr(feed, name, apply_compact_dtypes(value, f"{name}.txt"))
+        return feed
+
     def _append_distances(self, feed):
-        if (
-            "shape_dist_traveled" not in feed.shapes.columns
-            or feed.shapes.shape_dist_traveled.isna().any()
-        ):
-            feed = self._calculate_shape_distances(feed)
+        feed = self._append_shape_distances(feed)
         if (
             "shape_dist_traveled" not in feed.stop_times.columns
             or feed.stop_times.shape_dist_traveled.isna().any()
         ):
-            feed = self._calculate_stop_distances(feed)
+            feed = self._cached_stage(
+                feed, "stop_distances", self._calculate_stop_distances
+            )
+        else:
+            self._log_stage("stop_distances", "not needed")
         return feed
 
-    def _calculate_shape_distances(self, feed):
-        print("Calculating shape distances")
-
-        results = []
-        for _, group in feed.shapes.groupby("shape_id"):
-            result = self._calculate_single_shape(group, self.distance_unit)
-            results.append(result)
-
-        # Combine the results
-        feed.shapes = pd.concat(results)
-
+    def _append_shape_distances(self, feed):
+        if (
+            "shape_dist_traveled" not in feed.shapes.columns
+            or feed.shapes.shape_dist_traveled.isna().any()
+        ):
+            feed = self._cached_stage(
+                feed, "shape_distances", self._calculate_shape_distances
+            )
+        else:
+            self._log_stage("shape_distances", "not needed")
         return feed
 
-    def _calculate_single_shape(self, group, distance_unit):
-        cumulative_distance = 0
-        previous_point = None
+    def _log_stage(self, stage: str, status: str, start: Optional[float] = None):
+        seconds = 0.0 if start is None else time.perf_counter() - start
+        self.build_log.append({"stage": stage, "status": status, "seconds": seconds})
 
-        for idx, row in group.iterrows():
-            current_point = (row["shape_pt_lat"], row["shape_pt_lon"])
+    def _stage_cache_path(self, stage: str) -> Optional[str]:
+        """Cache file of a stage's outputs for the current zip, if caching."""
+        if not self.cache_dir or not self.member_hashes:
+            return None
+        key = {
+            "stage": stage,
+            "version": BUILD_STAGE_VERSION,
+            "inputs": {
+                member: self.member_hashes.get(member)
+                for member in BUILD_STAGE_INPUTS[stage]
+            },
+            "settings": [self.distance_unit, self.distance_method, self.date_dtype],
+        }
+        digest = hashlib.blake2b(
+            json.dumps(key, sort_keys=True).encode(), digest_size=16
+        ).hexdigest()
+        return os.path.join(self.cache_dir, f"{stage}-{digest}.pkl")
 
-            if previous_point is not None:
-                distance = geodesic(previous_point, current_point).meters
-                if distance_unit == "km":
-                    distance /= 1000
-                elif distance_unit == "miles":
-                    distance *= 0.000621371
-                cumulative_distance += distance
+    def _cached_stage(self, feed, stage: str, compute):
+        """
+        Run a build stage, or restore its output tables from the build cache
+        when none of the zip members it reads have changed since they were
+        cached.
+        """
+        start = time.perf_counter()
+        path = self._stage_cache_path(stage)
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                tables = cPickle.load(f)
+            for name, df in tables.items():
+                setattr(feed, name, df)
+            self._log_stage(stage, "cached", start)
+            return feed
+
+        feed = compute(feed)
+        if path:
+            tables = {
+                name: getattr(feed, name)
+                for name in BUILD_STAGE_OUTPUTS[stage]
+                if isinstance(getattr(feed, name, None), pd.DataFrame)
+            }
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(f"{path}.tmp", "wb") as f:
+                cPickle.dump(tables, f, protocol=-1)
+            os.replace(f"{path}.tmp", path)
+            # Only the latest outputs of each stage are kept
+            for stale in glob.glob(os.path.join(self.cache_dir, f"{stage}-*.pkl")):
+                if stale != path:
+                    os.remove(stale)
+        self._log_stage(stage, "computed", start)
+        return feed
 
-            group.at[idx, "shape_dist_traveled"] = cumulative_distance
-            previous_point = current_point
+    def _report_build(self):
+        log = pd.DataFrame(self.build_log)
+        print(f"Build log for {self.gtfs}:")
+        print(log.to_string(index=False, float_format="{:.2f}".format))
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(os.path.join(self.cache_dir, "build_log.json"), "w") as f:
+                json.dump(self.build_log, f, indent=2)
 
-        return group
+    def _calculate_shape_distances(self, feed):
+        print("Calculating shape distances")
+        feed.shapes = compute_shape_distances(
+            feed.shapes, self.distance_unit, self.distance_method
+        )
+        return feed
 
     def _calculate_stop_distances(self, feed):
         print("Calculating stop distances")
-        stops = feed.stops
         shapes = feed.shapes.sort_values(["shape_id", "shape_pt_sequence"])
-        stops["geometry"] = stops.apply(
-            lambda row: Point(row["stop_lon"], row["stop_lat"]), axis=1
+        feed.stop_times = self._stop_distances(
+            feed.stop_times, feed.stops, feed.trips, shapes.groupby("shape_id")
         )
-        # Create a GeoDataFrame with stop locations
-        stops_gdf = feed.stop_times.merge(stops[["stop_id", "geometry"]], on="stop_id")
-        stops_gdf = stops_gdf.merge(feed.trips[["trip_id", "shape_id"]], on="trip_id")
+
+        stats = snap_cache.stats()
+        print(
+            f"Snap cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['entries']} entries, {stats['nbytes'] / 2**20:.1f} MiB"
+        )
+        return feed
+
+    def _stop_distances(self, stop_times, stops, trips, shape_groups):
+        """
+        Add the distance along its trip's shape to every stop time.
+
+        Args:
+            stop_times (pd.DataFrame): All stop times or a chunk of whole trips
+            stops (pd.DataFrame): Stops with their coordinates
+            trips (pd.DataFrame): Trips with their shape_id
+            shape_groups: Shape points with distances, sorted and grouped by shape_id
+
+        Returns:
+            pd.DataFrame: stop_times with a shape_dist_traveled column
+        """
+        # Attach stop locations and shape to every stop time
+        stops_gdf = stop_times.merge(
+            stops[["stop_id", "stop_lon", "stop_lat"]], on="stop_id"
+        )
+        stops_gdf = stops_gdf.merge(trips[["trip_id", "shape_id"]], on="trip_id")
         # Group by shape_id and apply nearest_points function
-        grouped = stops_gdf.groupby("shape_id")
         results = []
-        for shape_id, group in grouped:
+        for shape_id, group in stops_gdf.groupby("shape_id"):
             shape_id = shape_id.strip()
-            shape_points = shapes[shapes.shape_id == shape_id]
-            shape_geometry = shape_points.apply(
-                lambda x: Point(x["shape_pt_lon"], x["shape_pt_lat"]), axis=1
+            shape_points = shape_groups.get_group(shape_id)
+            shape_coords = shape_points[["shape_pt_lon", "shape_pt_lat"]].to_numpy(
+                dtype=float
             )
-            result = nearest_points(group, shape_geometry)
-            result["shape_dist_traveled"] = shape_points.iloc[result["snap_start_id"]][
+            result = nearest_points(group, shape_id, shape_coords)
+            result["shape_dist_traveled"] = shape_points[
                 "shape_dist_traveled"
-            ].values
+            ].to_numpy()[result["snap_start_id"].to_numpy()]
             results.append(result)
+        if not results:
+            # None of these trips has a shape
+            return stop_times.assign(shape_dist_traveled=np.nan)
 
         # Combine results
         stop_gdf = pd.concat(results)
 
-        # Update feed.stop_times with calculated shape_dist_traveled
-        feed.stop_times = feed.stop_times.merge(
+        # Update stop_times with calculated shape_dist_traveled
+        return stop_times.merge(
             stop_gdf[["trip_id", "stop_sequence", "shape_dist_traveled"]],
             on=["trip_id", "stop_sequence"],
             how="left",
         )
 
-        return feed
-
     def _parse_times_and_dates(self, feed):
-        vparse_time = np.vectorize(self.parse_time)
-        vparse_date = np.vectorize(self.parse_date)
+        return self._parse_dates(self._parse_times(feed))
 
-        feed.stop_times[["departure_time", "arrival_time"]] = feed.stop_times[
-            ["departure_time", "arrival_time"]
-        ].apply(vparse_time)
+    def _parse_times(self, feed):
+        # Streamed stop_times are parsed chunk by chunk instead
+        if feed.stop_times is not None:
+            for column in ["departure_time", "arrival_time"]:
+                feed.stop_times[column] = parse_gtfs_times(feed.stop_times[column])
 
         if hasattr(feed, "timeframes"):
-            feed.timeframes[["start_time", "end_time"]] = feed.timeframes[
-                ["start_time", "end_time"]
-            ].apply(vparse_time)
+            for column in ["start_time", "end_time"]:
+                feed.timeframes[column] = parse_gtfs_times(feed.timeframes[column])
 
+        return feed
+
+    def _parse_dates(self, feed):
         for attr in ["calendar", "calendar_dates", "feed_info"]:
             if hasattr(feed, attr) and isinstance(getattr(feed, attr), pd.DataFrame):
                 df = getattr(feed, attr)
                 date_columns = [col for col in df.columns if "date" in col.lower()]
-                df[date_columns] = df[date_columns].apply(vparse_date)
+                for column in date_columns:
+                    dates = parse_gtfs_dates(df[column])
+                    # Prompts and examples compare these columns to datetime.date
+                    if self.date_dtype != "datetime64":
+                        dates = dates.astype(object)
+                    df[column] = dates
                 setattr(feed, attr, df)
 
         return feed
 
+    def _build_service_calendar(self, feed):
+        """Precompute feed.service_calendar, see build_service_calendar."""
+        start = time.perf_counter()
+        feed.service_calendar = build_service_calendar(
+            getattr(feed, "calendar", None), getattr(feed, "calendar_dates", None)
+        )
+        self._log_stage("service_calendar", "ran", start)
+        return feed
+
+    def _build_trip_index(self, feed):
+        """Sort stop_times by trip and index each trip's rows, see build_trip_index."""
+        start = time.perf_counter()
+        feed.stop_times = sort_stop_times(feed.stop_times)
+        feed.trip_stop_offsets = build_trip_index(feed.stop_times)
+        self._log_stage("trip_index", "ran", start)
+        return feed
+
+    def _build_departure_index(self, feed):
+        """Precompute the stop departure index, see build_departure_index."""
+        start = time.perf_counter()
+        feed.stop_departures, feed.stop_departure_offsets = build_departure_index(
+            feed.stop_times
+        )
+        self._log_stage("departure_index", "ran", start)
+        return feed
+
     def _remove_empty_attributes(self, feed):
         for attr in dir(feed):
             if not attr.startswith("_"):
@@ -240,42 +1784,61 @@ class GTFSLoader:
 
     @lru_cache(maxsize=None)
     def load_all_tables(self):
+        """
+        Make every file of the zip available on the feed. Tables gtfs_kit did
+        not load are read from the zip the first time they are accessed, see
+        LazyFeed.
+        """
         if not self.feed and not self.load_feed():
             return
 
+        if not isinstance(self.feed, LazyFeed):
+            self.feed = LazyFeed.from_feed(self.feed)
         for table in self.file_list:
             table_name = table.split(".")[0]
-            if not hasattr(self.feed, table_name):
-                try:
-                    with self.zipfile.open(f"{table_name}.txt", "r") as f:
-                        df = pd.read_csv(f, encoding="utf-8")
-                        setattr(self.feed, table_name, df)
-                except Exception as e:
-                    print(f"Could not load {table_name} due to {e}")
+            if (
+                not table.endswith(".txt")
+                or "/" in table
+                or table_name in self.streamed_tables
+                or table_name in self.feed.pending_tables
+                or hasattr(self.feed, table_name)
+            ):
+                continue
+            self.feed.add_lazy_table(table_name, partial(self.read_table, table))
 
         print(f"Loaded all tables: {self.gtfs}")
         if hasattr(self, "zipfile"):
+            self.zipfile.close()
             del self.zipfile
 
-    @lru_cache(maxsize=2**18)
+    def read_table(self, table: str, nrows: Optional[int] = None) -> pd.DataFrame:
+        """
+        Read one file of the zip as a DataFrame.
+
+        Args:
+            table (str): File name in the zip, e.g. "fare_rules.txt"
+            nrows (Optional[int]): Read only this many rows
+
+        Returns:
+            pd.DataFrame: The table, with compact dtypes if enabled
+        """
+        with zipfile.ZipFile(self.gtfs_path) as zf, zf.open(table, "r") as f:
+            dtype = None
+            if self.compact_dtypes:
+                # IDs are read straight into categoricals
+                fields = GTFS_FILE_FIELD_TYPE_MAPPING.get(table, {})
+                dtype = {
+                    field: "category"
+                    for field in fields
+                    if compact_dtype(table, field) == "category"
+                }
+            df = pd.read_csv(f, encoding="utf-8", dtype=dtype, nrows=nrows)
+        if self.compact_dtypes:
+            df = apply_compact_dtypes(df, table)
+        return df
+
     def parse_time(self, val: Any) -> np.float32:
-        if isinstance(val, (float, np.float32)) or pd.isna(val):
-            return val
-        if not val:
-            return np.nan
-        try:
-            return np.float32(val)
-        except ValueError:
-            h, m, s = map(float, str(val).strip().split(":"))
-            return np.float32(h * 3600 + m * 60 + s)
+        return _parse_time_value(val)
 
-    @lru_cache(maxsize=2**18)
     def parse_date(self, val: str) -> datetime.date:
-        if isinstance(val, datetime.date):
-            return val
-        for date_format in [DATE_FORMAT, DATE_FORMAT_ALT]:
-            try:
-                return datetime.datetime.strptime(val, date_format).date()
-            except ValueError:
-                continue
-        raise ValueError(f"Unable to parse date: {val}")
+        return _parse_date_value(val)
@@ -270,6 +270,81 @@ Output: DataFrame containing columns ['stop_id', 'stop_name', 'stop_lat', 'stop_
 </example>
 </function>
 
+<function>
+<function_name>find_departures</function_name>
+<function_description>Find the stop times departing from a stop within a time window, using a precomputed index instead of filtering all of feed.stop_times.</function_description>
+<function_args>
+- feed (GTFSFeed): The GTFS feed object
+- stop_id (str): The stop to depart from
+- start_time (float or str): Start of the window (inclusive), in seconds since midnight or "HH:MM:SS"
+- end_time (float or str, optional): End of the window (inclusive), default is no end
+- max_departures (int, optional): Maximum number of departures to return
+</function_args>
+<return>pandas.DataFrame: The rows of feed.stop_times for that stop within the window, sorted by departure_time. Trips of every service day are included; combine with active_trips for a single date.</return>
+<example>
+Input: find_departures(feed, "IU", "17:00:00", "18:00:00")
+Output: DataFrame with the columns of feed.stop_times, one row per departure from stop IU between 5 and 6 PM
+</example>
+</function>
+
+<function>
+<function_name>next_departures</function_name>
+<function_description>Find the next departures from a stop at or after a given time.</function_description>
+<function_args>
+- feed (GTFSFeed): The GTFS feed object
+- stop_id (str): The stop to depart from
+- after (float or str): Time in seconds since midnight or "HH:MM:SS"
+- count (int, optional): Number of departures to return, default is 5
+</function_args>
+<return>pandas.DataFrame: Up to `count` rows of feed.stop_times, sorted by departure_time</return>
+<example>
+Input: next_departures(feed, "IU", 17 * 3600, count=3)
+Output: DataFrame with the next 3 departures from stop IU at or after 5 PM
+</example>
+</function>
+
+<function>
+<function_name>trip_stop_times</function_name>
+<function_description>Get the stop times of one trip or a batch of trips, in stop_sequence order. feed.stop_times is stored sorted by trip, so this slices it with a precomputed index instead of filtering the whole table; prefer it over feed.stop_times[feed.stop_times.trip_id == trip_id], especially inside loops.</function_description>
+<function_args>
+- feed (GTFSFeed): The GTFS feed object
+- trip_ids (str or list): A single trip_id, or a list/Series of trip_ids
+</function_args>
+<return>pandas.DataFrame: The rows of feed.stop_times for the trips, in the order given. A single trip's rows share memory with feed.stop_times; call .copy() before modifying them.</return>
+<example>
+Input: trip_stop_times(feed, ["trip_1", "trip_2"])
+Output: DataFrame with the columns of feed.stop_times, the stops of trip_1 followed by the stops of trip_2
+</example>
+</function>
+
+<function>
+<function_name>active_trips</function_name>
+<function_description>Find the trips running on a date, using the feed's precomputed service calendar (calendar.txt with the calendar_dates.txt exceptions already applied).</function_description>
+<function_args>
+- feed (GTFSFeed): The GTFS feed object
+- date (datetime.date or str): The date of interest, e.g. datetime.date(2024, 10, 15) or "20241015"
+</function_args>
+<return>pandas.DataFrame: The rows of feed.trips whose service runs on that date</return>
+<example>
+Input: active_trips(feed, datetime.date(2024, 10, 15))
+Output: DataFrame with the columns of feed.trips, one row per trip running on October 15, 2024
+</example>
+</function>
+
+<function>
+<function_name>active_service_ids</function_name>
+<function_description>Find the service_ids running on a date, with calendar_dates.txt exceptions applied.</function_description>
+<function_args>
+- feed (GTFSFeed): The GTFS feed object
+- date (datetime.date or str): The date of interest
+</function_args>
+<return>list: The service_ids active on that date, empty outside the feed's validity window</return>
+<example>
+Input: active_service_ids(feed, "20241015")
+Output: ['B3_NOSCH_MF', 'GR4_MF', ...]
+</example>
+</function>
+
 <function>
 <function_name>get_geo_location</function_name>
 <function_description>Convert an address to geographic coordinates using Google Maps API or Nominatim.</function_description>
@@ -315,6 +390,7 @@ For distance calculations:
 - The calendar.txt file defines service patterns, but a route's full schedule may be spread across multiple service patterns.
 - Always cross-reference trips.txt to get the full picture of a route's schedule across all its services.
 - Remember to check calendar_dates.txt for exceptions to the regular schedule defined in calendar.txt.
+- To find the services or trips running on a date, use `active_service_ids(feed, date)` or `active_trips(feed, date)`; they already apply the calendar_dates.txt exceptions.
 
 ### Navigation and Directions
 - While finding directions, try to find more than one nearest neighbor to comprehensively arrive at the solution.
@@ -418,11 +494,18 @@ RETRY_PROMPT = """While executing the code, I encountered the following error:
 <error>
 {error}
 </error>
-
+{hot_lines}
 Please account for this error and adjust your code accordingly.
 Remember to follow the task instructions and use the provided code snippets and GTFS knowledge to answer the user query.
 Change the code to fix the error and try again.
 """
+HOT_LINES_PROMPT = """
+The code was too slow. These lines of it took the most time:
+<hot_lines>
+{hot_lines}
+</hot_lines>
+Rewrite them first, e.g. replace loops over rows with vectorized pandas operations.
+"""
 ## Think if we need to add examples here
 MODERATION_LLM_SYSTEM_PROMPT = """
 ### BLOCK CATEGORY:  
@@ -1,5 +1,6 @@
 import time
 import yaml
+import pandas as pd
 import streamlit as st
 from prompts.all_prompts import (
     GTFS_STRUCTURE,
@@ -11,7 +12,7 @@ from prompts.all_prompts import (
     VISUALIZATION_TIPS,
 )
 from prompts.gtfs_file_field_type import GTFS_FILE_FIELD_TYPE_MAPPING
-from gtfs_agent.gtfs_loader import GTFSLoader
+from gtfs_agent.gtfs_loader import GTFSLoader, LazyFeed
 from functools import lru_cache
 from utils.constants import (
     FEW_SHOT_EXAMPLES_FILE,
@@ -131,6 +132,15 @@ def yaml_to_examples(yaml_file: str) -> str:
     return "\n".join(examples)
 
 
+def compact_dtype_note(column: pd.Series) -> str:
+    """Tell the model how a column stored with a compact dtype behaves"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return " (stored as pandas `category`: pass `observed=True` to `groupby`)"
+    if pd.api.types.is_extension_array_dtype(column.dtype) and pd.api.types.is_integer_dtype(column.dtype):
+        return f" (stored as nullable `{column.dtype}`: missing values are `pd.NA`)"
+    return ""
+
+
 def generate_fileinfo_dtypes(feed: GTFSLoader, file_list, distance_unit: str):
     FILE_INFO = "\n\n## Sample from the feed: \n The following is a sample from the feed, showcasing the first five lines from each file:\n\n"
     GTFS_FEED_DATATYPES = BASE_GTFS_FEED_DATATYPES.format(distance_unit=distance_unit)
@@ -138,7 +148,11 @@ def generate_fileinfo_dtypes(feed: GTFSLoader, file_list, distance_unit: str):
     for file_name in file_list:
         try:
             file = file_name.split(".txt")[0]
-            df = getattr(feed, file)
+            # Lazy feeds read only the sample rows of tables not loaded yet
+            if isinstance(feed, LazyFeed):
+                df = feed.peek(file, 3)
+            else:
+                df = getattr(feed, file)
             df_string = df.head(3).to_markdown(index=False)
 
             FILE_INFO += f"### {file_name} (feed.{file})\n<feed-sample>\n"
@@ -149,7 +163,7 @@ def generate_fileinfo_dtypes(feed: GTFSLoader, file_list, distance_unit: str):
                 for field in df.columns:
                     if field in GTFS_FILE_FIELD_TYPE_MAPPING[file_name]:
                         if len(df[field].unique()) >= 1:
-                            GTFS_FEED_DATATYPES += f"- `{field}`: {GTFS_FILE_FIELD_TYPE_MAPPING[file_name][field]}\n"
+                            GTFS_FEED_DATATYPES += f"- `{field}`: {GTFS_FILE_FIELD_TYPE_MAPPING[file_name][field]}{compact_dtype_note(df[field])}\n"
                         else:
                             GTFS_FEED_DATATYPES += f"- `{field}`: {df[field].dtype}\n"
                 GTFS_FEED_DATATYPES += "\n</data-type>\n\n"
@@ -1,11 +1,30 @@
 import sys
 import os
 import pytest
+import psutil
+import math
+import shutil
+import subprocess
+import threading
+import time
+import tracemalloc
+import re
+import yaml
+import pandas as pd
+import plotly.express as px
+from concurrent.futures import ThreadPoolExecutor
 
 # Add the parent directory to the sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from evaluator.eval_code import GTFS_Eval
+from evaluator.eval_code import GTFS_Eval, EvalWorkerPool, execution_budget
+from evaluator.eval_imports import BASE_NAMESPACE, eval_namespace
+from evaluator import rewrite_code as rewrite_runtime
+from evaluator.rewrite_code import rewrite_code
+from evaluator.line_profile import LineProfiler, format_hot_lines
+from gtfs_agent.feed_store import load_feed_artifact, save_feed_artifact
+from evaluator.result_cache import EvalResultCache, code_key, feed_version
+from utils.constants import EVAL_CPU_MARGIN_SECONDS
 
 
 @pytest.fixture
@@ -110,3 +129,527 @@ print(fuzzywuzzy.process.extractOne("hello", ["hello", "world"]))
     result = gtfs_evaluator.evaluate(code_with_name_error)
     assert result["eval_success"] is False
     assert "NameError" in result["error_message"]
+
+
+@pytest.fixture
+def pooled_evaluator():
+    mock_file_mapping = {
+        "CUMTD": {"pickle_loc": "tests/test_pickle_feed/CUMTD_gtfs_loader.pkl"}
+    }
+    evaluator = GTFS_Eval(mock_file_mapping)
+    evaluator.get_system_prompt("CUMTD", "m", False)
+    evaluator.pool = EvalWorkerPool(evaluator.current_loader.feed, 1)
+    evaluator.result_cache = EvalResultCache()
+    pool = evaluator.pool
+    yield evaluator
+    pool.close()
+
+
+def test_pool_workers_do_not_share_feed_changes(pooled_evaluator):
+    rows = len(pooled_evaluator.current_loader.feed.stop_times)
+    drop_rows = """
+```python
+feed.stop_times.drop(feed.stop_times.index, inplace=True)
+result = len(feed.stop_times)
+```
+"""
+    assert pooled_evaluator.evaluate(drop_rows)["code_output"] == 0
+    count_rows = "```python\nresult = len(feed.stop_times)\n```"
+    assert pooled_evaluator.evaluate(count_rows)["code_output"] == rows
+    assert len(pooled_evaluator.current_loader.feed.stop_times) == rows
+
+
+def test_pool_kills_timed_out_worker(pooled_evaluator):
+    busy_loop = "```python\nwhile True:\n    pass\n```"
+    before = {child.pid for child in psutil.Process().children()}
+    result = pooled_evaluator.evaluate(busy_loop, timeout_seconds=1)
+    assert "TimeoutError" in result["error_message"]
+    # The worker running the loop is gone and a replacement waits
+    after = {child.pid for child in psutil.Process().children()}
+    assert len(before - after) == 1 and len(after - before) == 1
+    assert pooled_evaluator.pool.idle.qsize() == 1
+
+    result = pooled_evaluator.evaluate("```python\nresult = 1 / 0\n```")
+    assert "ZeroDivisionError" in result["error_message"]
+    assert "1: result = 1 / 0" in result["error_message"]
+    assert pooled_evaluator.evaluate("```python\nresult = 2\n```")["code_output"] == 2
+
+
+def test_thread_evaluations_do_not_share_feed_changes(pooled_evaluator):
+    pooled_evaluator.pool = None
+    rows = len(pooled_evaluator.current_loader.feed.stop_times)
+    drop_rows = """
+```python
+feed.stop_times.drop(feed.stop_times.index, inplace=True)
+feed.stops.loc[feed.stops.index[0], "stop_name"] = "changed"
+result = len(feed.stop_times)
+```
+"""
+    assert pooled_evaluator.evaluate(drop_rows)["code_output"] == 0
+    read_back = "```python\nresult = (len(feed.stop_times), feed.stops.stop_name.iloc[0])\n```"
+    count, name = pooled_evaluator.evaluate(read_back)["code_output"]
+    assert count == rows
+    assert name != "changed"
+
+
+def test_pool_replaces_dead_and_unforked_workers(pooled_evaluator, monkeypatch):
+    pool = pooled_evaluator.pool
+    code = "```python\nresult = len(feed.routes)\n```"
+    routes = len(pooled_evaluator.current_loader.feed.routes)
+    worker, _ = pool.idle.queue[0]
+    worker.kill()
+    worker.join()
+    assert pooled_evaluator.evaluate(code, use_cache=False)["code_output"] == routes
+
+    # A replacement that cannot be forked is forked on the next run
+    def fork_fails():
+        raise OSError(12, "Cannot allocate memory")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pool, "_fork_worker", fork_fails)
+        assert pooled_evaluator.evaluate(code, use_cache=False)["code_output"] == routes
+        assert pool.idle.empty()
+    assert pooled_evaluator.evaluate(code, use_cache=False)["code_output"] == routes
+    assert pool.forked == pool.size
+
+
+def test_pool_workers_find_artifact_tables_loaded(pooled_evaluator, tmp_path):
+    save_feed_artifact(pooled_evaluator.current_loader, str(tmp_path), "ipc")
+    feed = load_feed_artifact(str(tmp_path)).feed
+    assert "stop_times" in feed.pending_tables
+    pool = EvalWorkerPool(feed, 1)
+    try:
+        assert feed.pending_tables == []
+        code = "result = (feed.pending_tables, len(feed.stop_times))"
+        assert pool.run(code) == ([], len(pooled_evaluator.current_loader.feed.stop_times))
+    finally:
+        pool.close()
+
+
+def test_thread_evaluation_copies_only_the_tables_it_touches(pooled_evaluator):
+    pooled_evaluator.pool = None
+    stop_times = pooled_evaluator.current_loader.feed.stop_times
+    table_mb = stop_times.memory_usage().sum() / 2**20
+    code = "```python\nresult = len(feed.routes)\n```"
+    tracemalloc.start()
+    try:
+        output = pooled_evaluator.evaluate(code, use_cache=False)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+    assert output["code_output"] == len(pooled_evaluator.current_loader.feed.routes)
+    assert peak_mb < table_mb / 10
+
+
+@pytest.mark.parametrize("use_pool", [False, True])
+def test_chained_assignment_writes_alike_in_thread_and_pool(pooled_evaluator, use_pool):
+    if not use_pool:
+        pooled_evaluator.pool = None
+    name = pooled_evaluator.current_loader.feed.stops.stop_name.iloc[0]
+    code = """
+```python
+feed.stops["stop_name"][feed.stops.index[0]] = "changed"
+result = feed.stops.stop_name.iloc[0]
+```
+"""
+    assert pooled_evaluator.evaluate(code, use_cache=False)["code_output"] == "changed"
+    assert pooled_evaluator.current_loader.feed.stops.stop_name.iloc[0] == name
+    # The evaluation leaves the process-wide pandas mode alone
+    assert pd.options.mode.copy_on_write is False
+
+
+@pytest.mark.parametrize("use_pool", [False, True])
+def test_concurrent_evaluations_get_their_own_results(pooled_evaluator, use_pool):
+    if not use_pool:
+        pooled_evaluator.pool = None
+
+    def evaluate(i):
+        # Uneven sleeps interleave the evaluations
+        code = f"""
+```python
+import time
+time.sleep({(i * 7) % 5} * 0.02)
+result = {{"call": {i}, "routes": len(feed.routes)}}
+```
+"""
+        return pooled_evaluator.evaluate(code)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outputs = list(executor.map(evaluate, range(24)))
+    routes = len(pooled_evaluator.current_loader.feed.routes)
+    for i, output in enumerate(outputs):
+        assert output["eval_success"], output["error_message"]
+        assert output["code_output"] == {"call": i, "routes": routes}
+
+
+def test_pool_limits_cpu_and_memory_per_evaluation(pooled_evaluator):
+    busy_loop = "```python\nwhile True:\n    pass\n```"
+    result = pooled_evaluator.evaluate(busy_loop, timeout_seconds=30, cpu_seconds=1)
+    assert "CPUTimeLimitExceeded" in result["error_message"]
+    # Reported by the worker, without the CPU time it used before the code ran
+    assert result["cpu_seconds"] >= 0.9
+    # The worker stops the code itself and still sends its profile
+    result = pooled_evaluator.evaluate(busy_loop, timeout_seconds=30, cpu_seconds=1, profile=True)
+    assert "CPUTimeLimitExceeded" in result["error_message"]
+    assert result["profile"][0]["code"] in ("while True:", "pass")
+
+    # By default the CPU limit follows the wall clock budget
+    cpu_limit = "```python\nimport resource\nresult = resource.getrlimit(resource.RLIMIT_CPU)[0]\n```"
+    result = pooled_evaluator.evaluate(cpu_limit, timeout_seconds=400)
+    assert result["code_output"] == 400 + EVAL_CPU_MARGIN_SECONDS
+
+    allocate = "```python\nblock = bytearray(400 * 2**20)\nresult = len(block)\n```"
+    result = pooled_evaluator.evaluate(allocate, memory_mb=200)
+    assert "MemoryError" in result["error_message"]
+    result = pooled_evaluator.evaluate(allocate, memory_mb=800)
+    assert result["eval_success"]
+    # The worker's peak includes the block it allocated
+    assert result["peak_rss_mb"] >= 400
+    assert result["cpu_seconds"] >= 0
+
+
+def test_evaluate_reuses_cached_results(pooled_evaluator):
+    code = "```python\nresult = {'routes': len(feed.routes)}\n```"
+    first = pooled_evaluator.evaluate(code)
+    assert first["eval_success"] and not first["cache_hit"]
+    first["code_output"]["routes"] = -1
+
+    # Comments and formatting do not change the key
+    reformatted = "```python\n# Count the routes\nresult = {  'routes' : len( feed.routes )}\n```"
+    second = pooled_evaluator.evaluate(reformatted)
+    assert second["cache_hit"] and second["cpu_seconds"] is None
+    # Each hit is a fresh copy of the stored result
+    assert second["code_output"] == {"routes": len(pooled_evaluator.current_loader.feed.routes)}
+    assert not pooled_evaluator.evaluate(code, use_cache=False)["cache_hit"]
+
+    pooled_evaluator.feed_version = "rebuilt"
+    assert not pooled_evaluator.evaluate(code)["cache_hit"]
+
+
+def test_evaluate_rewrites_only_on_a_cache_miss(pooled_evaluator, monkeypatch):
+    import evaluator.eval_code as eval_code
+
+    rewritten = []
+    monkeypatch.setattr(eval_code, "rewrite_code", lambda code: rewritten.append(code) or rewrite_code(code))
+    code = "```python\nfor route_id in ['1']:\n    trips = feed.trips[feed.trips['route_id'] == route_id]\nresult = 1\n```"
+    first = pooled_evaluator.evaluate(code, rewrite=True)
+    assert not first["cache_hit"] and first["rewrites"]
+    second = pooled_evaluator.evaluate(code, rewrite=True)
+    assert second["cache_hit"] and second["rewrites"] == []
+    assert len(rewritten) == 1
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "from datetime import datetime\nresult = datetime.now().hour",
+        "import numpy as np\nresult = np.random.choice([1, 2])",
+        "result = undefined_name",
+    ],
+)
+def test_evaluate_does_not_cache_changing_or_failed_results(pooled_evaluator, code):
+    pooled_evaluator.evaluate(f"```python\n{code}\n```")
+    assert not pooled_evaluator.evaluate(f"```python\n{code}\n```")["cache_hit"]
+
+
+def test_result_cache_round_trips_frames_and_figures():
+    cache = EvalResultCache()
+    frame = pd.DataFrame({"route_id": ["1", "2"], "trips": [10, 20]})
+    result = {"answer": 2, "data": frame, "figure": px.bar(frame, x="route_id", y="trips")}
+    key = code_key("result = 1", "v1")
+    assert cache.put(key, result)
+    cached = cache.get(key)
+    pd.testing.assert_frame_equal(cached["data"], frame)
+    assert list(cached["figure"].data[0].x) == ["1", "2"]
+    assert code_key("result = (", "v1") is None and not cache.put(None, 1)
+
+
+def test_result_cache_evicts_expired_and_least_recently_used():
+    cache = EvalResultCache(ttl_seconds=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None and cache.size == 0
+
+    block = b"x" * 2**19  # Half a MiB
+    cache = EvalResultCache(max_mb=1.2)
+    cache.put("a", block)
+    cache.put("b", block)
+    cache.get("a")
+    cache.put("c", block)
+    # b was used least recently
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.size <= cache.max_bytes
+    assert not cache.put("d", block * 4)
+
+
+def test_feed_version_changes_when_feed_is_rebuilt(tmp_path):
+    pickle_loc = tmp_path / "CUMTD_gtfs_loader.pkl"
+    shutil.copy("tests/test_pickle_feed/CUMTD_gtfs_loader.pkl", pickle_loc)
+    version = feed_version(str(pickle_loc))
+    assert feed_version(str(pickle_loc)) == version
+    os.utime(pickle_loc, ns=(0, 0))
+    assert feed_version(str(pickle_loc)) != version
+    assert feed_version(str(tmp_path)) != feed_version(str(pickle_loc))
+
+
+def test_eval_imports_defers_libraries_until_used(pooled_evaluator):
+    check = (
+        "import sys, evaluator.eval_imports as m; "
+        "print(sorted(set(['matplotlib.pyplot', 'plotly.express', 'thefuzz', 'utils.find_stops']) & set(sys.modules)))"
+    )
+    loaded = subprocess.run(
+        [sys.executable, "-c", check], capture_output=True, text=True, check=True
+    ).stdout
+    assert loaded.strip() == "[]"
+
+    pooled_evaluator.pool = None
+    code = """
+```python
+fig, ax = plt.subplots()
+routes = find_route(feed, feed.routes.route_long_name.iloc[0])
+result = (type(fig).__name__, fuzz.ratio("Illini", "Illini"), routes is not None, isinstance(px.bar, object))
+```
+"""
+    output = pooled_evaluator.evaluate(code, use_cache=False)
+    assert output["code_output"] == ("Figure", 100, True, True), output["error_message"]
+
+
+@pytest.mark.parametrize("use_pool", [False, True])
+def test_evaluations_get_their_own_namespace(pooled_evaluator, use_pool):
+    if not use_pool:
+        pooled_evaluator.pool = None
+    internals = "```python\nresult = [name for name in ['GTFS_Eval', 'psutil', 'load_zipped_pickle', 'os', 'gc'] if name in globals()]\n```"
+    assert pooled_evaluator.evaluate(internals)["code_output"] == []
+
+    rebind = """
+```python
+pd = None
+helper_value = 1
+__builtins__["len"] = None
+result = True
+```
+"""
+    assert pooled_evaluator.evaluate(rebind)["code_output"]
+    read_back = "```python\nresult = (pd.__name__, 'helper_value' in globals(), len(feed.routes) > 0)\n```"
+    assert pooled_evaluator.evaluate(read_back)["code_output"] == ("pandas", False, True)
+    assert BASE_NAMESPACE["pd"].__name__ == "pandas" and BASE_NAMESPACE["result"] is None
+    with pytest.raises(TypeError):
+        BASE_NAMESPACE["pd"] = None
+
+
+def test_thread_evaluation_is_stopped_when_budget_is_spent(pooled_evaluator):
+    pooled_evaluator.pool = None
+    before = threading.active_count()
+    runaway = """
+```python
+count = 0
+while True:
+    # Catching everything does not keep it alive
+    try:
+        for _, row in feed.stop_times.iterrows():
+            count += row.stop_sequence
+    except Exception:
+        pass
+```
+"""
+    start = time.perf_counter()
+    result = pooled_evaluator.evaluate(runaway, timeout_seconds=1, use_cache=False)
+    assert "TimeoutError" in result["error_message"]
+    assert time.perf_counter() - start < 3
+    # The code is no longer running in the background
+    assert threading.active_count() == before
+    assert pooled_evaluator.evaluate("```python\nresult = 3\n```")["code_output"] == 3
+
+
+def test_execution_budget_scales_with_feed_size(pooled_evaluator):
+    feed = pooled_evaluator.current_loader.feed
+    rows = len(feed.stop_times)
+    assert execution_budget(feed, 300) == max(30, math.ceil(300 * rows / 2_000_000))
+    assert pooled_evaluator.budget_seconds == execution_budget(feed)
+
+    large = type("MockFeed", (), {"stop_times": pd.DataFrame(index=range(4_000_000))})()
+    assert execution_budget(large, 300) == 300
+    small = type("MockFeed", (), {"stop_times": pd.DataFrame(index=range(10))})()
+    assert execution_budget(small, 300) == 30
+
+
+SLOW_LOOP = """
+```python
+counts = {}
+for _, row in feed.stop_times.iterrows():
+    counts[row.stop_id] = counts.get(row.stop_id, 0) + 1
+result = len(counts)
+```
+"""
+
+
+@pytest.mark.parametrize("use_pool", [False, True])
+def test_profile_shows_hot_lines_of_timed_out_code(pooled_evaluator, use_pool):
+    if not use_pool:
+        pooled_evaluator.pool = None
+    output = pooled_evaluator.evaluate(SLOW_LOOP, timeout_seconds=2, profile=True)
+    assert "TimeoutError" in output["error_message"]
+    # The profile survives the timeout, slowest line first
+    hottest = output["profile"][0]
+    assert hottest["line"] in (2, 3) and hottest["hits"] > 100
+    assert "iterrows" in format_hot_lines(output["profile"])
+
+    fast = "```python\nresult = len(feed.routes)\n```"
+    pooled_evaluator.evaluate(fast)
+    output = pooled_evaluator.evaluate(fast, profile=True)
+    assert not output["cache_hit"] and output["profile"][0]["code"] == "result = len(feed.routes)"
+    assert pooled_evaluator.evaluate(fast)["profile"] is None
+
+
+def test_line_profiler_charges_calls_to_their_lines():
+    code = "def slow():\n    time.sleep(0.2)\n    return 1\nx = slow()\ny = sum(range(10))\n"
+    with LineProfiler(code) as profiler:
+        exec(compile(code, "<string>", "exec"), {"time": time})
+    profile = {row["line"]: row for row in profiler.results()}
+    assert profile[2]["seconds"] >= 0.2 and profile[2]["hits"] == 1
+    assert profile[4]["seconds"] < 0.1 and profile[4]["hits"] == 1
+    assert profiler.results()[0]["code"] == "time.sleep(0.2)"
+
+
+def test_overlapping_profiles_keep_tracing_memory():
+    code = "started.set()\nother_done.wait()\nblock = bytearray(50 * 2**20)\n"
+    started, other_done = threading.Event(), threading.Event()
+    namespace = {"started": started, "other_done": other_done}
+    results = {}
+
+    def profile_in_thread():
+        with LineProfiler(code) as profiler:
+            exec(compile(code, "<string>", "exec"), namespace)
+        results["profile"] = {row["line"]: row for row in profiler.results()}
+
+    thread = threading.Thread(target=profile_in_thread)
+    # The first profile to start ends while the other still runs
+    with LineProfiler("x = 1\n"):
+        thread.start()
+        started.wait()
+    still_tracing = tracemalloc.is_tracing()
+    other_done.set()
+    thread.join()
+    assert still_tracing
+    assert results["profile"][3]["allocated_mb"] > 49
+
+
+def test_rewrite_code_keeps_lines_and_warns_about_the_rest():
+    code = """for trip_id in trip_ids:
+    stops = feed.stop_times[
+        feed.stop_times['trip_id'] == trip_id
+    ]
+    trips = changed[changed.route_id == route_id]
+    first = stops[stops['stop_sequence'] == 1]
+changed['route_id'] = 'x'
+once = feed.stop_times[feed.stop_times['trip_id'] == trip_id]
+for _, row in feed.stops.iterrows():
+    pass
+"""
+    rewritten, rewrites, warnings = rewrite_code(code)
+    assert rewritten.count("\n") == code.count("\n")
+    assert rewritten.split("\n")[1] == "    stops = __rewrite__.rows_equal(feed.stop_times, 'trip_id', trip_id"
+    assert rewrites == ["Line 2: rows of `feed.stop_times` by `trip_id` looked up instead of scanned"]
+    # A frame changed in place or rebound in the loop is left alone, as is a filter run once
+    assert [warning.split(":")[0] for warning in warnings] == ["Line 5", "Line 6", "Line 9"]
+    assert "iterrows" in warnings[-1]
+    assert rewrite_code("result = (") == ("result = (", [], [])
+
+
+def test_rows_equal_matches_boolean_filter():
+    frame = pd.DataFrame(
+        {
+            "trip_id": ["b", "a", "b", "c", "a"],
+            "stop_sequence": [2, 1, 1, 1, 2],
+            "category": pd.Categorical(["x", "y", "x", "x", "y"]),
+            "distance": [0.5, 1.0, 0.5, 2.0, 1.0],
+        },
+        index=[10, 11, 12, 13, 14],
+    )
+    for column, value in [
+        ("trip_id", "a"),
+        ("trip_id", "b"),
+        ("trip_id", "missing"),
+        ("trip_id", 1),
+        ("stop_sequence", 1),
+        ("stop_sequence", "1"),
+        ("category", "x"),
+        ("distance", 0.5),
+    ]:
+        expected = frame[frame[column] == value]
+        # The first call filters, the next ones look the rows up
+        for _ in range(3):
+            pd.testing.assert_frame_equal(rewrite_runtime.rows_equal(frame, column, value), expected)
+    pd.testing.assert_frame_equal(
+        rewrite_runtime.rows_equal(frame, "trip_id", "a", attribute=True), frame[frame.trip_id == "a"]
+    )
+    # A frame of the same id that changed size is grouped again
+    frame.drop(index=11, inplace=True)
+    pd.testing.assert_frame_equal(rewrite_runtime.rows_equal(frame, "trip_id", "a"), frame[frame.trip_id == "a"])
+
+
+def test_geodesic_rows_matches_geopy():
+    from geopy.distance import geodesic
+
+    stops = pd.DataFrame(
+        {"stop_lat": [40.1164, 40.1106, 40.0985], "stop_lon": [-88.2434, -88.2073, -88.2212]},
+        index=["a", "b", "c"],
+    )
+    origin = (40.1020, -88.2272)
+    code = "distances = stops.apply(lambda row: geodesic(origin, (row['stop_lat'], row.stop_lon)).miles, axis=1)"
+    rewritten, rewrites, _ = rewrite_code(f"from geopy.distance import geodesic\n{code}")
+    assert "__rewrite__.geodesic_rows" in rewritten and len(rewrites) == 1
+
+    namespace = eval_namespace(None)
+    namespace.update(stops=stops, origin=origin)
+    exec(rewritten, namespace)
+    expected = stops.apply(lambda row: geodesic(origin, (row["stop_lat"], row.stop_lon)).miles, axis=1)
+    pd.testing.assert_series_equal(namespace["distances"], expected, rtol=1e-9)
+
+    # Rows geopy rejects are left to it
+    stops.loc["c", "stop_lat"] = 91
+    with pytest.raises(ValueError):
+        exec(rewritten, namespace)
+
+
+def _answer_code(answer: str) -> str:
+    code = re.findall(r"```python\n(.*?)```", answer, re.DOTALL)
+    return code[0] if code else ""
+
+
+def _same_output(original, rewritten):
+    if isinstance(original, dict):
+        assert original.keys() == rewritten.keys()
+        for key in original:
+            _same_output(original[key], rewritten[key])
+    elif isinstance(original, pd.DataFrame):
+        pd.testing.assert_frame_equal(original, rewritten)
+    elif isinstance(original, pd.Series):
+        pd.testing.assert_series_equal(original, rewritten)
+    else:
+        assert original == rewritten
+
+
+def test_rewritten_few_shot_answers_are_identical(pooled_evaluator):
+    pooled_evaluator.pool = None
+    with open("data/few_shot.yaml") as f:
+        examples = yaml.safe_load(f)
+    rewritten_examples = 0
+    for name, example in examples.items():
+        if example.get("feed") != "CUMTD" or not rewrite_code(_answer_code(example["answer"]))[1]:
+            continue
+        rewritten_examples += 1
+        original, rewritten = (
+            pooled_evaluator.evaluate(example["answer"], use_cache=False, rewrite=rewrite)
+            for rewrite in (False, True)
+        )
+        assert rewritten["rewrites"], name
+        if "TimeoutError" in (original["error_message"] or ""):
+            # Too slow for the feed's execution budget before the rewrite only
+            assert rewritten["eval_success"], name
+            continue
+        assert original["eval_success"] == rewritten["eval_success"], name
+        # Errors point at the same lines of the answer either way
+        assert original["error_message"] == rewritten["error_message"], name
+        _same_output(original["code_output"], rewritten["code_output"])
+    # Timings are in utils/benchmark_rewrite_code.py
+    assert rewritten_examples >= 5
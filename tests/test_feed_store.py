@@ -0,0 +1,191 @@
+import sys
+import os
+import gzip
+import copy
+import json
+import _pickle as cPickle
+import pytest
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Add the parent directory to the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gtfs_agent.feed_store import (
+    MANIFEST_FILE,
+    feed_tables,
+    load_feed_artifact,
+    mapped_memory,
+    save_feed_artifact,
+    stream_feed_artifact,
+)
+from gtfs_agent.gtfs_loader import GTFSLoader, sort_stop_times
+
+PICKLE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "test_pickle_feed",
+    "CUMTD_gtfs_loader.pkl",
+)
+STARTRAN_ZIP = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "gtfs_data",
+    "Lincoln-StarTran-NE",
+    "gtfs.zip",
+)
+
+
+@pytest.fixture(scope="module")
+def pickled_loader():
+    with gzip.open(PICKLE_PATH, "rb") as f:
+        return cPickle.load(f)
+
+
+@pytest.fixture(params=["parquet", "ipc"])
+def artifact(request, pickled_loader, tmp_path):
+    save_feed_artifact(pickled_loader, str(tmp_path), request.param)
+    return tmp_path
+
+
+def test_artifact_round_trip(pickled_loader, artifact):
+    loader = load_feed_artifact(str(artifact))
+    assert loader.gtfs == pickled_loader.gtfs
+    assert loader.distance_unit == pickled_loader.distance_unit
+    assert loader.feed.dist_units == pickled_loader.feed.dist_units
+
+    expected, actual = feed_tables(pickled_loader.feed), feed_tables(loader.feed)
+    assert expected.keys() == actual.keys()
+    for name, df in expected.items():
+        # Shapely geometries do not compare equal by value in pandas
+        geometry = [c for c in df.columns if c == "geometry"]
+        pd.testing.assert_frame_equal(
+            actual[name].drop(columns=geometry), df.drop(columns=geometry)
+        )
+    if "geometry" in pickled_loader.feed.stops:
+        assert loader.feed.stops.geometry.iloc[0].equals(
+            pickled_loader.feed.stops.geometry.iloc[0]
+        )
+
+
+def test_artifact_keeps_feed_attributes(pickled_loader, artifact):
+    loader = load_feed_artifact(str(artifact))
+    for attr in ["calendar", "calendar_dates", "frequencies", "trips"]:
+        assert hasattr(loader.feed, attr) == hasattr(pickled_loader.feed, attr)
+    # Derived indexes are rebuilt when the tables are set
+    assert loader.feed._trips_i.equals(pickled_loader.feed._trips_i)
+
+
+def test_artifact_manifest_prunes_null_columns(pickled_loader, artifact):
+    with open(artifact / MANIFEST_FILE) as f:
+        manifest = json.load(f)
+    stops = manifest["tables"]["stops"]
+    for column in stops["pruned_columns"]:
+        assert pickled_loader.feed.stops[column].isna().all()
+    path = str(artifact / stops["file"])
+    if path.endswith(".arrow"):
+        stored = pa.ipc.open_file(path).schema
+    else:
+        stored = pq.read_schema(path)
+    assert not set(stops["pruned_columns"]) & set(stored.names)
+    assert stops["rows"] == len(pickled_loader.feed.stops)
+
+
+def test_ipc_artifact_is_shared_copy_on_write(pickled_loader, tmp_path):
+    save_feed_artifact(pickled_loader, str(tmp_path), "ipc")
+    stop_times = load_feed_artifact(str(tmp_path)).feed.stop_times
+    departures = stop_times.departure_time.to_numpy()
+    # Numeric columns are views into the mapped file, not private copies
+    assert not departures.flags.owndata and departures.flags.writeable
+    assert mapped_memory(str(tmp_path))["rss_mb"] > 0
+
+    original = departures[0]
+    stop_times.loc[stop_times.index[0], "departure_time"] = original + 1
+    assert stop_times.departure_time.iloc[0] == original + 1
+    # The write is private to this process and never reaches the file
+    reloaded = load_feed_artifact(str(tmp_path)).feed.stop_times
+    assert reloaded.departure_time.iloc[0] == original
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "ipc"])
+def test_artifact_round_trip_compact_dtypes(pickled_loader, tmp_path, file_format):
+    loader = copy.deepcopy(pickled_loader)
+    loader.feed = loader._compact_feed(loader.feed)
+    save_feed_artifact(loader, str(tmp_path), file_format)
+    restored = load_feed_artifact(str(tmp_path))
+    for name in ["stop_times", "trips", "stops"]:
+        pd.testing.assert_frame_equal(
+            getattr(restored.feed, name).drop(columns="geometry", errors="ignore"),
+            getattr(loader.feed, name).drop(columns="geometry", errors="ignore"),
+        )
+
+
+def test_artifact_loads_tables_on_first_access(pickled_loader, artifact):
+    feed = load_feed_artifact(str(artifact)).feed
+    assert set(feed.pending_tables) == set(feed_tables(pickled_loader.feed))
+
+    sample = feed.peek("stop_times", 3)
+    pd.testing.assert_frame_equal(sample, pickled_loader.feed.stop_times.head(3))
+    assert "stop_times" in feed.pending_tables
+
+    # The derived index is built with its table
+    assert feed._trips_i.equals(pickled_loader.feed._trips_i)
+    assert "trips" not in feed.pending_tables
+    assert "stop_times" in feed.pending_tables
+
+
+def test_lazy_feed_copies_read_through_the_original(pickled_loader, artifact):
+    feed = load_feed_artifact(str(artifact)).feed
+    clone = copy.deepcopy(feed)
+    clone.stops.loc[clone.stops.index[0], "stop_name"] = "changed"
+    # The original keeps the table it read for the copy, unchanged
+    assert "stops" not in feed.pending_tables
+    assert feed.stops.stop_name.iloc[0] == pickled_loader.feed.stops.stop_name.iloc[0]
+    assert copy.deepcopy(feed).stops.stop_name.iloc[0] != "changed"
+
+
+@pytest.fixture(scope="module")
+def startran_loader():
+    loader = GTFSLoader("StarTran", STARTRAN_ZIP, "m")
+    loader.load_all_tables()
+    return loader
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "ipc"])
+def test_streamed_artifact_matches_full_build(startran_loader, tmp_path, file_format):
+    loader = GTFSLoader("StarTran", STARTRAN_ZIP, "m")
+    # Small chunks, so trips are cut across many of them
+    stream_feed_artifact(loader, str(tmp_path), file_format, chunk_rows=3000)
+    assert not hasattr(loader.feed, "stop_times")
+
+    manifest = json.load(open(tmp_path / MANIFEST_FILE))
+    assert manifest["tables"]["stop_times"]["rows"] == len(
+        startran_loader.feed.stop_times
+    )
+    expected = feed_tables(startran_loader.feed)
+    # Streamed builds leave the departure index to be built on first use
+    for name in ["stop_departures", "stop_departure_offsets"]:
+        expected.pop(name)
+    actual = feed_tables(load_feed_artifact(str(tmp_path)).feed)
+    assert expected.keys() == actual.keys()
+    # Chunks are sorted by trip one at a time, so trips follow chunk order
+    actual["stop_times"] = sort_stop_times(actual["stop_times"])
+    for offsets in [expected, actual]:
+        trips = offsets.pop("trip_stop_offsets")
+        offsets["trip_lengths"] = (trips.end - trips.start).sort_index().to_frame()
+    for name, df in expected.items():
+        pd.testing.assert_frame_equal(
+            actual[name].drop(columns="geometry", errors="ignore"),
+            df.drop(columns="geometry", errors="ignore"),
+        )
+
+
+def test_compressed_artifact_stores_trip_patterns(startran_loader, tmp_path):
+    loader = GTFSLoader("StarTran", STARTRAN_ZIP, "m", compress_stop_times=True)
+    loader.load_all_tables()
+    save_feed_artifact(loader, str(tmp_path), "ipc")
+    manifest = json.load(open(tmp_path / MANIFEST_FILE))
+    assert "stop_times" not in manifest["tables"]
+    assert "trip_patterns" in manifest["tables"]
+
+    feed = load_feed_artifact(str(tmp_path)).feed
+    assert "stop_times" in feed.pending_tables
+    pd.testing.assert_frame_equal(feed.stop_times, startran_loader.feed.stop_times)
@@ -1,6 +1,10 @@
 import sys
 import os
+import gzip
+import _pickle as cPickle
+import numpy as np
 import pandas as pd
+import pytest
 from unittest.mock import patch
 
 # Add the parent directory to the sys.path
@@ -15,6 +19,14 @@ from utils.find_stops import (
     find_nearby_stops,
     find_stops_by_address,
     find_route,
+    find_departures,
+    next_departures,
+    trip_stop_times,
+)
+from gtfs_agent.gtfs_loader import (
+    build_departure_index,
+    build_trip_index,
+    sort_stop_times,
 )
 
 
@@ -157,3 +169,154 @@ def test_find_route():
 
 
 # Add more tests as needed
+
+
+@pytest.fixture(scope="module")
+def cumtd_feed():
+    pickle_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "test_pickle_feed",
+        "CUMTD_gtfs_loader.pkl",
+    )
+    with gzip.open(pickle_path, "rb") as f:
+        feed = cPickle.load(f).feed
+    feed.stop_departures, feed.stop_departure_offsets = build_departure_index(
+        feed.stop_times
+    )
+    return feed
+
+
+def test_find_departures_matches_naive_filter(cumtd_feed):
+    stop_times = cumtd_feed.stop_times
+    rng = np.random.default_rng(0)
+    for stop_id in rng.choice(stop_times.stop_id.unique(), 25, replace=False):
+        start = float(rng.integers(0, 20 * 3600))
+        end = start + float(rng.integers(0, 4 * 3600))
+        expected = stop_times[
+            (stop_times.stop_id == stop_id)
+            & (stop_times.departure_time >= start)
+            & (stop_times.departure_time <= end)
+        ].sort_values("departure_time", kind="stable")
+        actual = find_departures(cumtd_feed, stop_id, start, end)
+        assert sorted(actual.index) == sorted(expected.index)
+        assert actual.departure_time.is_monotonic_increasing
+
+
+def test_next_departures(cumtd_feed):
+    stop_times = cumtd_feed.stop_times
+    stop_id = stop_times.stop_id.iloc[0]
+    departures = next_departures(cumtd_feed, stop_id, "17:00:00", count=3)
+    at_stop = stop_times[
+        (stop_times.stop_id == stop_id) & (stop_times.departure_time >= 17 * 3600)
+    ]
+    assert departures.departure_time.tolist() == sorted(at_stop.departure_time)[:3]
+    assert find_departures(cumtd_feed, "no such stop", 0).empty
+
+
+def test_find_departures_builds_missing_index():
+    feed = type(
+        "MockFeed",
+        (),
+        {
+            "stop_times": pd.DataFrame(
+                {
+                    "trip_id": ["t1", "t1", "t2", "t2"],
+                    "stop_id": ["A", "B", "A", "B"],
+                    "departure_time": [3600.0, 3700.0, 600.0, np.nan],
+                }
+            )
+        },
+    )()
+    assert find_departures(feed, "A", 0).trip_id.tolist() == ["t2", "t1"]
+    assert find_departures(feed, "B", 0).trip_id.tolist() == ["t1"]
+
+
+def test_find_departures_follows_reordered_and_replaced_stop_times(cumtd_feed):
+    feed = type("MockFeed", (), {})()
+    feed.stop_times = cumtd_feed.stop_times.copy()
+    feed.stop_departures = cumtd_feed.stop_departures
+    feed.stop_departure_offsets = cumtd_feed.stop_departure_offsets
+
+    def expected(stop_id):
+        stop_times = feed.stop_times
+        at_stop = stop_times[
+            (stop_times.stop_id == stop_id) & (stop_times.departure_time >= 17 * 3600)
+        ]
+        return sorted(at_stop.index)
+
+    # Generated code sorting the table in place moves every row
+    feed.stop_times.sort_values("departure_time", inplace=True)
+    departures = find_departures(feed, "WLNTLGN:2", "17:00:00")
+    assert set(departures.stop_id) == {"WLNTLGN:2"}
+    assert sorted(departures.index) == expected("WLNTLGN:2")
+
+    feed.stop_times = feed.stop_times[feed.stop_times.stop_id != "WLNTLGN:2"].copy()
+    assert find_departures(feed, "WLNTLGN:2", "17:00:00").empty
+    stop_id = feed.stop_times.stop_id.iloc[0]
+    assert sorted(find_departures(feed, stop_id, "17:00:00").index) == expected(stop_id)
+
+
+@pytest.fixture(scope="module")
+def trip_sorted_feed(cumtd_feed):
+    feed = type("MockFeed", (), {})()
+    feed.stop_times = sort_stop_times(cumtd_feed.stop_times)
+    feed.trip_stop_offsets = build_trip_index(feed.stop_times)
+    return feed
+
+
+def test_trip_stop_times_matches_naive_filter(trip_sorted_feed):
+    stop_times = trip_sorted_feed.stop_times
+    rng = np.random.default_rng(0)
+    trip_ids = rng.choice(stop_times.trip_id.unique(), 25, replace=False)
+    for trip_id in trip_ids:
+        expected = stop_times[stop_times.trip_id == trip_id]
+        actual = trip_stop_times(trip_sorted_feed, trip_id)
+        pd.testing.assert_frame_equal(actual, expected)
+        assert actual.stop_sequence.is_monotonic_increasing
+        # A single trip is a view into stop_times, not a copy
+        assert np.shares_memory(
+            actual.stop_sequence.to_numpy(), stop_times.stop_sequence.to_numpy()
+        )
+
+    batch = trip_stop_times(trip_sorted_feed, list(trip_ids) + ["no such trip"])
+    expected = pd.concat([stop_times[stop_times.trip_id == t] for t in trip_ids])
+    pd.testing.assert_frame_equal(batch, expected)
+    assert trip_stop_times(trip_sorted_feed, "no such trip").empty
+    assert trip_stop_times(trip_sorted_feed, []).empty
+
+
+def test_trip_stop_times_follows_stop_times_reordered_in_place(trip_sorted_feed):
+    feed = type("MockFeed", (), {})()
+    feed.stop_times = trip_sorted_feed.stop_times.copy()
+    feed.trip_stop_offsets = trip_sorted_feed.trip_stop_offsets
+    trip_ids = list(feed.stop_times.trip_id.unique()[:3])
+    expected = trip_stop_times(feed, trip_ids)
+
+    # Same length, so only the rows found show the index is stale
+    feed.stop_times.sort_values("departure_time", inplace=True)
+    pd.testing.assert_frame_equal(
+        trip_stop_times(feed, trip_ids[0]),
+        expected[expected.trip_id == trip_ids[0]],
+    )
+    pd.testing.assert_frame_equal(trip_stop_times(feed, trip_ids), expected)
+
+
+def test_trip_stop_times_sorts_ungrouped_stop_times():
+    feed = type(
+        "MockFeed",
+        (),
+        {
+            "stop_times": pd.DataFrame(
+                {
+                    "trip_id": ["t2", "t1", "t2", "t1"],
+                    "stop_sequence": [2, 2, 1, 1],
+                    "stop_id": ["B", "D", "A", "C"],
+                }
+            )
+        },
+    )()
+    assert trip_stop_times(feed, "t2").stop_id.tolist() == ["A", "B"]
+    assert trip_stop_times(feed, ["t1", "t2"]).stop_id.tolist() == list("CDAB")
+    # The index follows stop_times when it is replaced
+    feed.stop_times = feed.stop_times.iloc[:0]
+    assert trip_stop_times(feed, "t1").empty
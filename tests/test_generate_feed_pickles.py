@@ -0,0 +1,44 @@
+import sys
+import os
+import json
+import pytest
+
+# Add the parent directory to the sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.generate_feed_pickles import pickle_gtfs_loaders
+
+GTFS_DATA = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gtfs_data"
+)
+
+
+class CrashingPath(str):
+    """A file location that kills the worker process it is sent to"""
+
+    def __reduce__(self):
+        return (os._exit, (1,))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_feed_crashing_its_worker_does_not_stop_the_others(tmp_path, workers):
+    file_mapping = {
+        "Crashing": {"file_loc": CrashingPath("crash.zip"), "distance_unit": "m"},
+        "StarTran": {
+            "file_loc": os.path.join(GTFS_DATA, "Lincoln-StarTran-NE", "gtfs.zip"),
+            "distance_unit": "mi",
+        },
+        "Caltrain": {
+            "file_loc": os.path.join(GTFS_DATA, "San Francisco-Caltrain-CA", "gtfs.zip"),
+            "distance_unit": "mi",
+        },
+    }
+    mapping_path = tmp_path / "file_mapping.json"
+    pickle_gtfs_loaders(
+        file_mapping, str(tmp_path / "pickles"), str(mapping_path), workers=workers
+    )
+
+    mapping = json.loads(mapping_path.read_text())
+    assert mapping["Crashing"]["error"] == "Worker process died while building the feed"
+    for agency_name in ["StarTran", "Caltrain"]:
+        assert "error" not in mapping[agency_name]
+        assert (tmp_path / "pickles" / f"{agency_name}_gtfs_loader.pkl").exists()
@@ -2,11 +2,38 @@ import sys
 import os
 import pytest
 import numpy as np
+import pandas as pd
+import gtfs_kit as gk
 import datetime
+import zipfile
+import pickle
+import gzip
+import copy
+from types import SimpleNamespace
+from unittest.mock import patch
+from geopy.distance import geodesic
 
 # Add the parent directory to the sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from gtfs_agent.gtfs_loader import GTFSLoader
+from gtfs_agent import gtfs_loader
+from gtfs_agent.gtfs_loader import (
+    GTFSLoader,
+    LazyFeed,
+    WEEKDAYS,
+    active_service_ids,
+    active_trips,
+    build_service_calendar,
+    build_stop_patterns,
+    feed_view,
+    materialize_stop_times,
+    SnapCache,
+    compute_shape_distances,
+    iter_trip_chunks,
+    nearest_points,
+    parse_gtfs_dates,
+    parse_gtfs_times,
+    stop_time_rows,
+)
 
 
 @pytest.fixture
@@ -31,4 +58,428 @@ def test_parse_date(mock_gtfs_loader):
     assert mock_gtfs_loader.parse_date("2023-01-01") == datetime.date(2023, 1, 1)
 
 
+def test_parse_gtfs_times():
+    times = pd.Series(
+        ["12:34:56", "8:00:00", "25:10:00", "", None, "45296", " 08:00:00 ", "8:00:00"]
+    )
+    expected = [45296, 28800, 90600, np.nan, np.nan, 45296, 28800, 28800]
+    parsed = parse_gtfs_times(times)
+    assert parsed.dtype == np.float32
+    np.testing.assert_array_equal(parsed, np.array(expected, dtype=np.float32))
+
+
+def test_parse_gtfs_dates():
+    dates = pd.Series(["20230101", "2023-01-02", "", None, datetime.date(2023, 1, 3)])
+    parsed = parse_gtfs_dates(dates)
+    assert parsed.dtype == np.dtype("datetime64[D]")
+    assert list(parsed.astype(object)) == [
+        datetime.date(2023, 1, 1),
+        datetime.date(2023, 1, 2),
+        None,
+        None,
+        datetime.date(2023, 1, 3),
+    ]
+    with pytest.raises(ValueError):
+        parse_gtfs_dates(pd.Series(["not a date"]))
+
+
+@pytest.fixture
+def mock_shapes():
+    rng = np.random.default_rng(0)
+    frames = []
+    for shape_id, (lat, lon) in {"b": (40.11, -88.24), "a": (37.77, -122.42)}.items():
+        n = 50
+        frames.append(
+            pd.DataFrame(
+                {
+                    "shape_id": shape_id,
+                    "shape_pt_lat": lat + np.cumsum(rng.uniform(-1e-3, 1e-3, n)),
+                    "shape_pt_lon": lon + np.cumsum(rng.uniform(-1e-3, 1e-3, n)),
+                    "shape_pt_sequence": np.arange(1, n + 1),
+                }
+            )
+        )
+    # Shuffle so the engine has to restore (shape_id, shape_pt_sequence) order
+    return pd.concat(frames, ignore_index=True).sample(frac=1, random_state=0)
+
+
+def geodesic_shape_distances(group):
+    group = group.sort_values("shape_pt_sequence")
+    points = list(zip(group.shape_pt_lat, group.shape_pt_lon))
+    steps = [0.0] + [geodesic(p, q).meters for p, q in zip(points, points[1:])]
+    return pd.Series(np.cumsum(steps), index=group.index)
+
+
+def test_compute_shape_distances_matches_geodesic(mock_shapes):
+    expected = pd.concat(
+        geodesic_shape_distances(group) for _, group in mock_shapes.groupby("shape_id")
+    )
+    ellipsoid = compute_shape_distances(mock_shapes, "m", "ellipsoid")
+    np.testing.assert_allclose(
+        ellipsoid.shape_dist_traveled, expected.loc[ellipsoid.index], atol=1e-3
+    )
+
+    haversine = compute_shape_distances(mock_shapes, "m", "haversine")
+    np.testing.assert_allclose(
+        haversine.shape_dist_traveled, expected.loc[haversine.index], rtol=5e-3
+    )
+
+
+def test_compute_shape_distances_units(mock_shapes):
+    meters = compute_shape_distances(mock_shapes, "m").shape_dist_traveled
+    km = compute_shape_distances(mock_shapes, "km").shape_dist_traveled
+    ft = compute_shape_distances(mock_shapes, "ft").shape_dist_traveled
+    np.testing.assert_allclose(km, meters / 1000)
+    np.testing.assert_allclose(ft, meters * 3.28084)
+
+
+def test_compute_shape_distances_resets_per_shape(mock_shapes):
+    shapes = compute_shape_distances(mock_shapes, "km")
+    first_points = shapes.groupby("shape_id").head(1)
+    assert (first_points.shape_dist_traveled == 0).all()
+    assert (shapes.groupby("shape_id").shape_dist_traveled.diff().dropna() >= 0).all()
+
+
+def test_compute_shape_distances_unknown_method(mock_shapes):
+    with pytest.raises(ValueError):
+        compute_shape_distances(mock_shapes, "km", "flat")
+
+
+@pytest.fixture
+def straight_shape():
+    return np.column_stack([np.linspace(0, 0.01, 11), np.zeros(11)])
+
+
+def test_nearest_points_solves_each_pattern_once(straight_shape):
+    stop_lons = {"A": 0.0, "B": 0.005, "C": 0.009}
+    trips = {"t1": "ABC", "t2": "ABC", "t3": "AC", "t4": "ABC"}
+    stop_df = pd.DataFrame(
+        [
+            {
+                "trip_id": trip_id,
+                "stop_sequence": seq,
+                "stop_id": stop_id,
+                "stop_lon": stop_lons[stop_id],
+                "stop_lat": 0.0,
+            }
+            for trip_id, pattern in trips.items()
+            for seq, stop_id in enumerate(pattern, start=1)
+        ]
+    ).sample(frac=1, random_state=0)
+
+    with patch.object(
+        gtfs_loader,
+        "process_stop_sequence",
+        wraps=gtfs_loader.process_stop_sequence,
+    ) as solver, patch.object(
+        gtfs_loader, "_array_digest", wraps=gtfs_loader._array_digest
+    ) as digest:
+        result = nearest_points(stop_df, "s1", straight_shape, cache=SnapCache())
+
+    assert solver.call_count == 2
+    # The shape is hashed once for all of its patterns and its tree
+    shape_hashes = sum(call.args[0] is straight_shape for call in digest.call_args_list)
+    assert shape_hashes == 1
+    snaps = result.groupby("trip_id").snap_start_id.agg(list).to_dict()
+    assert snaps == {"t1": [0, 5, 9], "t2": [0, 5, 9], "t3": [0, 9], "t4": [0, 5, 9]}
+
+
+def test_snap_cache_hits_and_shape_geometry(straight_shape):
+    cache = SnapCache()
+    stops = np.array([[0.0, 0.0], [0.005, 0.0], [0.009, 0.0]])
+
+    first = cache.snap("s1", straight_shape, stops)
+    assert cache.stats()["hits"] == 0
+    np.testing.assert_array_equal(cache.snap("s1", straight_shape, stops), first)
+    assert cache.stats()["hits"] == 1
+
+    # Same shape_id with another geometry, e.g. from a different feed
+    cache.snap("s1", straight_shape[::-1], stops)
+    assert cache.stats()["hits"] == 1
+    assert len(cache) == 4
+
+
+def test_snap_cache_evicts_to_memory_budget(straight_shape):
+    cache = SnapCache(max_bytes=2048)
+    for offset in range(50):
+        shape = straight_shape + offset
+        cache.snap(f"s{offset}", shape, shape[[0, 5, 9]])
+    assert cache.nbytes <= 2048
+    assert len(cache) < 100
+
+
+def test_apply_compact_dtypes():
+    stop_times = pd.DataFrame(
+        {
+            "trip_id": ["t1", "t1", "t2"],
+            "arrival_time": np.array([3600, np.nan, 90000], dtype=np.float32),
+            "departure_time": np.array([3600, 7200, 90000], dtype=np.float32),
+            "stop_sequence": [1, 2, 100000],
+            "pickup_type": [0.0, np.nan, 1.0],
+            "timepoint": [1, 0, 500],
+            "stop_headsign": ["A", "B", "C"],
+        }
+    )
+    compact = gtfs_loader.apply_compact_dtypes(stop_times.copy(), "stop_times.txt")
+    assert isinstance(compact.trip_id.dtype, pd.CategoricalDtype)
+    assert compact.arrival_time.dtype == "Int32"
+    assert compact.arrival_time.isna().tolist() == [False, True, False]
+    assert compact.departure_time.dtype == np.int32
+    assert compact.stop_sequence.dtype == np.int32
+    assert compact.pickup_type.dtype == "Int8"
+    # Values that do not fit an enum keep their dtype
+    assert compact.timepoint.dtype == np.int64
+    assert compact.stop_headsign.dtype == object
+    assert compact.departure_time.tolist() == [3600, 7200, 90000]
+
+
+STARTRAN_ZIP = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "gtfs_data",
+    "Lincoln-StarTran-NE",
+    "gtfs.zip",
+)
+
+
+def build_statuses(gtfs_path, cache_dir):
+    loader = GTFSLoader("StarTran", gtfs_path, "m", cache_dir=cache_dir)
+    assert loader.load_feed()
+    return loader, {entry["stage"]: entry["status"] for entry in loader.build_log}
+
+
+def test_incremental_build_reuses_unchanged_stages(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    _, statuses = build_statuses(STARTRAN_ZIP, cache_dir)
+    assert statuses["stop_distances"] == "computed"
+    _, statuses = build_statuses(STARTRAN_ZIP, cache_dir)
+    assert statuses["shape_distances"] == "cached"
+    assert statuses["stop_distances"] == "cached"
+    assert statuses["parse_times"] == "cached"
+    assert statuses["parse_dates"] == "cached"
+
+    # A refreshed zip where only calendar_dates.txt changed
+    refreshed = str(tmp_path / "gtfs.zip")
+    with zipfile.ZipFile(STARTRAN_ZIP) as src, zipfile.ZipFile(refreshed, "w") as dst:
+        for item in src.infolist():
+            data = src.read(item)
+            if item.filename.endswith("calendar_dates.txt"):
+                data += b"1,20250704,2\r\n"
+            dst.writestr(item, data)
+    loader, statuses = build_statuses(refreshed, cache_dir)
+    assert statuses["stop_distances"] == "cached"
+    assert statuses["parse_times"] == "cached"
+    assert statuses["parse_dates"] == "computed"
+    assert len(loader.feed.calendar_dates) == 1
+
+    expected = GTFSLoader("StarTran", refreshed, "m")
+    assert expected.load_feed()
+    for table in ["stop_times", "shapes", "calendar", "calendar_dates", "trips"]:
+        pd.testing.assert_frame_equal(
+            getattr(loader.feed, table), getattr(expected.feed, table)
+        )
+
+
+def test_load_all_tables_reads_extra_files_on_access(tmp_path):
+    gtfs_path = str(tmp_path / "gtfs.zip")
+    with zipfile.ZipFile(STARTRAN_ZIP) as src, zipfile.ZipFile(gtfs_path, "w") as dst:
+        for item in src.infolist():
+            dst.writestr(item, src.read(item))
+        dst.writestr(
+            "directions.txt",
+            "route_id,direction_id,direction\n10,0,North\n10,1,South\n",
+        )
+    loader = GTFSLoader("StarTran", gtfs_path, "m")
+    loader.load_all_tables()
+    assert isinstance(loader.feed, LazyFeed)
+    assert loader.feed.pending_tables == ["directions"]
+    assert "directions" in dir(loader.feed)
+
+    # A sample for the prompt does not load the table
+    assert loader.feed.peek("directions", 1).direction.tolist() == ["North"]
+    assert loader.feed.pending_tables == ["directions"]
+    assert loader.feed.directions.direction.tolist() == ["North", "South"]
+    assert loader.feed.pending_tables == []
+    assert not hasattr(loader.feed, "frequencies")
+
+    # Pickles hold a plain feed with every table
+    restored = pickle.loads(pickle.dumps(loader))
+    assert type(restored.feed) is gk.Feed
+    assert len(restored.feed.directions) == 2
+
+
+def test_iter_trip_chunks_keeps_trips_together():
+    stop_times = pd.DataFrame(
+        {"trip_id": list("aaabbbbbcd"), "stop_sequence": [1, 2, 3, 1, 2, 3, 4, 5, 1, 1]}
+    )
+    reader = (stop_times.iloc[i : i + 4] for i in range(0, len(stop_times), 4))
+    chunks = list(iter_trip_chunks(reader))
+    # The last trip of a chunk waits for the next one, in case it continues
+    assert [chunk.trip_id.tolist() for chunk in chunks] == [
+        list("aaa"),
+        list("bbbbbc"),
+        ["d"],
+    ]
+    assert all(chunk.index.equals(pd.RangeIndex(len(chunk))) for chunk in chunks)
+
+
+@pytest.fixture
+def service_feed():
+    calendar = pd.DataFrame(
+        {
+            "service_id": ["WK", "SA", "SU"],
+            **{day: [1, 0, 0] for day in WEEKDAYS[:5]},
+            "saturday": [0, 1, 0],
+            "sunday": [0, 0, 1],
+            "start_date": [datetime.date(2024, 7, 1)] * 3,
+            "end_date": [datetime.date(2024, 7, 31)] * 3,
+        }
+    )
+    calendar_dates = pd.DataFrame(
+        {
+            # Independence Day runs the Sunday service, plus a one-off event
+            "service_id": ["WK", "SU", "EVENT"],
+            "date": [datetime.date(2024, 7, 4)] * 2 + [datetime.date(2024, 8, 2)],
+            "exception_type": [2, 1, 1],
+        }
+    )
+    trips = pd.DataFrame(
+        {"trip_id": ["t1", "t2", "t3", "t4"], "service_id": ["WK", "SA", "SU", "EVENT"]}
+    )
+    return SimpleNamespace(
+        calendar=calendar, calendar_dates=calendar_dates, trips=trips
+    )
+
+
+def naive_service_ids(feed, date):
+    calendar = feed.calendar
+    running = calendar[
+        (calendar.start_date <= date)
+        & (calendar.end_date >= date)
+        & (calendar[WEEKDAYS[date.weekday()]] == 1)
+    ]
+    ids = set(running.service_id)
+    exceptions = feed.calendar_dates[feed.calendar_dates.date == date]
+    ids |= set(exceptions[exceptions.exception_type == 1].service_id)
+    ids -= set(exceptions[exceptions.exception_type == 2].service_id)
+    return sorted(ids)
+
+
+def test_service_calendar_matches_naive_filter(service_feed):
+    service_calendar = build_service_calendar(
+        service_feed.calendar, service_feed.calendar_dates
+    )
+    assert service_calendar.index[0] == pd.Timestamp(2024, 7, 1)
+    assert service_calendar.index[-1] == pd.Timestamp(2024, 8, 2)
+    for date in pd.date_range("2024-06-30", "2024-08-03"):
+        date = date.date()
+        assert sorted(active_service_ids(service_feed, date)) == naive_service_ids(
+            service_feed, date
+        )
+
+    # The precomputed bitmap is used when the feed has one
+    service_feed.service_calendar = service_calendar
+    assert active_trips(service_feed, "20240704").trip_id.tolist() == ["t3"]
+    assert active_trips(service_feed, "2024-07-05").trip_id.tolist() == ["t1"]
+    assert active_trips(service_feed, datetime.date(2024, 8, 2)).trip_id.tolist() == [
+        "t4"
+    ]
+
+
+def test_stop_patterns_round_trip():
+    stop_times = pd.DataFrame(
+        {
+            "trip_id": ["a"] * 3 + ["b"] * 3 + ["c"] * 2,
+            "arrival_time": [100.0, np.nan, 300.0, 700.0, np.nan, 900.0, 50.0, 80.0],
+            "departure_time": [110.0, np.nan, 300.0, 710.0, np.nan, 900.0, 50.0, 80.0],
+            "stop_id": ["s1", "s2", "s3", "s1", "s2", "s3", "s3", "s1"],
+            "stop_sequence": [1, 2, 3, 1, 2, 3, 1, 2],
+        }
+    )
+    stop_patterns, trip_patterns = build_stop_patterns(stop_times)
+    # Trips a and b run the same pattern 600 seconds apart
+    assert trip_patterns.pattern_id.tolist() == [0, 0, 1]
+    assert trip_patterns.start_time.tolist() == [100.0, 700.0, 50.0]
+    assert len(stop_patterns) == 5
+    np.testing.assert_array_equal(
+        stop_patterns.departure_offset[:3], [10.0, np.nan, 200.0]
+    )
+    pd.testing.assert_frame_equal(
+        materialize_stop_times(stop_patterns, trip_patterns), stop_times
+    )
+    pd.testing.assert_frame_equal(
+        materialize_stop_times(stop_patterns, trip_patterns, nrows=4),
+        stop_times.head(4),
+    )
+
+
+def test_compressed_stop_times_are_rebuilt_on_access():
+    expected = GTFSLoader("StarTran", STARTRAN_ZIP, "m")
+    assert expected.load_feed()
+    loader = GTFSLoader("StarTran", STARTRAN_ZIP, "m", compress_stop_times=True)
+    loader.load_all_tables()
+    assert "stop_times" in loader.feed.pending_tables
+    assert len(loader.feed.trip_patterns) == len(expected.feed.trip_stop_offsets)
+    pd.testing.assert_frame_equal(
+        loader.feed.peek("stop_times", 3), expected.feed.stop_times.head(3)
+    )
+
+    # Pickles keep the patterns only, and rebuild stop_times when loaded
+    restored = pickle.loads(pickle.dumps(loader))
+    assert restored.feed.pending_tables == ["stop_times"]
+    # Its size is known without rebuilding it
+    del restored.feed.trip_stop_offsets
+    assert stop_time_rows(restored.feed) == len(expected.feed.stop_times)
+    assert restored.feed.pending_tables == ["stop_times"]
+    pd.testing.assert_frame_equal(restored.feed.stop_times, expected.feed.stop_times)
+
+
+@pytest.fixture(scope="module")
+def cumtd_feed():
+    pickle_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "test_pickle_feed",
+        "CUMTD_gtfs_loader.pkl",
+    )
+    with gzip.open(pickle_path, "rb") as f:
+        return pickle.load(f).feed
+
+
+def mutate_feed(feed):
+    feed.stop_times.drop(feed.stop_times.index[:100], inplace=True)
+    feed.stops.loc[feed.stops.index[0], "stop_name"] = "changed"
+    feed.stops.index.name = "changed"
+    feed.routes["new_column"] = 1
+    feed.trips.sort_values("route_id", inplace=True)
+    feed.calendar = None
+    del feed.shapes
+    feed.new_table = pd.DataFrame({"a": [1]})
+
+
+@pytest.mark.parametrize("copy_on_write", [False, True])
+def test_feed_view_changes_never_reach_the_feed(cumtd_feed, copy_on_write):
+    expected = copy.deepcopy(cumtd_feed)
+    with pd.option_context("mode.copy_on_write", copy_on_write):
+        view = feed_view(cumtd_feed)
+        assert "stop_times" in view.pending_tables
+        mutate_feed(view)
+        assert view.stops.stop_name.iloc[0] == "changed"
+        assert "stop_times" not in view.pending_tables
+        # Tables the code did not touch are never copied
+        assert "agency" in view.pending_tables
+
+        fresh = feed_view(cumtd_feed)
+        if copy_on_write:
+            assert np.shares_memory(
+                fresh.stop_times.stop_sequence.to_numpy(),
+                cumtd_feed.stop_times.stop_sequence.to_numpy(),
+            )
+    for name in ["stop_times", "stops", "routes", "trips", "calendar", "shapes"]:
+        pd.testing.assert_frame_equal(getattr(fresh, name), getattr(expected, name))
+        pd.testing.assert_frame_equal(
+            getattr(cumtd_feed, name), getattr(expected, name)
+        )
+    assert fresh._trips_i.equals(expected._trips_i)
+    assert not hasattr(cumtd_feed, "new_table")
+
+
 # Add more tests for other methods in GTFSLoader
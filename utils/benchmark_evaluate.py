@@ -0,0 +1,112 @@
+import os
+import sys
+import copy
+import time
+import statistics
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import pandas as pd
+
+warnings.filterwarnings("ignore")
+
+# Get the directory of the current script
+current_dir = Path(__file__).parent.resolve()
+
+# Add the parent directory to sys.path
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+from evaluator import eval_code
+from evaluator.eval_code import GTFS_Eval
+from gtfs_agent.gtfs_loader import feed_view
+
+FEEDS = ["CUMTD", "samTrans"]
+
+QUERIES = {
+    "routes": "result = feed.routes.route_id.nunique()",
+    "stop_times": "result = feed.stop_times.groupby('trip_id').size().max()",
+    "mutation": "feed.stops['checked'] = True\nresult = int(feed.stops.checked.sum())",
+}
+
+# How `evaluate` hands the feed to generated code, see evaluator/eval_code.py
+MODES = {
+    "thread, deepcopy": dict(pool=False, copy_feed=copy.deepcopy, cow=False),
+    "thread, view": dict(pool=False, copy_feed=feed_view, cow=False),
+    "thread, view (copy-on-write)": dict(pool=False, copy_feed=feed_view, cow=True),
+    "worker pool": dict(pool=True, copy_feed=feed_view, cow=False),
+}
+
+
+def median_latency_ms(evaluator: GTFS_Eval, code: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = evaluator.evaluate(f"```python\n{code}\n```", use_cache=False)
+        times.append(time.perf_counter() - start)
+        assert output["eval_success"], output["error_message"]
+    return statistics.median(times) * 1e3
+
+
+def handoff_cost(feed, copy_feed, tables: list) -> tuple:
+    """
+    Time in milliseconds and memory in MiB to hand `feed` to generated code
+    that reads `tables`.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    copied = copy_feed(feed)
+    for table in tables:
+        getattr(copied, table)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed * 1e3, peak / 2**20
+
+
+def benchmark_feed(name: str, pickle_loc: str, repeat: int = 7) -> pd.DataFrame:
+    """
+    Median `evaluate` latency of each query in each mode, and the cost of
+    handing the feed to the code in the thread modes.
+
+    Args:
+        name (str): Feed name
+        pickle_loc (str): Path to the feed's gzipped GTFSLoader pickle
+        repeat (int): Evaluations per query and mode
+
+    Returns:
+        pd.DataFrame: Latency in milliseconds and memory in MiB, one row per mode
+    """
+    evaluator = GTFS_Eval({name: {"pickle_loc": pickle_loc}})
+    evaluator.get_system_prompt(name, "m", False)
+    pool = evaluator.pool
+    rows = []
+    for mode, options in MODES.items():
+        evaluator.pool = pool if options["pool"] else None
+        eval_code.feed_view = options["copy_feed"]
+        with pd.option_context("mode.copy_on_write", options["cow"]):
+            row = {"mode": mode}
+            for table in [] if options["pool"] else ["routes", "stop_times"]:
+                # Handing the feed to a query reading one table
+                row[f"{table}_handoff_ms"], row[f"{table}_handoff_mb"] = handoff_cost(
+                    evaluator.current_loader.feed, options["copy_feed"], [table]
+                )
+            for query, code in QUERIES.items():
+                row[f"{query}_ms"] = median_latency_ms(evaluator, code, repeat)
+        rows.append(row)
+    eval_code.feed_view = feed_view
+    return pd.DataFrame(rows)
+
+
+def run_benchmark(pickle_directory: str):
+    for name in FEEDS:
+        pickle_loc = os.path.join(pickle_directory, f"{name}_gtfs_loader.pkl")
+        if not os.path.exists(pickle_loc):
+            print(f"Skipping {name}, no pickle at {pickle_loc}")
+            continue
+        print(f"\n{name}")
+        print(benchmark_feed(name, pickle_loc).to_markdown(index=False, floatfmt=".1f"))
+
+
+if __name__ == "__main__":
+    run_benchmark(os.path.join(parent_dir, "gtfs_data", "feed_pickles"))
@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import gtfs_kit as gk
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from geopy.distance import geodesic
+
+warnings.filterwarnings("ignore")
+
+# Get the directory of the current script
+current_dir = Path(__file__).parent.resolve()
+
+# Add the parent directory to sys.path
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+from utils.constants import file_mapping
+from gtfs_agent.gtfs_loader import (
+    GTFSLoader,
+    compute_shape_distances,
+    parse_gtfs_times,
+    _parse_time_value,
+)
+
+
+def timed(func, *args, **kwargs):
+    """Run `func` once and return its result and the elapsed seconds."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def geodesic_shape_distances(shapes: pd.DataFrame) -> pd.Series:
+    """Reference point-by-point geodesic loop the vectorized engine replaced."""
+    distances = pd.Series(0.0, index=shapes.index)
+    for _, group in shapes.groupby("shape_id"):
+        cumulative_distance = 0
+        previous_point = None
+        for idx, row in group.iterrows():
+            current_point = (row["shape_pt_lat"], row["shape_pt_lon"])
+            if previous_point is not None:
+                cumulative_distance += geodesic(previous_point, current_point).meters
+            distances.at[idx] = cumulative_distance
+            previous_point = current_point
+    return distances
+
+
+def benchmark_shape_distances(agency_name: str, gtfs_path: str) -> dict:
+    """
+    Time the geodesic loop against both vectorized distance modes for one feed.
+
+    Args:
+        agency_name (str): Name of the transit agency
+        gtfs_path (str): Path to the agency's gtfs.zip
+
+    Returns:
+        dict: Timings in seconds and the largest deviation from geodesic in meters
+    """
+    shapes = gk.read_feed(gtfs_path, dist_units="m").shapes
+    shapes = shapes.sort_values(["shape_id", "shape_pt_sequence"])
+    reference, geodesic_time = timed(geodesic_shape_distances, shapes)
+    row = {"agency": agency_name, "points": len(shapes), "geodesic_s": geodesic_time}
+    for method in ["ellipsoid", "haversine"]:
+        result, elapsed = timed(compute_shape_distances, shapes, "m", method)
+        row[f"{method}_s"] = elapsed
+        row[f"{method}_max_err_m"] = (
+            (result.shape_dist_traveled - reference.loc[result.index]).abs().max()
+        )
+    return row
+
+
+def benchmark_stop_distances(agency_name: str, gtfs_path: str) -> dict:
+    """
+    Time snapping every stop time onto its trip's shape for one feed.
+
+    Args:
+        agency_name (str): Name of the transit agency
+        gtfs_path (str): Path to the agency's gtfs.zip
+
+    Returns:
+        dict: Trip and stop pattern counts with the snapping time in seconds
+    """
+    loader = GTFSLoader(agency_name, gtfs_path, "m")
+    feed = gk.read_feed(gtfs_path, dist_units="m")
+    feed = loader._calculate_shape_distances(feed)
+    stop_times = feed.stop_times.sort_values(["trip_id", "stop_sequence"])
+    patterns = stop_times.groupby("trip_id").stop_id.agg(tuple)
+    patterns = pd.DataFrame({"pattern": patterns}).join(
+        feed.trips.set_index("trip_id").shape_id
+    )
+    _, elapsed = timed(loader._calculate_stop_distances, feed)
+    return {
+        "agency": agency_name,
+        "stop_times": len(stop_times),
+        "trips": len(patterns),
+        "patterns": len(patterns.drop_duplicates()),
+        "snap_s": elapsed,
+    }
+
+
+def benchmark_time_parsing(stop_times: pd.DataFrame, n_rows: int) -> dict:
+    """
+    Time the per-cell np.vectorize parser against parse_gtfs_times.
+
+    Args:
+        stop_times (pd.DataFrame): Raw stop_times, resampled up to `n_rows`
+        n_rows (int): Number of rows to parse
+
+    Returns:
+        dict: Timings in seconds for both parsers over both time columns
+    """
+    stop_times = stop_times[["arrival_time", "departure_time"]].sample(
+        n_rows, replace=True, random_state=0
+    )
+    vparse_time = np.vectorize(lru_cache(maxsize=2**18)(_parse_time_value))
+    reference, vectorize_time = timed(stop_times.apply, vparse_time)
+    columnar, columnar_time = timed(
+        lambda: {column: parse_gtfs_times(stop_times[column]) for column in stop_times}
+    )
+    for column in stop_times:
+        assert np.array_equal(
+            reference[column].to_numpy(dtype=np.float32),
+            columnar[column],
+            equal_nan=True,
+        )
+    return {
+        "rows": n_rows,
+        "np_vectorize_s": vectorize_time,
+        "columnar_s": columnar_time,
+        "speedup": vectorize_time / columnar_time,
+    }
+
+
+def run_benchmarks(file_mapping):
+    shape_rows, stop_rows = [], []
+    for agency_name, agency_data in file_mapping.items():
+        gtfs_path = os.path.join(parent_dir, agency_data["file_loc"])
+        if not os.path.exists(gtfs_path):
+            continue
+        print("<====Benchmarking", agency_name, "====>")
+        shape_rows.append(benchmark_shape_distances(agency_name, gtfs_path))
+        stop_rows.append(benchmark_stop_distances(agency_name, gtfs_path))
+
+    # Raw HH:MM:SS strings, resampled up to metro-scale row counts
+    raw_stop_times = gk.read_feed(
+        os.path.join(parent_dir, file_mapping["StarTran"]["file_loc"]), dist_units="m"
+    ).stop_times
+    time_rows = [
+        benchmark_time_parsing(raw_stop_times, n_rows)
+        for n_rows in [100_000, 1_000_000, 5_000_000]
+    ]
+
+    print("\nShape distances")
+    print(pd.DataFrame(shape_rows).to_markdown(index=False, floatfmt=".4g"))
+    print("\nStop snapping")
+    print(pd.DataFrame(stop_rows).to_markdown(index=False, floatfmt=".4g"))
+    print("\nstop_times time parsing")
+    print(pd.DataFrame(time_rows).to_markdown(index=False, floatfmt=".4g"))
+
+
+if __name__ == "__main__":
+    run_benchmarks(file_mapping)
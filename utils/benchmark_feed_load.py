@@ -0,0 +1,162 @@
+import os
+import sys
+import glob
+import gzip
+import time
+import tempfile
+import multiprocessing
+import warnings
+import _pickle as cPickle
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import psutil
+
+warnings.filterwarnings("ignore")
+
+# Get the directory of the current script
+current_dir = Path(__file__).parent.resolve()
+
+# Add the parent directory to sys.path
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+from gtfs_agent.feed_store import load_feed_artifact, save_feed_artifact
+
+
+def load_pickle(path: str):
+    with gzip.open(path, "rb") as f:
+        return cPickle.load(f)
+
+
+def warm_up():
+    """
+    Pay the one-time import and Arrow reader start-up (thread pools, kernel
+    registry) before measuring, so only the feed itself is counted.
+    """
+    import gtfs_kit, shapely  # noqa: F401
+
+    with tempfile.TemporaryDirectory() as warmup:
+        pq.write_table(pa.table({"a": ["x"]}), os.path.join(warmup, "a.parquet"))
+        pq.read_table(os.path.join(warmup, "a.parquet")).to_pandas()
+
+
+def load(kind: str, path: str):
+    if kind == "pickle":
+        loader = load_pickle(path)
+    else:
+        # "lazy" reads the IPC artifact's tables on first access, the others
+        # read every table up front
+        loader = load_feed_artifact(path, lazy=kind == "lazy")
+    # Arrow's allocator holds on to freed read buffers until asked
+    pa.default_memory_pool().release_unused()
+    return loader
+
+
+def measure_load(kind: str, path: str) -> tuple:
+    """
+    Load one feed and return the elapsed seconds and resident memory it added.
+
+    Runs in a fresh worker process so earlier loads do not skew the RSS.
+    """
+    warm_up()
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    start = time.perf_counter()
+    loader = load(kind, path)
+    elapsed = time.perf_counter() - start
+    rss_added = process.memory_info().rss - rss_before
+    assert loader.feed is not None
+    return elapsed, rss_added / 2**20
+
+
+def hold_feed(kind: str, path: str, barrier, results):
+    """
+    Load a feed alongside the other processes of a sharing benchmark and
+    report the proportional set size (PSS) it added to this process.
+    PSS splits each shared page between the processes mapping it, so the
+    sum over all processes is the memory the feed really takes.
+    """
+    warm_up()
+    process = psutil.Process()
+    barrier.wait()
+    pss_before = process.memory_full_info().pss
+    barrier.wait()
+    loader = load(kind, path)
+    # Measure only once every process holds its copy
+    barrier.wait()
+    results.put((process.memory_full_info().pss - pss_before) / 2**20)
+    barrier.wait()
+    assert loader.feed is not None
+
+
+def measure_shared(kind: str, path: str, n_processes: int) -> float:
+    """Total PSS in MiB added by `n_processes` processes each holding the feed."""
+    context = multiprocessing.get_context("spawn")
+    barrier, results = context.Barrier(n_processes), context.Queue()
+    processes = [
+        context.Process(target=hold_feed, args=(kind, path, barrier, results))
+        for _ in range(n_processes)
+    ]
+    for process in processes:
+        process.start()
+    total = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    return total
+
+
+def directory_size_mb(path: str) -> float:
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 2**20
+    return sum(f.stat().st_size for f in Path(path).iterdir()) / 2**20
+
+
+def benchmark_feed(pickle_path: str, artifact_root: str, n_processes: int) -> dict:
+    """
+    Convert one pickled loader to Parquet and IPC artifacts and compare
+    loading all three formats, and loading the IPC artifact lazily.
+
+    Args:
+        pickle_path (str): Path to a gzipped GTFSLoader pickle
+        artifact_root (str): Directory to write the artifacts under
+        n_processes (int): Number of processes holding the feed at once
+
+    Returns:
+        dict: Size on disk, load time, added RSS for one process and total
+            PSS for `n_processes` processes, per format
+    """
+    loader = load_pickle(pickle_path)
+    paths = {"pickle": pickle_path}
+    for file_format in ["parquet", "ipc"]:
+        paths[file_format] = os.path.join(
+            artifact_root, f"{Path(pickle_path).stem}_{file_format}"
+        )
+        save_feed_artifact(loader, paths[file_format], file_format)
+    paths["lazy"] = paths["ipc"]
+
+    row = {"feed": os.path.basename(pickle_path).replace("_gtfs_loader.pkl", "")}
+    for kind, path in paths.items():
+        # One process per load: spawn start, nothing shared with the parent
+        with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+            elapsed, rss = pool.submit(measure_load, kind, path).result()
+        row[f"{kind}_mb"] = directory_size_mb(path)
+        row[f"{kind}_load_s"] = elapsed
+        row[f"{kind}_rss_mb"] = rss
+        row[f"{kind}_pss_x{n_processes}_mb"] = measure_shared(kind, path, n_processes)
+    return row
+
+
+def run_benchmarks(pickle_directory: str, n_processes: int = 4):
+    rows = []
+    with tempfile.TemporaryDirectory() as artifact_root:
+        for pickle_path in sorted(glob.glob(os.path.join(pickle_directory, "*.pkl"))):
+            print("<====Benchmarking", pickle_path, "====>")
+            rows.append(benchmark_feed(pickle_path, artifact_root, n_processes))
+    print(pd.DataFrame(rows).set_index("feed").T.to_markdown(floatfmt=".3g"))
+
+
+if __name__ == "__main__":
+    run_benchmarks(os.path.join(parent_dir, "gtfs_data", "feed_pickles"))
@@ -0,0 +1,69 @@
+import os
+import re
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import pandas as pd
+import yaml
+
+warnings.filterwarnings("ignore")
+
+# Get the directory of the current script
+current_dir = Path(__file__).parent.resolve()
+
+# Add the parent directory to sys.path
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+from evaluator.eval_code import GTFS_Eval
+from evaluator.rewrite_code import rewrite_code
+
+FEED = "CUMTD"
+
+
+def answer_code(answer: str) -> str:
+    code = re.findall(r"```python\n(.*?)```", answer, re.DOTALL)
+    return code[0] if code else ""
+
+
+def run_benchmark(pickle_loc: str, few_shot_file: str):
+    """
+    Wall time of each few-shot answer for FEED that rewrite_code changes,
+    evaluated as generated and rewritten.
+    """
+    evaluator = GTFS_Eval({FEED: {"pickle_loc": pickle_loc}})
+    evaluator.get_system_prompt(FEED, "m", False)
+    with open(few_shot_file) as f:
+        examples = yaml.safe_load(f)
+    rows = []
+    for name, example in examples.items():
+        if example.get("feed") != FEED:
+            continue
+        rewrites = rewrite_code(answer_code(example["answer"]))[1]
+        if not rewrites:
+            continue
+        row = {"example": name, "rewrites": len(rewrites)}
+        for rewrite in (False, True):
+            start = time.perf_counter()
+            output = evaluator.evaluate(
+                example["answer"], use_cache=False, rewrite=rewrite
+            )
+            column = "rewritten" if rewrite else "original"
+            row[f"{column}_s"] = time.perf_counter() - start
+            row[f"{column}_ok"] = output["eval_success"]
+        rows.append(row)
+    results = pd.DataFrame(rows)
+    results["speedup"] = results.original_s / results.rewritten_s
+    print(results.to_markdown(index=False, floatfmt=".2f"))
+    print(
+        f"\nTotal: {results.original_s.sum():.1f} s as generated, "
+        f"{results.rewritten_s.sum():.1f} s rewritten"
+    )
+
+
+if __name__ == "__main__":
+    run_benchmark(
+        os.path.join(parent_dir, "gtfs_data", "feed_pickles", f"{FEED}_gtfs_loader.pkl"),
+        os.path.join(parent_dir, "data", "few_shot.yaml"),
+    )
@@ -0,0 +1,124 @@
+import os
+import sys
+import gzip
+import time
+import warnings
+import _pickle as cPickle
+from pathlib import Path
+
+import pandas as pd
+
+warnings.filterwarnings("ignore")
+
+# Get the directory of the current script
+current_dir = Path(__file__).parent.resolve()
+
+# Add the parent directory to sys.path
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+from gtfs_agent.gtfs_loader import (
+    apply_compact_dtypes,
+    build_stop_patterns,
+    materialize_stop_times,
+    sort_stop_times,
+)
+
+FEEDS = ["CUMTD", "samTrans"]
+
+
+def table_memory_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(index=True, deep=True).sum() / 2**20
+
+
+def best_of(func, repeat: int = 5) -> float:
+    """Fastest of `repeat` runs of func, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1e3
+
+
+def trips_at_stops_flat(stop_times: pd.DataFrame, stop_ids) -> pd.Series:
+    return stop_times[stop_times.stop_id.isin(stop_ids)].trip_id.unique()
+
+
+def trips_at_stops_patterns(stop_patterns, trip_patterns, stop_ids) -> pd.Series:
+    # Only the patterns are scanned, then mapped to their trips
+    patterns = stop_patterns[stop_patterns.stop_id.isin(stop_ids)].pattern_id.unique()
+    return trip_patterns[trip_patterns.pattern_id.isin(patterns)].trip_id.unique()
+
+
+def stop_visits_flat(stop_times: pd.DataFrame) -> pd.Series:
+    return stop_times.stop_id.value_counts()
+
+
+def stop_visits_patterns(stop_patterns, trip_patterns) -> pd.Series:
+    trips_per_pattern = trip_patterns.pattern_id.value_counts()
+    weights = stop_patterns.pattern_id.map(trips_per_pattern)
+    return weights.groupby(stop_patterns.stop_id, observed=True).sum()
+
+
+def benchmark_feed(pickle_path: str, compact: bool) -> dict:
+    """
+    Memory of stop_times flat and as trip patterns, and the time to build,
+    materialize and scan each form.
+
+    Args:
+        pickle_path (str): Path to a gzipped GTFSLoader pickle
+        compact (bool): Apply compact dtypes first
+
+    Returns:
+        dict: One row of the report
+    """
+    with gzip.open(pickle_path, "rb") as f:
+        stop_times = sort_stop_times(cPickle.load(f).feed.stop_times)
+    if compact:
+        stop_times = apply_compact_dtypes(stop_times, "stop_times.txt")
+
+    start = time.perf_counter()
+    stop_patterns, trip_patterns = build_stop_patterns(stop_times)
+    build_ms = (time.perf_counter() - start) * 1e3
+    stop_ids = stop_times.stop_id.drop_duplicates().sample(20, random_state=0)
+
+    flat_mb = table_memory_mb(stop_times)
+    patterns_mb = table_memory_mb(stop_patterns) + table_memory_mb(trip_patterns)
+    return {
+        "dtypes": "compact" if compact else "default",
+        "rows": len(stop_times),
+        "patterns": len(trip_patterns.pattern_id.unique()),
+        "pattern_rows": len(stop_patterns),
+        "flat_mb": flat_mb,
+        "patterns_mb": patterns_mb,
+        "saved": 1 - patterns_mb / flat_mb,
+        "build_ms": build_ms,
+        "materialize_ms": best_of(
+            lambda: materialize_stop_times(stop_patterns, trip_patterns)
+        ),
+        "stop_scan_flat_ms": best_of(lambda: trips_at_stops_flat(stop_times, stop_ids)),
+        "stop_scan_patterns_ms": best_of(
+            lambda: trips_at_stops_patterns(stop_patterns, trip_patterns, stop_ids)
+        ),
+        "visits_flat_ms": best_of(lambda: stop_visits_flat(stop_times)),
+        "visits_patterns_ms": best_of(
+            lambda: stop_visits_patterns(stop_patterns, trip_patterns)
+        ),
+    }
+
+
+def run_benchmark(pickle_directory: str):
+    for feed in FEEDS:
+        pickle_path = os.path.join(pickle_directory, f"{feed}_gtfs_loader.pkl")
+        if not os.path.exists(pickle_path):
+            print(f"Skipping {feed}, no pickle at {pickle_path}")
+            continue
+        report = pd.DataFrame(
+            [benchmark_feed(pickle_path, compact) for compact in [False, True]]
+        )
+        print(f"\n{feed}")
+        print(report.round(2).T.to_markdown())
+
+
+if __name__ == "__main__":
+    run_benchmark(os.path.join(parent_dir, "gtfs_data", "feed_pickles"))
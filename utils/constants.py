@@ -3,6 +3,26 @@ import streamlit as st
 
 # Set timeout to 5 minutes
 TIMEOUT_SECONDS = 5 * 60
+# Generated code gets TIMEOUT_SECONDS on feeds with EVAL_BUDGET_FULL_ROWS stop_times rows or more,
+# proportionally less on smaller feeds but at least EVAL_BUDGET_MIN_SECONDS, and is stopped once it is spent
+EVAL_BUDGET_FULL_ROWS = 2_000_000
+EVAL_BUDGET_MIN_SECONDS = 30
+# Pre-forked worker processes per feed that run generated code (0 runs it in a thread of the app)
+EVAL_WORKERS = 2
+# Seconds an evaluation waits for an idle worker before it fails
+EVAL_WORKER_WAIT_SECONDS = TIMEOUT_SECONDS
+# Per-evaluation limits of a worker: CPU seconds on top of the evaluation's wall clock budget, for code
+# using several cores, and memory (MiB) on top of what it shares with the app
+EVAL_CPU_MARGIN_SECONDS = 60
+EVAL_MEMORY_MB = 4 * 1024
+# Profile generated code line by line and show its slowest lines to the LLM when it times out
+PROFILE_GENERATED_CODE = False
+PROFILE_TOP_LINES = 5
+# Rewrite slow pandas patterns in generated code into equivalent faster calls before running it
+REWRITE_GENERATED_CODE = False
+# Results of generated code are reused for identical code on the same feed for up to an hour, in at most this many MiB (0 disables)
+EVAL_CACHE_TTL_SECONDS = 60 * 60
+EVAL_CACHE_MAX_MB = 256
 
 # File to store sample questions
 QUESTIONS_FILE = "data/sample_questions.json"
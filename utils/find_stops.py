@@ -1,10 +1,19 @@
 import re
+import datetime
+import numpy as np
 import pandas as pd
 from thefuzz import fuzz, process
 from geopy.distance import geodesic
 from geopy.geocoders import Nominatim
 import streamlit as st
 import googlemaps
+from gtfs_agent.gtfs_loader import (
+    build_departure_index,
+    build_trip_index,
+    parse_gtfs_times,
+    slice_positions,
+    sort_stop_times,
+)
 
 
 def remove_text_in_braces(text):
@@ -225,6 +234,182 @@ def find_nearby_stops(
         return stops_df.nsmallest(max_stops, "distance")
 
 
+def _time_in_seconds(value) -> float:
+    """Seconds since midnight from seconds, a datetime.time or a "HH:MM:SS" string."""
+    if isinstance(value, (datetime.time, datetime.datetime)):
+        return value.hour * 3600 + value.minute * 60 + value.second
+    if isinstance(value, str):
+        return float(parse_gtfs_times([value])[0])
+    return float(value)
+
+
+def _departure_index(feed, rebuild: bool = False) -> tuple:
+    """The feed's stop departure index, kept on the feed and built if missing or rebuild."""
+    if rebuild or getattr(feed, "stop_departure_offsets", None) is None:
+        feed.stop_departures, feed.stop_departure_offsets = build_departure_index(
+            feed.stop_times
+        )
+    return feed.stop_departures, feed.stop_departure_offsets
+
+
+def _rows_match(stop_times: pd.DataFrame, column: str, rows: np.ndarray, expected) -> bool:
+    """
+    Whether positions `rows` of stop_times hold `expected` in `column`, i.e. an
+    index built earlier still fits the table. Generated code may sort or
+    replace feed.stop_times, which leaves the index pointing at other rows.
+    """
+    if len(rows) and rows.max() >= len(stop_times):
+        return False
+    values = stop_times[column].iloc[rows].to_numpy().astype(str)
+    return bool(np.all(values == expected))
+
+
+def _stop_departures(stop_departures, offsets, stop_id: str) -> tuple:
+    """The departure times of a stop, sorted, and their positions in stop_times."""
+    if stop_id not in offsets.index:
+        return np.array([], dtype=np.float64), np.array([], dtype=np.int64)
+    start, end = offsets.loc[stop_id, ["start", "end"]].to_numpy(dtype=np.int64)
+    return (
+        stop_departures.departure_time.to_numpy()[start:end],
+        stop_departures.row.to_numpy()[start:end],
+    )
+
+
+def find_departures(
+    feed,
+    stop_id: str,
+    start_time,
+    end_time=None,
+    max_departures: int = None,
+) -> pd.DataFrame:
+    """
+    Find the stop times departing from a stop within a time window.
+
+    This function binary-searches the feed's precomputed stop departure
+    index instead of filtering all of `feed.stop_times`. The index is rebuilt
+    when it no longer matches `feed.stop_times`, e.g. after generated code
+    sorted or replaced the table.
+
+    Args:
+        feed: GTFS feed with `stop_times` (departure_time in seconds since midnight)
+        stop_id (str): The stop to depart from
+        start_time: Start of the window, inclusive. Seconds since midnight,
+                    a datetime.time or a "HH:MM:SS" string. Eg: "17:00:00"
+        end_time (optional): End of the window, inclusive, in the same formats.
+                             Defaults to no end.
+        max_departures (int, optional): Return at most this many departures.
+
+    Returns:
+        pd.DataFrame: The rows of `feed.stop_times` for that stop and window,
+                      sorted by departure_time. Empty if the stop has no departures.
+
+    Note:
+        Only departure_time is considered, so trips on every service day are
+        included. Combine with `active_trips(feed, date)` for a single date.
+    """
+    stop_id = str(stop_id)
+    stop_departures, offsets = _departure_index(feed)
+    times, rows = _stop_departures(stop_departures, offsets, stop_id)
+    stale = not _rows_match(feed.stop_times, "stop_id", rows, stop_id)
+    if not stale and stop_id not in offsets.index:
+        # A stop missing from the index may have been added since
+        stop_times = feed.stop_times
+        at_stop = stop_times.stop_id.astype(str).eq(stop_id)
+        stale = bool((at_stop & stop_times.departure_time.notna()).any())
+    if stale:
+        stop_departures, offsets = _departure_index(feed, rebuild=True)
+        times, rows = _stop_departures(stop_departures, offsets, stop_id)
+    low = np.searchsorted(times, _time_in_seconds(start_time), side="left")
+    high = len(rows)
+    if end_time is not None:
+        high = np.searchsorted(times, _time_in_seconds(end_time), side="right")
+    return feed.stop_times.iloc[rows[low:high][:max_departures]]
+
+
+def next_departures(feed, stop_id: str, after, count: int = 5) -> pd.DataFrame:
+    """
+    Find the next departures from a stop at or after a given time.
+
+    Args:
+        feed: GTFS feed with `stop_times`
+        stop_id (str): The stop to depart from
+        after: Seconds since midnight, a datetime.time or a "HH:MM:SS" string
+        count (int, optional): Number of departures to return. Defaults to 5.
+
+    Returns:
+        pd.DataFrame: Up to `count` rows of `feed.stop_times`, sorted by departure_time
+    """
+    return find_departures(feed, stop_id, after, max_departures=count)
+
+
+def _trip_index(feed, rebuild: bool = False) -> pd.DataFrame:
+    """
+    The feed's trip offsets into `feed.stop_times`, kept on the feed.
+
+    The index is rebuilt if rebuild, or when it no longer covers
+    `feed.stop_times`, e.g. after generated code replaced the table. A table
+    not grouped by trip is sorted first, since a trip's rows must be one slice.
+    """
+    offsets = getattr(feed, "trip_stop_offsets", None)
+    rows = len(feed.stop_times)
+    if (
+        rebuild
+        or offsets is None
+        or (offsets.end.max() if len(offsets) else 0) != rows
+    ):
+        try:
+            offsets = build_trip_index(feed.stop_times)
+        except ValueError:
+            feed.stop_times = sort_stop_times(feed.stop_times)
+            feed.stop_departures = feed.stop_departure_offsets = None
+            offsets = build_trip_index(feed.stop_times)
+        feed.trip_stop_offsets = offsets
+    return offsets
+
+
+def _trip_rows(offsets: pd.DataFrame, trip_ids: pd.Index) -> tuple:
+    """Positions in stop_times of the rows of trip_ids and the trip_id each row holds."""
+    found = offsets.reindex(trip_ids).dropna()
+    starts = found.start.to_numpy(dtype=np.int64)
+    ends = found.end.to_numpy(dtype=np.int64)
+    return slice_positions(starts, ends), np.repeat(found.index.to_numpy(), ends - starts)
+
+
+def trip_stop_times(feed, trip_ids) -> pd.DataFrame:
+    """
+    Get the stop times of one trip or a batch of trips.
+
+    This function slices `feed.stop_times`, which is stored sorted by
+    (trip_id, stop_sequence), using the feed's trip offset index instead
+    of filtering the whole table. The index is rebuilt when the rows it
+    points at no longer belong to the trips, e.g. after generated code
+    sorted `feed.stop_times` in place.
+
+    Args:
+        feed: GTFS feed with `stop_times`
+        trip_ids: A single trip_id, or a list/array/Series of trip_ids
+
+    Returns:
+        pd.DataFrame: The rows of `feed.stop_times` for the trips, in stop_sequence
+                      order. For a single trip this is a slice sharing memory with
+                      `feed.stop_times`; use `.copy()` before modifying it. For a batch
+                      the trips follow the order given. Unknown trip_ids have no rows.
+
+    Example:
+        >>> stops_of_trip = trip_stop_times(feed, "trip_1")
+        >>> stops_of_trips = trip_stop_times(feed, feed.trips.trip_id[:10])
+    """
+    single = np.ndim(trip_ids) == 0
+    trip_ids = pd.Index([trip_ids] if single else trip_ids).astype(str)
+    rows, row_trips = _trip_rows(_trip_index(feed), trip_ids)
+    if not _rows_match(feed.stop_times, "trip_id", rows, row_trips):
+        # Generated code reordered feed.stop_times in place
+        rows, row_trips = _trip_rows(_trip_index(feed, rebuild=True), trip_ids)
+    if single and len(rows):
+        return feed.stop_times.iloc[rows[0] : rows[-1] + 1]
+    return feed.stop_times.iloc[rows]
+
+
 def find_stops_by_address(
     feed, address: str, radius_meters: float = 200, max_stops: int = 5
 ) -> pd.DataFrame:
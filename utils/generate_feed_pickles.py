@@ -1,11 +1,24 @@
 import os
 import sys
+import time
+import argparse
+import tempfile
 import warnings
 import _pickle as cPickle
 import gzip
 import json
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
+import psutil
+from tabulate import tabulate
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 warnings.filterwarnings("ignore")
 
 # Get the directory of the current script
@@ -15,10 +28,11 @@ current_dir = Path(__file__).parent.resolve()
 parent_dir = current_dir.parent
 sys.path.append(str(parent_dir))
 from utils.constants import file_mapping
-from gtfs_agent.gtfs_loader import GTFSLoader
+from gtfs_agent.gtfs_loader import STOP_TIMES_CHUNK_ROWS, GTFSLoader
+from gtfs_agent.feed_store import save_feed_artifact, stream_feed_artifact
 
 
-def process_single_feed(agency_name, agency_data, output_directory, parent_dir):
+def process_single_feed(agency_name, agency_data, output_directory, parent_dir, artifact_directory=None, artifact_format="ipc", cache_directory=None, compact_dtypes=False, stream_chunk_rows=None, compress_stop_times=False):
     """
     Process a single GTFS feed: create GTFSLoader, pickle it, and update agency data.
     
@@ -27,6 +41,12 @@ def process_single_feed(agency_name, agency_data, output_directory, parent_dir):
         agency_data (dict): Dictionary containing agency's GTFS data information
         output_directory (str): Directory to store the pickled GTFSLoader
         parent_dir (Path): Parent directory path for relative path calculations
+        artifact_directory (str, optional): Directory to also store the feed's columnar artifact in
+        artifact_format (str): "ipc" (memory-mapped when served) or "parquet"
+        cache_directory (str, optional): Directory for the per-feed build cache, so a rebuild only reruns the stages whose input files changed
+        compact_dtypes (bool): Store IDs as categoricals and integers and times in small int dtypes
+        stream_chunk_rows (int, optional): Stream stop_times.txt straight into the artifact in chunks of this many rows, so the build never holds the whole table. No pickle is written, as it would lack stop_times
+        compress_stop_times (bool): Store stop_times as timed trip patterns, rebuilt when first accessed
     
     Returns:
         dict: Updated agency_data dictionary
@@ -41,8 +61,24 @@ def process_single_feed(agency_name, agency_data, output_directory, parent_dir):
             gtfs=agency_name,
             gtfs_path=agency_data["file_loc"],
             distance_unit=agency_data["distance_unit"] or "km",  # Default to 'km' if None
+            cache_dir=os.path.join(cache_directory, agency_name) if cache_directory else None,
+            compact_dtypes=compact_dtypes,
+            compress_stop_times=compress_stop_times,
         )
 
+        if stream_chunk_rows:
+            if not artifact_directory:
+                raise ValueError("Streaming stop_times needs an artifact directory")
+            artifact_path = os.path.join(artifact_directory, agency_name)
+            if stream_feed_artifact(loader, artifact_path, artifact_format, stream_chunk_rows) is None:
+                raise ValueError(f"Could not load the GTFS feed of {agency_name}")
+            print(f"Streamed columnar artifact for {agency_name} to {artifact_path}")
+            agency_data["artifact_loc"] = os.path.relpath(artifact_path, start=parent_dir).replace("\\", "/")
+            # An older pickle would be served if the artifact went missing
+            agency_data.pop("pickle_loc", None)
+            agency_data.pop("error", None)
+            return agency_data
+
         # Load all tables
         loader.load_all_tables()
 
@@ -58,7 +94,15 @@ def process_single_feed(agency_name, agency_data, output_directory, parent_dir):
 
         # Add relative pickle location to agency_data
         agency_data["pickle_loc"] = os.path.relpath(filepath, start=parent_dir).replace("\\", "/")
-        
+
+        if artifact_directory:
+            artifact_path = os.path.join(artifact_directory, agency_name)
+            save_feed_artifact(loader, artifact_path, artifact_format)
+            print(f"Stored columnar artifact for {agency_name} at {artifact_path}")
+            agency_data["artifact_loc"] = os.path.relpath(artifact_path, start=parent_dir).replace("\\", "/")
+        # Clear the error left by an earlier failed build
+        agency_data.pop("error", None)
+
     except Exception as e:
         print(f"Error processing {agency_name}: {str(e)}")
         # Add error information to agency_data
@@ -66,32 +110,294 @@ def process_single_feed(agency_name, agency_data, output_directory, parent_dir):
     
     return agency_data
 
-def pickle_gtfs_loaders(file_mapping, output_directory, mapping_file_path):
+
+def peak_rss_mb():
+    """Peak resident memory of the current process in MiB."""
+    if resource is None:
+        return psutil.Process().memory_info().peak_wset / 2**20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def build_feed_in_worker(
+    agency_name,
+    agency_data,
+    output_directory,
+    parent_dir,
+    memory_limit_mb=None,
+    **options,
+):
+    """
+    Pool entry point: build one feed under an optional address-space limit.
+    `options` are passed on to process_single_feed.
+
+    Each worker process builds a single feed, so its peak RSS is the feed's.
+
+    Returns:
+        tuple: (agency_data, elapsed seconds, peak RSS in MiB)
+    """
+    if memory_limit_mb and resource is not None:
+        limit = int(memory_limit_mb * 2**20)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    start = time.perf_counter()
+    agency_data = process_single_feed(
+        agency_name, agency_data, output_directory, parent_dir, **options
+    )
+    return agency_data, time.perf_counter() - start, peak_rss_mb()
+
+
+def merge_file_mapping(mapping_file_path, updates):
+    """
+    Merge updated agency entries into the mapping file atomically.
+
+    The file is re-read so entries changed by someone else are kept, and the
+    result is written to a temporary file that replaces the original, so a
+    reader never sees a half-written mapping.
+    """
+    mapping = {}
+    if os.path.exists(mapping_file_path):
+        with open(mapping_file_path, "r") as f:
+            mapping = json.load(f)
+    mapping.update(updates)
+
+    mapping_dir = os.path.dirname(os.path.abspath(mapping_file_path))
+    fd, temp_path = tempfile.mkstemp(dir=mapping_dir, suffix=".json.tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(mapping, f, indent=2)
+        os.replace(temp_path, mapping_file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return mapping
+
+
+def _run_pool(jobs, workers, output_directory, memory_limit_mb, options):
+    """
+    Build `jobs` ({agency_name: agency_data}) and yield each feed's outcome,
+    the worker's result or the exception its build failed with.
+
+    Only `workers` feeds are submitted at a time, and none once a worker has
+    died and broken the pool, so mostly just the feeds in flight yield
+    BrokenProcessPool and the rest are built in a fresh pool. A feed submitted
+    before the pool noticed the dead worker fails with them.
+    """
+    queued = list(jobs.items())
+    while queued:
+        with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+            running = {}
+            broken = False
+            while running or (queued and not broken):
+                # A worker may have died while the last outcome was recorded
+                broken = broken or any(
+                    future.done() and isinstance(future.exception(), BrokenProcessPool)
+                    for future in running
+                )
+                while queued and len(running) < workers and not broken:
+                    agency_name, agency_data = queued[0]
+                    try:
+                        future = pool.submit(
+                            build_feed_in_worker,
+                            agency_name,
+                            agency_data,
+                            output_directory,
+                            parent_dir,
+                            memory_limit_mb,
+                            **options,
+                        )
+                    except BrokenProcessPool:
+                        broken = True
+                    else:
+                        running[future] = agency_name
+                        queued.pop(0)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    agency_name = running.pop(future)
+                    try:
+                        outcome = future.result()
+                    except Exception as e:
+                        broken = broken or isinstance(e, BrokenProcessPool)
+                        outcome = e
+                    yield agency_name, outcome
+
+
+def _record_feed(file_mapping, mapping_file_path, agency_name, outcome):
+    """Merge one finished or failed feed into the mapping and return its stats row."""
+    if isinstance(outcome, Exception):
+        print(f"Error processing {agency_name}: {outcome!r}")
+        agency_data = file_mapping[agency_name]
+        agency_data["error"] = (
+            "Worker process died while building the feed"
+            if isinstance(outcome, BrokenProcessPool)
+            else str(outcome)
+        )
+        outcome = (agency_data, None, None)
+    agency_data, elapsed, peak_rss = outcome
+    file_mapping[agency_name] = agency_data
+    merge_file_mapping(mapping_file_path, {agency_name: agency_data})
+    status = "error" if "error" in agency_data else "ok"
+    return [
+        agency_name,
+        status,
+        None if elapsed is None else round(elapsed, 1),
+        None if peak_rss is None else round(peak_rss),
+    ]
+
+
+def pickle_gtfs_loaders(
+    file_mapping,
+    output_directory,
+    mapping_file_path,
+    workers=1,
+    memory_limit_mb=None,
+    artifact_directory=None,
+    artifact_format="ipc",
+    cache_directory=None,
+    compact_dtypes=False,
+    stream_chunk_rows=None,
+    compress_stop_times=False,
+):
     """
     Create, pickle, and store GTFSLoader objects based on the provided file mapping.
     Update the file_mapping with pickle locations and save it to a specified path.
+
+    Feeds are built in a process pool of `workers` processes, one fresh process
+    per feed, each limited to `memory_limit_mb` of address space if given. A
+    feed that fails, or whose worker dies, is recorded with an `error` entry
+    and does not stop the others: feeds in flight when a worker dies are
+    retried one at a time and the rest go on in a fresh pool. Each finished
+    feed is merged into the mapping file right away, and a timing and peak
+    RSS table is printed at the end. With `artifact_directory`, each feed is also written there as a
+    columnar artifact in `artifact_format` (see gtfs_agent/feed_store.py).
+    With `cache_directory`, build stages whose input files are unchanged since
+    the last build are restored from the cache instead of recomputed.
+    `compact_dtypes` stores IDs as categoricals and integer and time columns
+    as small int dtypes (see utils/report_feed_memory.py for the savings).
+    With `stream_chunk_rows`, stop_times.txt is streamed into the artifact in
+    chunks of that many rows instead of being read whole, bounding the peak
+    memory of large feeds; those feeds get no pickle. `compress_stop_times`
+    stores stop_times as the unique timed stop patterns of the trips, see
+    gtfs_loader.build_stop_patterns.
     """
+    options = {
+        "artifact_directory": artifact_directory,
+        "artifact_format": artifact_format,
+        "cache_directory": cache_directory,
+        "compact_dtypes": compact_dtypes,
+        "stream_chunk_rows": stream_chunk_rows,
+        "compress_stop_times": compress_stop_times,
+    }
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
+    if memory_limit_mb and resource is None:
+        print("Memory limits are not supported on this platform, ignoring")
 
-    for agency_name, agency_data in file_mapping.items():
-        print("<====Processing", agency_name, "====>")
-        file_mapping[agency_name] = process_single_feed(
-            agency_name, 
-            agency_data, 
-            output_directory, 
-            parent_dir
-        )
+    print(f"<====Processing {len(file_mapping)} feeds with {workers} workers====>")
+    stats = []
+    crashed = []
+    for agency_name, outcome in _run_pool(
+        file_mapping, workers, output_directory, memory_limit_mb, options
+    ):
+        if isinstance(outcome, BrokenProcessPool):
+            crashed.append(agency_name)
+        else:
+            stats.append(
+                _record_feed(file_mapping, mapping_file_path, agency_name, outcome)
+            )
 
-    # Save updated file_mapping
-    with open(mapping_file_path, "w") as f:
-        json.dump(file_mapping, f, indent=2)
+    # The feeds in flight when a worker died are retried on their own, so
+    # the one that killed it cannot take another feed down with it
+    for agency_name in crashed:
+        print("<====Retrying", agency_name, "====>")
+        jobs = {agency_name: file_mapping[agency_name]}
+        [(_, outcome)] = list(
+            _run_pool(jobs, 1, output_directory, memory_limit_mb, options)
+        )
+        stats.append(_record_feed(file_mapping, mapping_file_path, agency_name, outcome))
 
     print(f"Updated file mapping saved to {mapping_file_path}")
+    print(
+        tabulate(
+            sorted(stats),
+            headers=["Agency", "Status", "Time (s)", "Peak RSS (MiB)"],
+            tablefmt="github",
+        )
+    )
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build pickled GTFS feeds")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of feeds built in parallel"
+    )
+    parser.add_argument(
+        "--memory-limit-mb",
+        type=int,
+        default=None,
+        help="Address-space limit per feed build, in MiB",
+    )
+    parser.add_argument(
+        "--no-artifacts",
+        action="store_true",
+        help="Only write pickles, not the columnar feed artifacts",
+    )
+    parser.add_argument(
+        "--artifact-format",
+        choices=["ipc", "parquet"],
+        default="ipc",
+        help="ipc artifacts are memory-mapped and shared between app processes, "
+        "parquet ones are smaller on disk",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Recompute every build stage instead of reusing cached results",
+    )
+    parser.add_argument(
+        "--compact-dtypes",
+        action="store_true",
+        help="Store IDs as categoricals and integer and time columns as small ints",
+    )
+    parser.add_argument(
+        "--stream-stop-times",
+        type=int,
+        nargs="?",
+        const=STOP_TIMES_CHUNK_ROWS,
+        default=None,
+        metavar="ROWS",
+        help="Stream stop_times.txt into the artifact in chunks of ROWS rows "
+        f"(default {STOP_TIMES_CHUNK_ROWS}) to bound memory on very large feeds; "
+        "writes no pickle",
+    )
+    parser.add_argument(
+        "--compress-stop-times",
+        action="store_true",
+        help="Store stop_times as the unique timed stop patterns of the trips, "
+        "rebuilt when first accessed",
+    )
+    args = parser.parse_args()
+    if args.stream_stop_times and args.compress_stop_times:
+        parser.error("--compress-stop-times does not apply to streamed builds")
+    if args.stream_stop_times and args.no_artifacts:
+        parser.error("--stream-stop-times writes artifacts, drop --no-artifacts")
+
     pickle_gtfs_loaders(
         file_mapping,
         os.path.join(parent_dir, "gtfs_data", "feed_pickles"),
         os.path.join(parent_dir, "gtfs_data", "file_mapping.json"),
+        workers=args.workers,
+        memory_limit_mb=args.memory_limit_mb,
+        artifact_directory=None
+        if args.no_artifacts
+        else os.path.join(parent_dir, "gtfs_data", "feed_artifacts"),
+        artifact_format=args.artifact_format,
+        cache_directory=None
+        if args.no_cache
+        else os.path.join(parent_dir, "gtfs_data", "build_cache"),
+        compact_dtypes=args.compact_dtypes,
+        stream_chunk_rows=args.stream_stop_times,
+        compress_stop_times=args.compress_stop_times,
     )
@@ -0,0 +1,101 @@
+import os
+import sys
+import statistics
+import subprocess
+from pathlib import Path
+
+import pandas as pd
+
+# Get the directory of the current script
+current_dir = Path(__file__).parent.resolve()
+
+# Add the parent directory to sys.path
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+
+# What a process pays to import the evaluator, with the evaluation libraries
+# imported on first use and, as before, up front
+IMPORTS = {
+    "eval_imports, lazy": "import evaluator.eval_imports as m",
+    "eval_imports, eager": "import evaluator.eval_imports as m; m.load_namespace(m.import_namespace)",
+    "eval_code, lazy": "import evaluator.eval_code as m",
+    "eval_code, eager": "import evaluator.eval_code; import evaluator.eval_imports as m; m.load_namespace(m.import_namespace)",
+}
+
+TIMED = """
+import time, warnings
+warnings.filterwarnings("ignore")
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start)
+"""
+
+
+def run_python(code: str, *flags) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        cwd=parent_dir,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def cold_import_seconds(statement: str, repeat: int) -> float:
+    """Median time of statement in a fresh interpreter"""
+    times = [
+        float(run_python(TIMED.format(statement=statement)).stdout.split()[-1])
+        for _ in range(repeat)
+    ]
+    return statistics.median(times)
+
+
+FIRST_USE = """
+import time, warnings
+warnings.filterwarnings("ignore")
+import evaluator.eval_code
+import evaluator.eval_imports as m
+from evaluator.eval_imports import LazyAttribute, LazyModule, resolve
+for name, value in m.import_namespace.items():
+    if isinstance(value, (LazyModule, LazyAttribute)):
+        start = time.perf_counter()
+        resolve(value)
+        print(name, time.perf_counter() - start)
+"""
+
+
+def first_use_seconds() -> pd.DataFrame:
+    """
+    Time the first use of each lazy name takes once the evaluator is
+    imported, in namespace order, so libraries shared by several names are
+    counted for the first of them.
+    """
+    lines = run_python(FIRST_USE).stdout.splitlines()
+    rows = [
+        {"name": name, "ms": float(seconds) * 1e3}
+        for name, seconds in map(str.split, lines)
+    ]
+    return pd.DataFrame(rows)
+
+
+def run_profile(repeat: int = 7):
+    rows = [
+        {"import": name, "seconds": cold_import_seconds(statement, repeat)}
+        for name, statement in IMPORTS.items()
+    ]
+    report = pd.DataFrame(rows)
+    print(report.to_markdown(index=False, floatfmt=".3f"))
+    for module in ["eval_imports", "eval_code"]:
+        lazy, eager = (
+            report.set_index("import").seconds[f"{module}, {mode}"]
+            for mode in ["lazy", "eager"]
+        )
+        print(
+            f"Cold start of {module} saved: {eager - lazy:.3f} s ({1 - lazy / eager:.0%})"
+        )
+    print("\nFirst use of each lazy name")
+    print(first_use_seconds().to_markdown(index=False, floatfmt=".1f"))
+
+
+if __name__ == "__main__":
+    run_profile()
@@ -0,0 +1,68 @@
+import os
+import sys
+import glob
+import gzip
+import warnings
+import _pickle as cPickle
+from pathlib import Path
+
+import pandas as pd
+
+warnings.filterwarnings("ignore")
+
+# Get the directory of the current script
+current_dir = Path(__file__).parent.resolve()
+
+# Add the parent directory to sys.path
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+from gtfs_agent.gtfs_loader import apply_compact_dtypes
+from gtfs_agent.feed_store import feed_tables
+
+
+def table_memory_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(index=True, deep=True).sum() / 2**20
+
+
+def feed_memory_report(pickle_path: str) -> pd.DataFrame:
+    """
+    Memory of every table of a pickled feed before and after compact dtypes.
+
+    Args:
+        pickle_path (str): Path to a gzipped GTFSLoader pickle
+
+    Returns:
+        pd.DataFrame: One row per table with the memory in MiB before and after
+    """
+    with gzip.open(pickle_path, "rb") as f:
+        loader = cPickle.load(f)
+    rows = []
+    for name, df in feed_tables(loader.feed).items():
+        before = table_memory_mb(df)
+        after = table_memory_mb(apply_compact_dtypes(df.copy(), f"{name}.txt"))
+        rows.append({"table": name, "before_mb": before, "after_mb": after})
+    return pd.DataFrame(rows)
+
+
+def run_report(pickle_directory: str):
+    totals = []
+    for pickle_path in sorted(glob.glob(os.path.join(pickle_directory, "*.pkl"))):
+        feed = os.path.basename(pickle_path).replace("_gtfs_loader.pkl", "")
+        report = feed_memory_report(pickle_path)
+        print(f"\n{feed}")
+        print(report.to_markdown(index=False, floatfmt=".2f"))
+        totals.append(
+            {
+                "feed": feed,
+                "before_mb": report.before_mb.sum(),
+                "after_mb": report.after_mb.sum(),
+            }
+        )
+    totals = pd.DataFrame(totals)
+    totals["saved"] = 1 - totals.after_mb / totals.before_mb
+    print("\nTotal")
+    print(totals.to_markdown(index=False, floatfmt=".2f"))
+
+
+if __name__ == "__main__":
+    run_report(os.path.join(parent_dir, "gtfs_data", "feed_pickles"))